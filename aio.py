@@ -0,0 +1,192 @@
+import threading
+import weakref
+import asyncio
+
+import backup
+from utils import lazy_import
+
+concurrent_futures = lazy_import("concurrent.futures")
+typing = lazy_import("typing")
+
+
+MAX_CONCURRENCY = 4  # how many calls run at the same time by default, further calls wait for their turn
+
+_executor = None  # the executor every call runs on, created when first used if not configured
+_own_executor = None  # the executor created when first used, which is shut down once it's replaced
+_max_concurrency = MAX_CONCURRENCY
+_semaphores = weakref.WeakKeyDictionary()  # the semaphore limiting the calls made from each event loop
+_lock = threading.Lock()
+
+
+def configure(executor: "concurrent_futures.Executor | None" = None, max_concurrency: int = MAX_CONCURRENCY) -> None:
+    """Set where and how many calls run at the same time.
+
+    Parameters
+    ----------
+    executor: Executor, None, optional
+        The executor every call runs on, by default a thread pool with `max_concurrency` threads.
+        Since diffing is mostly pure Python, a `ProcessPoolExecutor` lets backups of different files use more than one core.
+
+    max_concurrency: int, optional
+        How many calls run at the same time (for each event loop), further calls wait for their turn without using the executor.
+
+    The thread pool created by default is shut down once replaced (letting the calls already running on it finish), while given executors are left for the caller to shut down.
+    """
+    global _executor, _own_executor, _max_concurrency
+    with _lock:
+        own_executor = _own_executor
+        _executor = executor
+        _own_executor = None
+        _max_concurrency = max_concurrency
+        _semaphores.clear()
+
+    if own_executor is not None:
+        own_executor.shutdown(wait=False)
+
+
+async def acreate_global_backup(file_path: str, message: str = "", mode: str | None = None) -> None:
+    """Asynchronous version of `backup.create_global_backup`."""
+    return await _run("create_global_backup", file_path, message, mode)
+
+
+async def arestore_global_backup(backup_index: int, timestamp: int, unsaved_changes_ok: bool = False) -> None:
+    """Asynchronous version of `backup.restore_global_backup`."""
+    return await _run("restore_global_backup", backup_index, timestamp, unsaved_changes_ok)
+
+
+async def acat_global_backup(backup_index: int, timestamp: int, output: str) -> None:
+    """Asynchronous version of `backup.cat_global_backup`, which only writes to paths (use `aiter_global_backup` to get the content instead)."""
+    return await _run("cat_global_backup", backup_index, timestamp, output)
+
+
+async def adiff_global_backup(backup_index: int, old_timestamp: int, new_timestamp: int, output: str, mode: str | None = None, context: int = backup.DIFF_CONTEXT_LINES) -> None:
+    """Asynchronous version of `backup.diff_global_backup`, which only writes to paths."""
+    return await _run("diff_global_backup", backup_index, old_timestamp, new_timestamp, output, mode, context)
+
+
+async def aread_backup_range(backup_index: int, timestamp: int, offset: int, length: int | None = None) -> bytes:
+    """Asynchronous version of `backup.read_backup_range`."""
+    return await _run("read_backup_range", backup_index, timestamp, offset, length)
+
+
+async def alist_tracked_files() -> list[dict]:
+    """Asynchronous version of `backup.list_tracked_files`."""
+    return await _run("list_tracked_files")
+
+
+async def alist_file_backups(backup_index: int, reverse: bool = False) -> list[int]:
+    """Asynchronous version of `backup.list_file_backups`."""
+    return await _run("list_file_backups", backup_index, reverse)
+
+
+async def aget_backup_message(backup_index: int, timestamp: int) -> str:
+    """Asynchronous version of `backup.get_backup_message`."""
+    return await _run("get_backup_message", backup_index, timestamp)
+
+
+async def acreate_backup_message(backup_index: int, timestamp: int, message: str) -> None:
+    """Asynchronous version of `backup.create_backup_message`."""
+    return await _run("create_backup_message", backup_index, timestamp, message)
+
+
+async def arepack_global_backups(backup_index: int, keyframe_interval: int = backup.KEYFRAME_INTERVAL) -> dict:
+    """Asynchronous version of `backup.repack_global_backups`."""
+    return await _run("repack_global_backups", backup_index, keyframe_interval)
+
+
+async def aprune_global_backups(backup_index: int, keep_last: int = 1, hourly: int = 0, daily: int = 0, weekly: int = 0, dry_run: bool = False, verify: bool = True) -> list[int]:
+    """Asynchronous version of `backup.prune_global_backups`."""
+    return await _run("prune_global_backups", backup_index, keep_last, hourly, daily, weekly, dry_run, verify)
+
+
+async def averify_global_backups(backup_index: int, sample: int | None = None) -> dict:
+    """Asynchronous version of `backup.verify_global_backups`."""
+    return await _run("verify_global_backups", backup_index, sample)
+
+
+async def aget_backup_stats(backup_index: int) -> dict:
+    """Asynchronous version of `backup.get_backup_stats`."""
+    return await _run("get_backup_stats", backup_index)
+
+
+async def aiter_global_backup(backup_index: int, timestamp: int, block_size: int | None = None) -> "typing.AsyncIterator[bytes]":
+    """Asynchronous version of `backup.iter_global_backup`.
+
+    Each block is read on a thread of the event loop's default executor (generators can't be sent to other processes), and breaking out of the loop or cancelling it stops reading right after the current block.
+    The iteration counts as a single call towards the concurrency limit until it's done.
+    """
+    loop = asyncio.get_running_loop()
+    repository = backup.get_repository()
+    iterator = backup.iter_global_backup(backup_index, timestamp, block_size)
+    step = None
+
+    def read_block() -> bytes | None:
+        with repository.activate():
+            return next(iterator, None)
+
+    semaphore = _get_semaphore(loop)
+    async with semaphore:
+        try:
+            while True:
+                step = loop.run_in_executor(None, read_block)
+                block = await step
+                if block is None:
+                    break
+                yield block
+        finally:
+            # the generator can only be closed once it's not running anymore
+            if step is not None and not step.done():
+                step.add_done_callback(lambda _: iterator.close())
+            else:
+                iterator.close()
+
+
+async def _run(function_name: str, *args):
+    """Call a function of `backup` on the executor, waiting for a free slot first.
+
+    Cancelling a call that's still waiting for its turn means it never runs.
+    A call that's already running can't be stopped halfway without leaving the backups of the file inconsistent, so it keeps running in the background (holding its slot) even though the caller gets `CancelledError` right away.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _get_semaphore(loop)
+    await semaphore.acquire()
+    try:
+        future = _get_executor().submit(_call, backup.get_repository(), function_name, args)
+    except BaseException:
+        semaphore.release()
+        raise
+
+    # release the slot once the call is actually done, not when the caller stops waiting for it
+    future.add_done_callback(lambda _: _release(loop, semaphore))
+    return await asyncio.wrap_future(future, loop=loop)
+
+
+def _call(repository: "backup.Repository", function_name: str, args: tuple):
+    """Call a function of `backup` from the executor, using the same repository as the caller, even from another process."""
+    with repository.activate():
+        return getattr(backup, function_name)(*args)
+
+
+def _get_executor() -> "concurrent_futures.Executor":
+    global _executor, _own_executor
+    with _lock:
+        if _executor is None:
+            _executor = _own_executor = concurrent_futures.ThreadPoolExecutor(max_workers=_max_concurrency, thread_name_prefix="backup")
+
+        return _executor
+
+
+def _get_semaphore(loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+    with _lock:
+        if loop not in _semaphores:
+            _semaphores[loop] = asyncio.Semaphore(_max_concurrency)
+
+        return _semaphores[loop]
+
+
+def _release(loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore) -> None:
+    """Release a slot from the thread that finished a call."""
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        pass  # the event loop is already closed
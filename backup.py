@@ -1,34 +1,157 @@
+from array import array
+import contextvars
+import contextlib
 import threading
-import argparse
-import tempfile
-import zipfile
-import hashlib
-import shutil
+import codecs
+import bisect
 import enum
 import time
+import sys
 import io
 import os
 
-from platformdirs import user_data_dir
+from collections.abc import Iterable, Iterator, Sequence
+
+from utils import FileLock, JSONManager, Journal, date_from_ms, get_file_key, lazy_import, profiler
+
+# modules that are slow to import are only loaded when first used, which keeps the startup of the command line fast
+concurrent_futures = lazy_import("concurrent.futures")
+argparse = lazy_import("argparse")
+typing = lazy_import("typing")
+json = lazy_import("json")
+tempfile = lazy_import("tempfile")
+cProfile = lazy_import("cProfile")
+zipfile = lazy_import("zipfile")
+hashlib = lazy_import("hashlib")
+shutil = lazy_import("shutil")
+random = lazy_import("random")
+mmap = lazy_import("mmap")
+tarfile = lazy_import("tarfile")
+storage = lazy_import("storage")
+
+
+# the paths used by global backups are only resolved when first used (see `_get_path`), so importing this module doesn't touch the file system:
+# USER_DATA_DIR, DEFAULT_BACKUP_DATA_DIR, NEW_DIR_FILE_PATH, MIGRATION_FILE_PATH, BACKUP_DATA_DIR, TRACKED_FILES_LIST_PATH, CONFIG_FILE_PATH and SERVER_SOCKET_PATH
+# BACKUP_DATA_DIR and TRACKED_FILES_LIST_PATH come from the repository activated in the current context instead, if any (see `Repository.activate`)
+_repository = contextvars.ContextVar("repository", default=None)
+_repositories = {}  # the repository of every backup directory used without activating one, see `get_repository`
+_journals = {}  # the journal of every backup directory, see `_get_journal`
+_journals_lock = threading.Lock()
+
+# settings for the line-aware diff used on text files
+DIFF_MODES = ("auto", "text", "binary")
+TEXT_DIFF_MAX_SIZE = 64 * 1024 * 1024  # larger files always use the byte diff when on "auto" mode
+TEXT_DIFF_MAX_LINE_EDITS = 20000  # the line diff falls back to the byte diff after this many lines added or removed
+TEXT_DIFF_MAX_REFINE_SIZE = 16384  # changed sections larger than this are replaced as a whole instead of refined
+TEXT_DIFF_MAX_REFINE_EDITS = 512  # changed sections with more byte edits than this are replaced as a whole
+TEXT_SAMPLE_SIZE = 8192  # how many bytes from the start of a file are checked to tell if it's text (see `is_text_file`)
+
+# settings for showing the differences between versions (see `iter_global_diff`)
+DIFF_CONTEXT_LINES = 3  # how many unchanged lines are shown around each change on text diffs
+
+# settings for choosing the base of new global backups
+BASE_CANDIDATES = 4  # how many of the last versions are considered as base for a new backup
+SIGNATURE_MAX_CHUNK = 4096  # the maximum size of a chunk on the signature of a file
+KEYFRAME_INTERVAL = 50  # the maximum chain length kept by repack before storing a full copy of a version
+
+# settings for migrating backups to another directory
+MIGRATE_WORKERS = 8  # how many files are copied at the same time when the new directory is on another file system
+MIGRATE_CHECKPOINT_INTERVAL = 1.0  # how often the files already copied are saved, so an interrupted migration doesn't copy them again (in seconds)
+COPY_CHUNK_SIZE = 1024 * 1024 * 1024  # the most bytes copied by a single call to `os.copy_file_range`
+
+# settings for packing the backups of a tracked file together (see `pack_global_backups`)
+PACK_THRESHOLD = 64  # how many loose backups a tracked file can have before they're packed automatically
+PACK_INDEX_ENTRY = 3  # how many numbers each backup takes on the index of a pack: its timestamp, offset and size
+
+# settings for exporting the backups of a tracked file as a bundle (see `export_global_backups`)
+BUNDLE_FORMAT = 1  # the version of the format of bundles, bundles with a newer format can't be imported
+BUNDLE_MANIFEST = "manifest.json"  # the first member of a bundle, describing the tracked file
+BUNDLE_CHECKSUMS = "sha256sums.json"  # the last member of a bundle, with the checksum of every other member
+BUNDLE_METADATA = ("bases.json", "checksums.json", "messages.json", "stats.json", "timestamp")  # the metadata files of a backup folder, in the order they're bundled
+
+# settings for the journal of metadata changes (see `_append_journal`)
+JOURNAL_MAX_SIZE = 1024 * 1024  # the journal is compacted into the metadata files once it gets larger than this (in bytes)
+JOURNAL_FIELDS = {"bases.json": "base", "checksums.json": "checksum", "messages.json": "message", "stats.json": "stats"}  # the field of the records on the journal saved to each metadata file
+
+# settings for caching metadata in memory
+LISTING_CACHE_DELAY = 1_000_000_000  # how long a directory must go without changes before its listing is cached (in nanoseconds)
+
+# settings tuned for the local machine by `tune_settings` and read by every operation through `get_settings`
+DEFAULT_SETTINGS = {
+    "apply_workers": 20,  # how many threads apply changes at the same time
+    "apply_group_size": 255,  # how many changes each of those threads applies
+    "read_block_size": 1024 * 1024,  # how many bytes are read at once when streaming or hashing files
+    "compression": "lzma",  # the compression method of new backups, one of `COMPRESSION_METHODS`
+    "compresslevel": None,  # the preset of the compression method, None uses its default
+    "journal_fsync": "always",  # "always" syncs every change to disk before returning (sharing syncs between changes made at the same time), "never" leaves it to the OS
+}
+COMPRESSION_METHODS = {"stored": 0, "deflate": 8, "bzip2": 12, "lzma": 14}  # the values of the zipfile compression constants
+TUNE_SAMPLE_SIZE = 2 * 1024 * 1024  # the size of the sample file used by `tune_settings`
+TUNE_MAX_COMPRESSION_SLOWDOWN = 4  # how many times slower than the fastest one a compression preset can be to still be chosen for its size
+_settings = None
+
+
+def _get_path(name: str) -> str:
+    """Get one of the paths used by global backups, resolving it the first time it's needed unless it was already set (e.g. by tests).
+
+    The directory of the backups is created when first resolved.
+    """
+    if name in ("BACKUP_DATA_DIR", "TRACKED_FILES_LIST_PATH"):
+        repository = _repository.get()
+        if repository is not None:
+            return repository.root if name == "BACKUP_DATA_DIR" else repository.tracked_files_list_path
+
+    paths = globals()
+    if name in paths:
+        return paths[name]
+
+    match name:
+        case "USER_DATA_DIR":
+            from platformdirs import user_data_dir
+
+            path = user_data_dir("BackTrack", "Huuuuuugo", ensure_exists=True)
+        case "DEFAULT_BACKUP_DATA_DIR":
+            path = os.path.join(_get_path("USER_DATA_DIR"), "backups")
+        case "NEW_DIR_FILE_PATH":
+            path = os.path.join(_get_path("USER_DATA_DIR"), "new_dir.txt")
+        case "MIGRATION_FILE_PATH":
+            path = os.path.join(_get_path("USER_DATA_DIR"), "migration.json")
+        case "CONFIG_FILE_PATH":
+            path = os.path.join(_get_path("USER_DATA_DIR"), "config.json")
+        case "SERVER_SOCKET_PATH":
+            path = os.path.join(_get_path("USER_DATA_DIR"), "server.sock")
+        case "BACKUP_DATA_DIR":
+            # the backups can't be used while they're being migrated, since they may be only half copied
+            if os.path.exists(_get_path("MIGRATION_FILE_PATH")):
+                target = JSONManager(_get_path("MIGRATION_FILE_PATH"), {}).read()["target"]
+                raise BackupExceptions.MigrationInProgressError(f"The backups are being migrated to '{target}', if the migration was interrupted run 'bak migrate {target}' to finish it.")
+
+            # use the directory the backups were migrated to, if any
+            path = _get_path("DEFAULT_BACKUP_DATA_DIR")
+            if os.path.exists(_get_path("NEW_DIR_FILE_PATH")):
+                with open(_get_path("NEW_DIR_FILE_PATH"), "r", encoding="utf8") as new_dir_file:
+                    path = new_dir_file.read()
+            os.makedirs(path, exist_ok=True)
+        case "TRACKED_FILES_LIST_PATH":
+            path = os.path.realpath(os.path.join(_get_path("BACKUP_DATA_DIR"), "tracked.json"))
+        case _:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-from utils import JSONManager, date_from_ms, get_tracked_path, timestamp_exists
+    paths[name] = path
+    return path
 
 
-# set up global variables
-USER_DATA_DIR = user_data_dir("BackTrack", "Huuuuuugo", ensure_exists=True)
-DEFAULT_BACKUP_DATA_DIR = os.path.join(USER_DATA_DIR, "backups")
+def __getattr__(name: str) -> str:
+    # resolve the paths used by global backups when they're accessed from outside this module
+    return _get_path(name)
 
-# get backup data dir
-NEW_DIR_FILE_PATH = os.path.join(USER_DATA_DIR, "new_dir.txt")
-if "new_dir.txt" in os.listdir(USER_DATA_DIR):
-    with open(NEW_DIR_FILE_PATH, "r", encoding="utf8") as new_dir_file:
-        BACKUP_DATA_DIR = new_dir_file.read()
-        os.makedirs(BACKUP_DATA_DIR, exist_ok=True)
-else:
-    BACKUP_DATA_DIR = DEFAULT_BACKUP_DATA_DIR
-    os.makedirs(BACKUP_DATA_DIR, exist_ok=True)
 
-TRACKED_FILES_LIST_PATH = os.path.realpath(os.path.join(BACKUP_DATA_DIR, "tracked.json"))
+def _get_metadata_cache() -> dict:
+    """Get the cache of metadata of the repository used in the current context (see `get_repository`).
+
+    It keeps parsed json files (see `JSONManager`) by their path, the list of backups of each tracked file by the path of its "changes" directory (see `_list_backups`) and the index of tracked files (see `_get_tracked_index`).
+    """
+    return get_repository().metadata_cache
 
 
 # class to group all custom exceptions together
@@ -45,12 +168,23 @@ class BackupExceptions:
     class TimestampNotFound(Exception):
         """Indicates that no backup with the given timestamp exist"""
 
+    class CorruptedBackupError(Exception):
+        """Indicates that a backup doesn't match its checksum"""
+
+    class MigrationInProgressError(Exception):
+        """Indicates that the backups are being migrated to another directory, or that a migration was interrupted"""
+
+    class FileAlreadyTrackedError(Exception):
+        """Indicates that the file whose backups are being imported is already tracked"""
+
 
 class Change:
     class ChangeTypes(enum.Enum):
         ADD = 0
         RMV = 1
 
+    __slots__ = ("type", "position", "content")
+
     def __init__(self, type: ChangeTypes, position: int = 0, content: bytes = b""):
         self.type = type
         self.position = position
@@ -61,13 +195,89 @@ class Change:
         return len(self.content)
 
     def __str__(self):
-        return f"<type: {Change.ChangeTypes(self.type).name} | position: {self.position} | content: {self.content}>"
+        return f"<type: {Change.ChangeTypes(self.type).name} | position: {self.position} | content: {bytes(self.content)}>"
+
+
+class ChangeSet:
+    """A compact list of changes stored as parallel arrays backed by a single payload buffer.
+
+    Instead of keeping a `Change` object (and a separate bytes object) for every change, the type, position and size of each change are stored on typed arrays and the content of all changes is stored one right after the other on a single contiguous payload, addressed by offset.
+    Indexing a change set returns a `Change` whose content is a memoryview over the payload, so changes can be read back without copying their content.
+
+    Slicing a change set returns a new change set that shares the same payload.
+    """
+
+    __slots__ = ("types", "positions", "sizes", "offsets", "payload")
+
+    def __init__(self, types: array | None = None, positions: array | None = None, sizes: array | None = None, payload: bytes | bytearray | None = None, offsets: array | None = None):
+        self.types = array("b") if types is None else types
+        self.positions = array("q") if positions is None else positions
+        self.sizes = array("q") if sizes is None else sizes
+        self.payload = bytearray() if payload is None else payload
+
+        # calculate the offset of each change on the payload if they weren't given
+        if offsets is None:
+            offsets = array("q")
+            offset = 0
+            for size in self.sizes:
+                offsets.append(offset)
+                offset += size
+        self.offsets = offsets
+
+    @classmethod
+    def from_changes(cls, changes) -> "ChangeSet":
+        """Create a change set from any iterable of `Change` objects."""
+        change_set = cls()
+        for change in changes:
+            change_set.append(change.type, change.position, change.content)
+
+        return change_set
+
+    def append(self, type: int, position: int, content: bytes) -> None:
+        """Append a change to the end of the set, copying its content to the payload."""
+        self.types.append(type)
+        self.positions.append(position)
+        self.sizes.append(len(content))
+        self.offsets.append(len(self.payload))
+        self.payload += content
+
+    def content(self, index: int) -> memoryview:
+        """Get a view of the content of the change at the given index without copying it."""
+        offset = self.offsets[index]
+        return memoryview(self.payload)[offset : offset + self.sizes[index]]
+
+    def end(self, index: int) -> int:
+        """Get the position on the original file right after the change at the given index."""
+        if self.types[index] == types.RMV.value:
+            return self.positions[index] + self.sizes[index]
+
+        return self.positions[index]
+
+    def payload_view(self) -> memoryview:
+        """Get a view of the section of the payload used by the changes on this set."""
+        if not self.sizes:
+            return memoryview(b"")
+
+        return memoryview(self.payload)[self.offsets[0] : self.offsets[-1] + self.sizes[-1]]
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return ChangeSet(self.types[index], self.positions[index], self.sizes[index], self.payload, self.offsets[index])
+
+        return Change(self.types[index], self.positions[index], self.content(index))
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
 
 
 types = Change.ChangeTypes
 
 
-def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
+def get_changes(old_file_path: str, new_file_path: str) -> ChangeSet:
     """Get a complete list of all the diferent sections between two files.
 
     This function cyles through every byte of both files in search of sections where they differ and then lables those sections as addition or deletion.
@@ -84,8 +294,8 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
 
     Returns
     -------
-    list[Change]
-        A list containing every difference between the two files in the form of Change objects.
+    ChangeSet
+        A change set containing every difference between the two files.
     """
     with open(old_file_path, "rb") as old_file:
         with open(new_file_path, "rb") as new_file:
@@ -95,7 +305,14 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
             old_file_pos = 0
             old_byte = 1
             new_byte = 1
-            changes = []
+            changes = ChangeSet()
+            pending = []  # the last changes found, kept as objects while they can still be merged with the next ones
+
+            # move the changes that can no longer be merged from pending to the change set
+            def flush_pending(keep: int) -> None:
+                while len(pending) > keep:
+                    change = pending.pop(0)
+                    changes.append(change.type, change.position, change.content)
 
             # cycle through each byte on both files simultaneously untill any of them
             # reaches its end
@@ -112,8 +329,8 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
                     old_pos_offset = 0
                     new_pos_offset = 0
                     change_type = ""
-                    add = Change(types.ADD.value, 0, new_byte)
-                    rmv = Change(types.RMV.value, 0, old_byte)
+                    add = Change(types.ADD.value, 0, bytearray(new_byte))
+                    rmv = Change(types.RMV.value, 0, bytearray(old_byte))
                     rmv_break = False
                     add_break = False
 
@@ -204,11 +421,11 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
 
                             if same_change_flag and (prev_change_type in (change_type, "both")):
                                 if prev_change_type == "both":
-                                    changes[-2].content += add.content
+                                    pending[-2].content += add.content
                                 else:
-                                    changes[-1].content += add.content
+                                    pending[-1].content += add.content
                             else:
-                                changes.append(add)  # save change
+                                pending.append(add)  # save change
 
                         case types.RMV.value:
                             old_file_pos += old_pos_offset
@@ -216,9 +433,9 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
                             old_file.seek(old_file_pos)  # move to the end of the byte chain
 
                             if same_change_flag and (prev_change_type in (change_type, "both")):
-                                changes[-1].content += rmv.content
+                                pending[-1].content += rmv.content
                             else:
-                                changes.append(rmv)  # save change
+                                pending.append(rmv)  # save change
 
                         case "both":
                             temp_same_change_flag = True
@@ -233,16 +450,21 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
                             add.content += next_new_byte
                             rmv.content += next_old_byte
 
-                            changes.append(add)  # save changes
-                            changes.append(rmv)  # save changes
+                            pending.append(add)  # save changes
+                            pending.append(rmv)  # save changes
 
                     same_change_flag = temp_same_change_flag
                     prev_change_type = change_type
 
+                    # only the last two changes can still be merged
+                    flush_pending(2)
+
                 elif same_change_flag:
                     same_change_flag = False  # update the flag if the changes loop didn't trigger on the first iteration
                     prev_change_type = ""
 
+            flush_pending(0)
+
             # get all the content that was left on any of the files
             remaining_old_bytes = old_file.read()
             remaining_new_bytes = new_file.read()
@@ -250,14 +472,332 @@ def get_changes(old_file_path: str, new_file_path: str) -> list[Change]:
             # save the remaining content to the list of changes accordingly
             # TODO: make it append to the last change when appropriate
             if remaining_old_bytes:
-                changes.append(Change(types.RMV.value, old_file_pos, remaining_old_bytes))
+                changes.append(types.RMV.value, old_file_pos, remaining_old_bytes)
             elif remaining_new_bytes:
-                changes.append(Change(types.ADD.value, old_file_pos, remaining_new_bytes))
+                changes.append(types.ADD.value, old_file_pos, remaining_new_bytes)
+
+    return changes
+
+
+def is_text_file(file_path: str) -> bool:
+    """Check if a file looks like text by testing if its first few kilobytes are valid UTF-8 without any null bytes."""
+    with open(file_path, "rb") as file:
+        return _is_text_sample(file.read(TEXT_SAMPLE_SIZE))
+
+
+def _is_text_sample(sample: bytes) -> bool:
+    """Check if the start of a file looks like text, see `is_text_file`."""
+    if b"\0" in sample:
+        return False
+
+    # the sample may end in the middle of a multibyte character, so the decoder is never finalized
+    try:
+        codecs.getincrementaldecoder("utf8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
+
+def myers_diff(old_seq: Sequence, new_seq: Sequence, max_cost: int) -> list[tuple[int, int, int]] | None:
+    """Get the matching blocks between two sequences using the Myers diff algorithm.
+
+    The Myers algorithm finds the shortest sequence of insertions and deletions that turns one sequence into the other by exploring every diagonal of the edit graph one edit at a time.
+    Its running time is proportional to the size of the sequences times the amount of edits, which makes it very fast for similar sequences.
+
+    Parameters
+    ----------
+    old_seq: Sequence
+        The sequence used as base for the comparison.
+
+    new_seq: Sequence
+        The sequence being compared to the old sequence.
+
+    max_cost: int
+        The maximum amount of insertions and deletions to look for before giving up.
+
+    Returns
+    -------
+    list[tuple[int, int, int]], None
+        A list of matching blocks ordered by position, each one composed of the position on the old sequence, the position on the new sequence and the size of the block.
+        None is returned if the sequences differ by more than `max_cost` edits.
+    """
+    old_size = len(old_seq)
+    new_size = len(new_seq)
+    max_cost = min(max_cost, old_size + new_size)
+
+    # v stores the furthest x position reached on each diagonal k (where k = x - y)
+    # and trace stores the relevant portion of v before each step for backtracking
+    offset = max_cost + 1
+    v = [0] * (2 * max_cost + 3)
+    trace = []
+    for cost in range(max_cost + 1):
+        trace.append(v[offset - cost - 1 : offset + cost + 2])
+        for k in range(-cost, cost + 1, 2):
+            # move down (insertion) or right (deletion) from the best neighbouring diagonal
+            if k == -cost or (k != cost and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+
+            # follow the diagonal while the elements match
+            while x < old_size and y < new_size and old_seq[x] == new_seq[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+
+            if x >= old_size and y >= new_size:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+
+    # walk the trace backwards collecting every diagonal run as a matching block
+    blocks = []
+    x = old_size
+    y = new_size
+    for cost in range(len(trace) - 1, -1, -1):
+        snapshot = trace[cost]
+        k = x - y
+        if k == -cost or (k != cost and snapshot[k - 1 + cost + 1] < snapshot[k + 1 + cost + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = max(snapshot[prev_k + cost + 1], 0)
+        prev_y = prev_x - prev_k
+
+        # get the end of the previous edit, from where the current diagonal run starts
+        if cost == 0:
+            start_x = 0
+        elif prev_k == k + 1:
+            start_x = prev_x
+        else:
+            start_x = prev_x + 1
+        if x > start_x:
+            blocks.append((start_x, start_x - k, x - start_x))
+
+        x = prev_x
+        y = prev_y
+
+    blocks.reverse()
+    return blocks
+
+
+def get_line_changes(old_file_path: str, new_file_path: str) -> ChangeSet:
+    """Get a complete list of all the diferent sections between two text files using a line-aware diff.
+
+    This function splits both files into lines and replaces every line with a numeric id so that the Myers algorithm (see `myers_diff`) can align them cheaply.
+    Every section of lines that changed is then refined with a byte level Myers diff, so small edits inside long lines still result in small changes.
+    The result uses the exact same position-based changes returned by `get_changes` and can be stored and applied the same way.
+
+    If the files are too different for the line diff to be worth it, this function falls back to `get_changes`.
+
+    Parameters
+    ----------
+    old_file_path: str
+        The path to the file that will be used as base for getting the differences.
+
+    new_file_path: str
+        The path of the file that'll be compared to the old file.
+
+    Returns
+    -------
+    ChangeSet
+        A change set containing every difference between the two files.
+    """
+    with open(old_file_path, "rb") as old_file:
+        old_data = old_file.read()
+    with open(new_file_path, "rb") as new_file:
+        new_data = new_file.read()
+
+    old_lines = old_data.splitlines(keepends=True)
+    new_lines = new_data.splitlines(keepends=True)
+
+    # replace each line by an id, so lines are compared as integers instead of bytes
+    line_ids = {}
+    old_ids = [line_ids.setdefault(line, len(line_ids)) for line in old_lines]
+    new_ids = [line_ids.setdefault(line, len(line_ids)) for line in new_lines]
+
+    # skip the lines both files have in common on their beginning and ending
+    prefix = 0
+    while prefix < len(old_ids) and prefix < len(new_ids) and old_ids[prefix] == new_ids[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(old_ids) - prefix and suffix < len(new_ids) - prefix and old_ids[-suffix - 1] == new_ids[-suffix - 1]:
+        suffix += 1
+
+    blocks = myers_diff(old_ids[prefix : len(old_ids) - suffix], new_ids[prefix : len(new_ids) - suffix], TEXT_DIFF_MAX_LINE_EDITS)
+    if blocks is None:
+        return get_changes(old_file_path, new_file_path)
+
+    # get the byte position where every line starts on both files
+    old_starts = [0]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    new_starts = [0]
+    for line in new_lines:
+        new_starts.append(new_starts[-1] + len(line))
+
+    # add the common beginning and ending back as matching blocks, including an empty block at the very end
+    blocks = [(0, 0, prefix)] + [(old + prefix, new + prefix, size) for old, new, size in blocks]
+    blocks.append((len(old_lines) - suffix, len(new_lines) - suffix, suffix))
+
+    changes = ChangeSet()
+    old_line = 0
+    new_line = 0
+    for old_block, new_block, size in blocks:
+        # refine the lines in between the matching blocks
+        if old_block > old_line or new_block > new_line:
+            old_pos = old_starts[old_line]
+            new_pos = new_starts[new_line]
+            old_section = old_data[old_pos : old_starts[old_block]]
+            new_section = new_data[new_pos : new_starts[new_block]]
+            _append_refined_changes(changes, old_pos, old_section, new_section)
+
+        old_line = old_block + size
+        new_line = new_block + size
+
+    return changes
+
+
+def _append_refined_changes(changes: ChangeSet, position: int, old_section: bytes, new_section: bytes) -> None:
+    """Append the changes needed to turn a section of the old file into a section of the new file, using a byte level diff when the sections are small enough."""
+    blocks = None
+    if old_section and new_section and len(old_section) + len(new_section) <= TEXT_DIFF_MAX_REFINE_SIZE:
+        blocks = myers_diff(old_section, new_section, TEXT_DIFF_MAX_REFINE_EDITS)
+
+    # replace the whole section if it can't be refined
+    if blocks is None:
+        blocks = []
+    blocks.append((len(old_section), len(new_section), 0))
+
+    old_pos = 0
+    new_pos = 0
+    for old_block, new_block, size in blocks:
+        # every gap in between matching blocks becomes an addition followed by a deletion on the same position
+        if new_block > new_pos:
+            changes.append(types.ADD.value, position + old_pos, new_section[new_pos:new_block])
+        if old_block > old_pos:
+            changes.append(types.RMV.value, position + old_pos, old_section[old_pos:old_block])
+
+        old_pos = old_block + size
+        new_pos = new_block + size
+
+
+def get_file_changes(old_file_path: str, new_file_path: str, mode: str = "auto") -> ChangeSet:
+    """Get the changes between two files using the diff best suited for their content.
+
+    Parameters
+    ----------
+    old_file_path: str
+        The path to the file that will be used as base for getting the differences.
+
+    new_file_path: str
+        The path of the file that'll be compared to the old file.
+
+    mode: str, optional
+        One of the `DIFF_MODES`:
+            "text": always use the line-aware diff from `get_line_changes`;
+            "binary": always use the byte diff from `get_changes`;
+            "auto": use the line-aware diff if both files look like text (see `is_text_file`) and aren't larger than `TEXT_DIFF_MAX_SIZE`.
+
+    Returns
+    -------
+    ChangeSet
+        A change set containing every difference between the two files.
+    """
+    if mode not in DIFF_MODES:
+        raise ValueError(f"Invalid diff mode '{mode}', expected one of {DIFF_MODES}.")
+
+    with profiler.span("diff") as span:
+        old_size = os.path.getsize(old_file_path)
+        new_size = os.path.getsize(new_file_path)
+        if mode == "auto":
+            mode = "binary"
+            if max(old_size, new_size) <= TEXT_DIFF_MAX_SIZE:
+                if is_text_file(old_file_path) and is_text_file(new_file_path):
+                    mode = "text"
+
+        if mode == "text":
+            changes = get_line_changes(old_file_path, new_file_path)
+        else:
+            changes = get_changes(old_file_path, new_file_path)
+
+        span.set(mode=mode, old_bytes=old_size, new_bytes=new_size, changes=len(changes))
+        profiler.count("diff.bytes", old_size + new_size)
+        profiler.count("diff.changes", len(changes))
 
     return changes
 
 
-def apply_changes(changes: list[Change], file_path: str) -> None:
+def get_signature(file_path: str) -> array:
+    """Get the chunk signature of a file, used to cheaply estimate the size of the changes between two versions of a file.
+
+    The file is split into chunks at every line break (long lines are also split every `SIGNATURE_MAX_CHUNK` bytes) and every chunk is represented by a 64 bit hash followed by its size.
+    Since chunks end on line breaks, an edit only affects the chunks around it, no matter how much the content after it is shifted.
+
+    Parameters
+    ----------
+    file_path: str
+        The path of the file whose signature will be calculated.
+
+    Returns
+    -------
+    array
+        An array of unsigned 64 bit integers containing the hash and size of every chunk, one after the other.
+    """
+    profiler.count("signature.files")
+    signature = array("Q")
+
+    def add_chunk(chunk: bytes) -> None:
+        signature.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "little"))
+        signature.append(len(chunk))
+
+    with open(file_path, "rb") as file:
+        leftover = b""
+        while block := file.read(get_settings()["read_block_size"]):
+            data = leftover + block
+            start = 0
+            while True:
+                # find the end of the current line, limited to the maximum chunk size
+                end = data.find(b"\n", start, start + SIGNATURE_MAX_CHUNK)
+                if end == -1:
+                    # wait for the next block if the line might continue there
+                    if len(data) - start < SIGNATURE_MAX_CHUNK:
+                        break
+                    end = start + SIGNATURE_MAX_CHUNK - 1
+
+                add_chunk(data[start : end + 1])
+                start = end + 1
+
+            leftover = data[start:]
+
+        if leftover:
+            add_chunk(leftover)
+
+    return signature
+
+
+def estimate_changes_size(old_signature: array, new_signature: array) -> int:
+    """Estimate how many bytes the changes between two versions of a file would take using their signatures (see `get_signature`).
+
+    Every chunk that only exists on one of the versions is counted as either an addition or a deletion.
+    """
+    counts = {}
+    sizes = {}
+    for signature, weight in ((new_signature, 1), (old_signature, -1)):
+        for i in range(0, len(signature), 2):
+            chunk_hash = signature[i]
+            counts[chunk_hash] = counts.get(chunk_hash, 0) + weight
+            sizes[chunk_hash] = signature[i + 1]
+
+    return sum(abs(count) * sizes[chunk_hash] for chunk_hash, count in counts.items())
+
+
+def apply_changes(changes: ChangeSet | list[Change], file_path: str) -> None:
     """Apply a list of changes to a file using a fast multithreaded implementation.
 
     This function is used to apply a list of changes created by the `get_changes` function and efectively turn the "old file" into the "new file".
@@ -267,8 +807,8 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
 
     Parameters
     ----------
-    changes: list[Change]
-        A list of changes generated by the `get_changes` function to be applied to a file.
+    changes: ChangeSet, list[Change]
+        A change set generated by the `get_changes` function (or a list of changes) to be applied to a file.
 
     file_path: str
         The path of the file where the changes should be applied.
@@ -277,37 +817,47 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
     -------
     Replaces the file within the given file path with its changed version.
     """
-    timer = time.perf_counter()
+    if not isinstance(changes, ChangeSet):
+        changes = ChangeSet.from_changes(changes)
+
+    # nothing to do for an empty list of changes
+    if not changes:
+        return
+
+    settings = get_settings()
+    with profiler.span("apply", changes=len(changes)):
+        _apply_changes(changes, file_path, settings["apply_group_size"], settings["apply_workers"])
+        profiler.count("apply.changes", len(changes))
+
+
+def _apply_changes(changes: ChangeSet, file_path: str, group_size: int, workers: int) -> None:
+    """Apply a non empty change set to a file, using one thread for every group of `group_size` changes with up to `workers` of them running at once (see `apply_changes`)."""
 
     # apply a set of changes to a buffer containing only a section of the original file
     # TODO: make it work on reverse (newer version to older version)
-    def apply_changes_worker(changes: list[Change], file_path: str, buffer_info: list[io.BytesIO, bool], next_change: Change) -> None:
+    def apply_changes_worker(changes: ChangeSet, file_path: str, buffer_info: list[io.BytesIO, threading.Event], next_change_pos: int) -> None:
         buffer = buffer_info[0]
 
-        # get first and last change
-        first_change = changes[0]
-        last_change = changes[-1]
+        # get position of the first and last change
+        first_change_pos = changes.positions[0]
+        last_change_pos = changes.positions[-1]
+        ending_pos = changes.end(-1)
 
-        # get position of the last change
-        ending_pos = last_change.position
-        if last_change.type == types.RMV.value:
-            ending_pos += last_change.size
-
-        buffer_size = ending_pos - first_change.position
+        buffer_size = ending_pos - first_change_pos
 
         # get the portion of the file where the changes need to be applied
         with open(file_path, "rb") as file:
-            file.seek(first_change.position)
+            file.seek(first_change_pos)
             buffer.write(file.read(buffer_size))
             buffer.seek(0)
 
         # apply changes sequentially
         offset = 0
-        for change in changes:
-            bytes_changed = change.content
-            size = change.size
-            position = change.position - first_change.position + offset
-            change_type = change.type
+        for i in range(len(changes)):
+            bytes_changed = changes.content(i)
+            size = changes.sizes[i]
+            position = changes.positions[i] - first_change_pos + offset
+            change_type = changes.types[i]
 
             match change_type:
                 case types.RMV.value:
@@ -331,26 +881,27 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
                     # move to the position after the added portion
                     buffer.seek(position)
 
-                    # save the new content and everything from there onward
-                    content = bytes_changed + buffer.read()
+                    # save everything from there onward
+                    original_content = buffer.read()
 
-                    # move to the beggining of the removed portion and rewrite the content
+                    # move to the beggining of the added portion and write the new content followed by the original one
                     buffer.seek(position)
-                    buffer.write(content)
+                    buffer.write(bytes_changed)
+                    buffer.write(original_content)
 
         # get the unchanged section in between the last change of the current change set and first one of the next set
-        offset_betwen_changes = next_change.position - last_change.position
+        offset_betwen_changes = next_change_pos - last_change_pos
         unchanged_between = io.BytesIO()
         if offset_betwen_changes > 0:
             with open(file_path, "rb") as file:
-                file.seek(last_change.position)
+                file.seek(last_change_pos)
                 unchanged_between.write(file.read(offset_betwen_changes))
                 unchanged_between.seek(0)
 
                 # remove the portion that would be deleted by the last change
                 # TODO: remember to modify this, since it does not take into account changes of the "both" type and might cause issues when applying changes in reverse
-                if last_change.type == types.RMV.value:
-                    unchanged_between.seek(last_change.size)
+                if changes.types[-1] == types.RMV.value:
+                    unchanged_between.seek(changes.sizes[-1])
 
         # remove leftovers from the operations
         buffer.truncate(buffer_size + offset)
@@ -361,20 +912,17 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
         unchanged_between.close()
 
         # signalize that all necessary changes have been applied
-        buffer_info[1] = True
+        buffer_info[1].set()
 
     # apply the changes made by each worker thread to a temporary file in the correct order
-    def apply_changes_supervisor(buffers_list: list[list[io.BytesIO, bool]], file_path: str, first_change: Change, last_change: Change):
+    def apply_changes_supervisor(buffers_list: list[list[io.BytesIO, threading.Event]], file_path: str, starting_pos: int, ending_pos: int):
         with tempfile.TemporaryDirectory() as temp_dir:
             # get the unchanged portions of the original file
             with open(file_path, "rb") as file:
                 # get unchanged portion on the beginning of the file
-                unchanged_start = file.read(first_change.position)
+                unchanged_start = file.read(starting_pos)
 
                 # get unchanged portion on the ending of the file
-                ending_pos = last_change.position
-                if last_change.type == types.RMV.value:
-                    ending_pos += last_change.size
                 file.seek(ending_pos)
                 unchanged_end = file.read()
 
@@ -389,8 +937,7 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
                     curr_buffer = buffers_list.pop(0)
 
                     # wait for the buffer to be fully written
-                    while not curr_buffer[1]:
-                        time.sleep(0.01)
+                    curr_buffer[1].wait()
 
                     # write the buffer to the original file
                     curr_buffer[0].seek(0)
@@ -403,55 +950,257 @@ def apply_changes(changes: list[Change], file_path: str) -> None:
             # copy to the original file
             shutil.copy(temp_file_path, file_path)
 
-    # split the changes into groups os 255 and set up a thread for each group
+    # split the changes into groups of `group_size` and set up a thread for each group
     # then add them in sequence to a queue
+    # slicing a change set only copies its arrays, the payload is shared between all groups
     buffers_list = []
     thread_queue = []
-    thread_supervisor = threading.Thread(target=apply_changes_supervisor, args=(buffers_list, file_path, changes[0], changes[-1]), daemon=True)
-    while changes:
+    thread_supervisor = threading.Thread(target=apply_changes_supervisor, args=(buffers_list, file_path, changes.positions[0], changes.end(-1)), daemon=True)
+    for group_start in range(0, len(changes), group_size):
         # setup the buffer and change set
-        change_set = changes[0:255]  # take the first 255 changes
+        change_set = changes[group_start : group_start + group_size]  # take the next group of changes
         changes_buffer = io.BytesIO()
-        buffer_info = [changes_buffer, False]  # the first value is the actual buffer and the second indicates if all changes have been applied
+        buffer_info = [changes_buffer, threading.Event()]  # the first value is the actual buffer and the second is set once all changes have been applied
         buffers_list.append(buffer_info)
 
-        # update the list of changes
-        changes = changes[255:]
-
-        # get the change that comes after the current set of changes
-        if changes:
-            next_change = changes[0]
+        # get the position of the change that comes after the current set of changes
+        if group_start + group_size < len(changes):
+            next_change_pos = changes.positions[group_start + group_size]
         else:
-            next_change = change_set[-1]
+            next_change_pos = change_set.positions[-1]
 
-        # set up the worker thread with the change_set, file_path (for reference when creating the buffer), buffer_info and next_change (to calculate and preserve the unchanged sections in between change sets)
-        thread = threading.Thread(target=apply_changes_worker, args=(change_set, file_path, buffer_info, next_change), daemon=True)
+        # set up the worker thread with the change_set, file_path (for reference when creating the buffer), buffer_info and next_change_pos (to calculate and preserve the unchanged sections in between change sets)
+        thread = threading.Thread(target=apply_changes_worker, args=(change_set, file_path, buffer_info, next_change_pos), daemon=True)
         thread_queue.append(thread)
 
     # start the supervisor thread to manage writes to the final file
     thread_supervisor.start()
 
-    # start the worker threads allowing up to 20 concurrent ones (besides main and supervisor)
-    while thread_queue:
-        if threading.active_count() <= 22:
-            thread_queue.pop(0).start()
-        else:
-            time.sleep(0.01)
+    # start the worker threads allowing up to `workers` concurrent ones, waiting for the oldest one to finish before starting another
+    running_threads = []
+    for thread in thread_queue:
+        if len(running_threads) >= workers:
+            running_threads.pop(0).join()
+        thread.start()
+        running_threads.append(thread)
 
     # wait for all threads to finish before ending
-    while threading.active_count() > 1:
-        time.sleep(0.01)
+    for thread in running_threads:
+        thread.join()
+    thread_supervisor.join()
+
+
+def iter_applied_changes(changes: ChangeSet | list[Change], file_path: str, block_size: int | None = None) -> Iterator[bytes]:
+    """Get the content of a file with a list of changes applied to it, in blocks, without modifying the file.
+
+    Unlike `apply_changes`, this function walks the file and the changes a single time from start to finish, yielding each section of the changed file as soon as it's available.
+    This makes it suitable for streaming the changed file somewhere else.
+
+    Parameters
+    ----------
+    changes: ChangeSet, list[Change]
+        A change set generated by the `get_changes` function (or a list of changes) to be applied to the file.
+
+    file_path: str
+        The path of the file the changes should be applied to.
+
+    block_size: int, None, optional
+        The maximum size of the unchanged sections read from the file at once.
+        If omited, the "read_block_size" setting is used (see `get_settings`).
+
+    Yields
+    ------
+    bytes
+        The next section of the changed file.
+    """
+    if not isinstance(changes, ChangeSet):
+        changes = ChangeSet.from_changes(changes)
+
+    block_size = block_size or get_settings()["read_block_size"]
+    profiler.count("apply.changes", len(changes))
+    with open(file_path, "rb") as file:
+        position = 0
+        for i in range(len(changes)):
+            # copy the unchanged section before the change
+            change_position = changes.positions[i]
+            while position < change_position:
+                block = file.read(min(block_size, change_position - position))
+                if not block:
+                    break
+                position += len(block)
+                yield block
+
+            # add the new content or skip the removed one
+            if changes.types[i] == types.ADD.value:
+                yield bytes(changes.content(i))
+            else:
+                position += changes.sizes[i]
+                file.seek(position)
+
+        # copy everything after the last change
+        while block := file.read(block_size):
+            yield block
+
+
+def _change_operations(changes: ChangeSet) -> Iterator[tuple[str, int | memoryview]]:
+    """Describe a change set as a sequence of operations over the original file.
+
+    Each operation is either ("keep", size), ("add", content) or ("rmv", content), the last one is always a "keep" of everything left on the file.
+    """
+    position = 0
+    for i in range(len(changes)):
+        if changes.positions[i] > position:
+            yield "keep", changes.positions[i] - position
+            position = changes.positions[i]
+
+        if changes.types[i] == types.ADD.value:
+            yield "add", changes.content(i)
+        else:
+            yield "rmv", changes.content(i)
+            position += changes.sizes[i]
+
+    yield "keep", sys.maxsize
+
 
-    print(f"apply time: {time.perf_counter() - timer}")
+def compose_changes(first: ChangeSet, second: ChangeSet) -> ChangeSet:
+    """Merge two consecutive change sets into a single one.
 
+    Given the changes from a file A to a file B and the changes from B to a file C, this function returns the changes from A to C, without needing any of the files.
+    Both change sets are walked at the same time as sequences of operations (see `_change_operations`): the content the first one keeps or adds is what the second one keeps or removes.
+    Content added by the first change set and removed by the second one cancels out, while content removed from A is always known, since it's stored in one of the two change sets.
 
-def create_backup(old_file: str, new_file: str, backup_file: str) -> None:
-    """Create a delta backup file using the `get_changes` function.
+    Parameters
+    ----------
+    first: ChangeSet
+        The changes from file A to file B.
+
+    second: ChangeSet
+        The changes from file B to file C.
+
+    Returns
+    -------
+    ChangeSet
+        The changes from file A to file C.
+    """
+    composed = ChangeSet()
+
+    # consecutive additions and deletions are grouped into a single addition followed by a single deletion
+    position = 0  # the current position on file A
+    run_start = 0
+    run_added = bytearray()
+    run_removed = bytearray()
+
+    def flush_run() -> None:
+        nonlocal run_added, run_removed
+        if run_added:
+            composed.append(types.ADD.value, run_start, run_added)
+        if run_removed:
+            composed.append(types.RMV.value, run_start, run_removed)
+        run_added = bytearray()
+        run_removed = bytearray()
+
+    def start_run() -> None:
+        nonlocal run_start
+        if not (run_added or run_removed):
+            run_start = position
+
+    first_operations = _change_operations(first)
+    second_operations = _change_operations(second)
+    first_type, first_value = next(first_operations)
+    second_type, second_value = next(second_operations)
+    while True:
+        # content removed from A doesn't reach B
+        if first_type == "rmv":
+            start_run()
+            run_removed += first_value
+            position += len(first_value)
+            first_type, first_value = next(first_operations)
+            continue
+
+        # content added to C doesn't come from B
+        if second_type == "add":
+            start_run()
+            run_added += second_value
+            second_type, second_value = next(second_operations)
+            continue
+
+        # both files end with everything left being kept
+        if first_type == second_type == "keep" and first_value == second_value == sys.maxsize:
+            break
+
+        # the first operation produces content of B and the second one consumes it
+        first_size = first_value if first_type == "keep" else len(first_value)
+        second_size = second_value if second_type == "keep" else len(second_value)
+        size = min(first_size, second_size)
+        if first_type == "keep" and second_type == "keep":
+            flush_run()
+            position += size
+        elif first_type == "keep":
+            start_run()
+            run_removed += second_value[:size]
+            position += size
+        elif second_type == "keep":
+            start_run()
+            run_added += first_value[:size]
+
+        # move to the remaining part of each operation
+        if first_size == size:
+            first_type, first_value = next(first_operations)
+        elif first_type == "keep":
+            first_value = first_value if first_value == sys.maxsize else first_value - size
+        else:
+            first_value = first_value[size:]
+
+        if second_size == size:
+            second_type, second_value = next(second_operations)
+        elif second_type == "keep":
+            second_value = second_value if second_value == sys.maxsize else second_value - size
+        else:
+            second_value = second_value[size:]
+
+    flush_run()
+    return composed
+
+
+def invert_changes(changes: ChangeSet) -> ChangeSet:
+    """Reverse a change set without needing any of the files.
+
+    Given the changes from a file A to a file B, this function returns the changes from B to A: content added to A is removed from B and content removed from A is added back to B, which is possible since both are stored in the change set.
+
+    Parameters
+    ----------
+    changes: ChangeSet
+        The changes from file A to file B.
+
+    Returns
+    -------
+    ChangeSet
+        The changes from file B to file A.
+    """
+    inverted = ChangeSet()
+
+    position = 0  # the current position on file B
+    for operation, value in _change_operations(changes):
+        if operation == "keep":
+            if value == sys.maxsize:
+                break
+            position += value
+        elif operation == "add":
+            inverted.append(types.RMV.value, position, value)
+            position += len(value)
+        else:
+            inverted.append(types.ADD.value, position, value)
+
+    return inverted
+
+
+def create_backup(old_file: str, new_file: str, backup_file: str, mode: str = "auto") -> None:
+    """Create a delta backup file using the `get_changes` function (or `get_line_changes` for text files).
 
     This functions uses the output from `get_changes` to create a backup file that can be stored on the system.
     This backup file consists of a LZMA compressed file composed of two other files: "changes" and "instructions".
 
-    The "changes" file is simply a binary file composed of all the changed content one right after the other.
+    The "changes" file is simply a binary file composed of all the changed content one right after the other, which is exactly the payload of the change set returned by `get_changes`.
 
     The "instructions" file is a plain text file with instructions on how to recreate the file using the content from "changes".
     Every line of this file represents a change and every change is composed of:
@@ -476,6 +1225,9 @@ def create_backup(old_file: str, new_file: str, backup_file: str) -> None:
     backup_file: str
         The path where the backup file will be saved when finished.
 
+    mode: str, optional
+        The diff used to get the changes, see `get_file_changes` for more information.
+
     Effects
     -------
     Creates a backup file on the specified location.
@@ -486,49 +1238,117 @@ def create_backup(old_file: str, new_file: str, backup_file: str) -> None:
         If "old file" and "new file" are exactly equal.
     """
     # get everything that changed between the two files
-    changes = get_changes(old_file, new_file)
+    changes = get_file_changes(old_file, new_file, mode)
 
     if not changes:
         raise BackupExceptions.NoChangesException("The file is exactly the same as the last backup.")
 
-    # save instructions and changes to temporary files
+    write_backup(changes, backup_file)
+
+
+def write_backup(changes: ChangeSet, backup_file: str, compression: int | None = None, compresslevel: int | None = None) -> None:
+    """Save a change set to a backup file.
+
+    See `create_backup` for more information on the format of the backup file.
+
+    The instructions are built straight from the arrays of the change set and the payload is written in a single operation, so no change has its content copied.
+
+    Parameters
+    ----------
+    changes: ChangeSet
+        The change set being saved.
+
+    backup_file: str
+        The path where the backup file will be saved when finished.
+
+    compression: int, None, optional
+        The zipfile compression method used on the backup file.
+        If omited, the "compression" and "compresslevel" settings are used (see `get_settings`).
+
+    compresslevel: int, None, optional
+        The preset of the compression method, by default 9 for deflate and the default of the method for any other.
+
+    Effects
+    -------
+    Creates a backup file on the specified location.
+    """
+    if compression is None:
+        settings = get_settings()
+        compression = COMPRESSION_METHODS[settings["compression"]]
+        compresslevel = settings["compresslevel"]
+    elif compresslevel is None and compression == zipfile.ZIP_DEFLATED:
+        compresslevel = 9
+
+    with profiler.span("serialize", changes=len(changes)):
+        instructions = "".join(f"{type} {position} {size}\n" for type, position, size in zip(changes.types, changes.positions, changes.sizes))
+
+    # compress the instructions and changes together into a temporary file
     with tempfile.TemporaryDirectory() as temp_dir:
-        temp_changes_path = os.path.join(temp_dir, "changes")
-        temp_instructions_path = os.path.join(temp_dir, "instructions")
-        with open(temp_instructions_path, "w") as instructions_file:
-            with open(temp_changes_path, "wb") as changes_file:
-                for change in changes:
-                    # save instruction for current change
-                    instruction_str = f"{change.type} {change.position} {change.size}\n"
-                    instructions_file.write(instruction_str)
-
-                    # save bytes changed
-                    changes_file.write(change.content)
-
-        # compress both files together
         temp_zip_path = os.path.join(temp_dir, "backup")
-        with zipfile.ZipFile(temp_zip_path, "w", compression=zipfile.ZIP_LZMA) as zip_file:
-            zip_file.write(temp_instructions_path, "instructions")
-            zip_file.write(temp_changes_path, "changes")
+        with profiler.span("compress") as span:
+            with zipfile.ZipFile(temp_zip_path, "w", compression=compression, compresslevel=compresslevel) as zip_file:
+                zip_file.writestr("instructions", instructions)
+                with zip_file.open("changes", "w") as changes_file:
+                    changes_file.write(changes.payload_view())
+
+            compressed_size = os.path.getsize(temp_zip_path)
+            span.set(bytes_in=len(instructions) + len(changes.payload), bytes_out=compressed_size)
+            profiler.count("compress.bytes_in", len(instructions) + len(changes.payload))
+            profiler.count("compress.bytes_out", compressed_size)
 
         # save output file
         shutil.move(temp_zip_path, backup_file)
 
 
-def restore_backup(backup_file: str, input_file: str, output_file: str | None = None) -> None:
+def read_backup(backup_file: "str | io.BytesIO") -> ChangeSet:
+    """Read the change set stored within a backup file created by `create_backup`.
+
+    See `create_backup` for more information on the format of the backup file.
+
+    The "changes" file is used as is for the payload of the change set, so the content of each change is never copied out of it.
+
+    Parameters
+    ----------
+    backup_file: str, BytesIO
+        The path to the backup file generated by `create_backup`, or its content (such as a backup read from a pack file, see `pack_global_backups`).
+
+    Returns
+    -------
+    ChangeSet
+        The change set stored within the backup file.
+    """
+    with profiler.span("decompress") as span:
+        with zipfile.ZipFile(backup_file, "r") as zip_file:
+            instructions = zip_file.read("instructions")
+            payload = zip_file.read("changes")
+
+        bytes_in = os.path.getsize(backup_file) if isinstance(backup_file, str) else len(backup_file.getbuffer())
+        span.set(bytes_in=bytes_in, bytes_out=len(instructions) + len(payload))
+        profiler.count("decompress.bytes_in", bytes_in)
+        profiler.count("decompress.bytes_out", len(instructions) + len(payload))
+
+    # every instruction is made out of three values: type, position and size
+    with profiler.span("parse") as span:
+        instructions = instructions.split()
+        changes = ChangeSet(array("b", map(int, instructions[0::3])), array("q", map(int, instructions[1::3])), array("q", map(int, instructions[2::3])), payload)
+        span.set(changes=len(changes))
+
+    return changes
+
+
+def restore_backup(backup_file: "str | io.BytesIO", input_file: str, output_file: str | None = None) -> None:
     """Restore a backup using a file created by `create_backup`.
 
     See `create_backup` for more information on how the backup file works.
 
-    This function starts by extracting the contents of the backup file into a temporary directory and then cycling through each instruction of the "instructions" file, recostructing the original list of changes.
-    For each instruction it sequentially consumes the current change size from the "changes" file and uses this in conjunction to the position and type values to instantiate a new Change object that's later appended to a list of changes.
+    This function starts by reading the change set stored within the backup file using `read_backup`, which parses every instruction of the "instructions" file into the arrays of the change set and uses the "changes" file as its payload.
 
-    After that, it simply calls the `apply_changes` function to apply the retrieved list of changes to the original file.
+    After that, it simply calls the `apply_changes` function to apply the retrieved change set to the original file.
 
     Parameters
     ----------
-    backup_file: str
-        The path to the backup file generated by `create_backup`.
+    backup_file: str, BytesIO
+        The path to the backup file generated by `create_backup`, or its content (see `read_backup`).
 
     input_file: str
         The path to the original file to which the backup belongs.
@@ -543,26 +1363,12 @@ def restore_backup(backup_file: str, input_file: str, output_file: str | None =
     """
     if output_file is None:
         output_file = input_file
+    elif output_file != input_file:
+        shutil.copy(input_file, output_file)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # extract files from the backup
-        with zipfile.ZipFile(backup_file, "r") as backup_file:
-            backup_file.extractall(path=temp_dir)
-
-        # create a list of change objects
-        changes = []
-        temp_changes_path = os.path.join(temp_dir, "changes")
-        temp_instructions_path = os.path.join(temp_dir, "instructions")
+    changes = read_backup(backup_file)
 
-        with open(temp_instructions_path, "r") as instructions_file:
-            with open(temp_changes_path, "rb") as changes_file:
-                for line in instructions_file.readlines():
-                    type, position, size = line.strip().split(" ")
-                    content = changes_file.read(int(size))
-
-                    changes.append(Change(int(type), int(position), content))
-
-    # apply changes to the input_file
+    # apply changes to the output_file
     apply_changes(changes, output_file)
 
 
@@ -577,12 +1383,59 @@ def list_tracked_files() -> list[dict]:
             index: which contains the backup index of the tracked file;
             path: which contains the absolute path of the tracked file.
     """
-    # read the list of tracked files inside tracked.json
-    tracked_list_manger = JSONManager(TRACKED_FILES_LIST_PATH, {"last": -1, "list": []})
-    tracked_list = tracked_list_manger.read()["list"]
+    # the entries are copied, since the list read from tracked.json is shared between calls
+    return [dict(entry) for entry in _read_tracked_list()]
+
+
+def _read_tracked_list() -> list[dict]:
+    """Read the list of tracked files inside "tracked.json", which is shared between calls and must not be changed (see `JSONManager`)."""
+    tracked_list_manger = JSONManager(_get_path("TRACKED_FILES_LIST_PATH"), {"last": -1, "list": []}, _get_metadata_cache())
+    return tracked_list_manger.read()["list"]
+
+
+def get_tracked_path(backup_index: int):
+    """Get the path of the tracked file with a corresponding backup index.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the tracked file whose path need to be retrieved.
+
+    Returns
+    -------
+    str
+        A string containing the path of the track file.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't correspond to any tracked file.
+    """
+    # return the path of the tracked file if the given backup index exists or raise exception if not
+    return _get_tracked_entry(backup_index)["path"]
+
+
+def _get_tracked_index() -> dict[int, dict]:
+    """Get the entry of every tracked file by its backup index, which is only built again once "tracked.json" changes."""
+    tracked_list = _read_tracked_list()
+
+    # the index is kept along with the key of the version of "tracked.json" it was built from
+    cache = _get_metadata_cache()
+    key = cache[_get_path("TRACKED_FILES_LIST_PATH")][0]
+    cached = cache.get("tracked index")
+    if cached is None or cached[0] != key:
+        cached = (key, {file["index"]: file for file in tracked_list})
+        cache["tracked index"] = cached
+
+    return cached[1]
 
-    # return the entire list of tracked files if no index was specified
-    return tracked_list
+
+def _get_tracked_entry(backup_index: int) -> dict:
+    """Get the entry of a tracked file on "tracked.json"."""
+    try:
+        return _get_tracked_index()[backup_index]
+    except KeyError:
+        raise BackupExceptions.BackupNotFoundError(f"Backup with index '{backup_index}' does not exist.")
 
 
 def list_file_backups(backup_index: int, reverse: bool = False) -> list[int]:
@@ -606,20 +1459,203 @@ def list_file_backups(backup_index: int, reverse: bool = False) -> list[int]:
     BackupNotFoundError
         If the given backup index doesn't correspond to any tracked file.
     """
-    # implicitly check if the given backup index is being used
-    get_tracked_path(backup_index)
-
-    # get the list of timestamps
-    backups_dir = os.path.join(BACKUP_DATA_DIR, f"{backup_index}/changes/")
-    backup_list = [int(backup) for backup in os.listdir(backups_dir)]
+    backup_list = list(_list_backups(backup_index))
     if reverse:
         backup_list.reverse()
 
     return backup_list
 
 
-def get_backup_message(backup_index: int, timestamp: int) -> str:
-    """Get the message of a given backup.
+def _list_backups(backup_index: int) -> list[int]:
+    """Get the timestamps of every backup of a tracked file from oldest to newest, like `list_file_backups` does.
+
+    The list is shared between calls and must not be changed, see `_get_changes_index`.
+    """
+    # implicitly check if the given backup index is being used
+    get_tracked_path(backup_index)
+
+    # get the list of timestamps, finishing an interrupted repack if the backups were being swapped
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), f"{backup_index}/changes/")
+    if not os.path.isdir(backups_dir):
+        # the backups may also be being swapped by another process right now, in which case they're done once its lock is released
+        with _lock_backup_index(backup_index):
+            if not os.path.exists(backups_dir):
+                _finish_repack(os.path.dirname(os.path.dirname(backups_dir)))
+
+    return _get_changes_index(backups_dir).backups
+
+
+class _ChangesIndex:
+    """The backups inside a "changes" directory, stored either as loose files named after their timestamps or inside pack files (see `pack_global_backups`)."""
+
+    def __init__(self, changes_dir: str):
+        self.changes_dir = changes_dir
+        self.loose = set()
+        self.packed = {}  # the pack file, offset and size of every packed backup
+        for name in os.listdir(changes_dir):
+            if name.isdigit():
+                self.loose.add(int(name))
+            elif name.endswith(".idx"):
+                entries = array("Q")
+                with open(os.path.join(changes_dir, name), "rb") as index_file:
+                    entries.frombytes(index_file.read())
+                pack_name = name.removesuffix(".idx") + ".pack"
+                for i in range(0, len(entries), PACK_INDEX_ENTRY):
+                    self.packed[entries[i]] = (pack_name, entries[i + 1], entries[i + 2])
+
+        self.backups = sorted(self.loose | self.packed.keys())
+        self._maps = {}  # the memory map of every pack file opened so far
+        self._lock = threading.Lock()
+
+    def open(self, timestamp: int) -> "str | io.BytesIO":
+        """Get the path of a loose backup, or the content of a packed one."""
+        # a backup that's both loose and packed was just packed, so its loose file is about to be removed
+        if timestamp not in self.packed:
+            return os.path.join(self.changes_dir, str(timestamp))
+
+        pack_name, offset, size = self.packed[timestamp]
+        with self._lock:
+            if pack_name not in self._maps:
+                with open(os.path.join(self.changes_dir, pack_name), "rb") as pack_file:
+                    self._maps[pack_name] = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            pack_map = self._maps[pack_name]
+
+        profiler.count("pack.reads")
+        return io.BytesIO(pack_map[offset : offset + size])
+
+    def size(self, timestamp: int) -> int:
+        """Get the size of a backup, whether it's loose or packed."""
+        if timestamp not in self.packed:
+            return os.path.getsize(os.path.join(self.changes_dir, str(timestamp)))
+
+        return self.packed[timestamp][2]
+
+
+def _get_changes_index(changes_dir: str) -> _ChangesIndex:
+    """Get the backups inside a "changes" directory, which are kept until the directory changes."""
+    key = get_file_key(changes_dir)
+
+    cache = _get_metadata_cache()
+    cached = cache.get(changes_dir)
+    if cached is not None and cached[0] == key:
+        profiler.count("metadata.cache_hits")
+        return cached[1]
+
+    changes_index = _ChangesIndex(changes_dir)
+
+    # the modification time of directories may only be updated every few milliseconds, so directories that just changed could change again without it changing
+    # the list of those is only kept once they stop changing
+    if time.time_ns() - key[0] > LISTING_CACHE_DELAY:
+        cache[changes_dir] = (key, changes_index)
+
+    return changes_index
+
+
+def _get_backup_file(changes_dir: str, timestamp: int) -> "str | io.BytesIO":
+    """Get a backup from a "changes" directory the way `read_backup` takes it, whether it's loose or packed."""
+    backup_file = _get_changes_index(changes_dir).open(timestamp)
+
+    # the loose backup may have just been packed by another process, which changes the directory and so its index
+    if isinstance(backup_file, str) and not os.path.exists(backup_file):
+        backup_file = _get_changes_index(changes_dir).open(timestamp)
+
+    return backup_file
+
+
+def pack_global_backups(backup_index: int) -> int:
+    """Pack every loose backup of a globally tracked file into a single pack file.
+
+    Each backup is usually stored as its own small file, so a long history means thousands of files to open and parse when restoring.
+    A pack holds many of them one after the other inside a ".pack" file, with a ".idx" file containing the timestamp, offset and size of each one.
+    Packs are read through a memory map, so every backup inside one is read without opening any file after the first.
+
+    Backups are packed automatically by `create_global_backup` once there are `PACK_THRESHOLD` loose ones, and `repack_global_backups` and `prune_global_backups` pack every backup they create.
+    Every function that reads backups reads them the same way whether they're loose or packed.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file whose backups are packed.
+
+    Returns
+    -------
+    int
+        How many backups were packed.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    get_tracked_path(backup_index)
+    with _lock_backup_index(backup_index):
+        return _pack_backups(os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "changes"))
+
+
+def _pack_backups(changes_dir: str) -> int:
+    """Pack the loose backups inside a "changes" directory, see `pack_global_backups`.
+
+    The pack is only used once its index is in place and the loose backups are only removed after that, so an interrupted pack never loses any backup.
+    """
+    loose = sorted(int(name) for name in os.listdir(changes_dir) if name.isdigit())
+    if not loose:
+        return 0
+
+    # packs are named after their first backup, so packing the same backups again after an interruption replaces the leftover pack
+    pack_path = os.path.join(changes_dir, f"{loose[0]}.pack")
+    index_path = os.path.join(changes_dir, f"{loose[0]}.idx")
+    entries = array("Q")
+    with profiler.span("pack", backups=len(loose)):
+        with open(f"{pack_path}.tmp", "wb") as pack_file:
+            for timestamp in loose:
+                offset = pack_file.tell()
+                with open(os.path.join(changes_dir, str(timestamp)), "rb") as backup_file:
+                    shutil.copyfileobj(backup_file, pack_file)
+                entries.extend((timestamp, offset, pack_file.tell() - offset))
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+
+        with open(f"{index_path}.tmp", "wb") as index_file:
+            entries.tofile(index_file)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        os.replace(f"{pack_path}.tmp", pack_path)
+        os.replace(f"{index_path}.tmp", index_path)
+        for timestamp in loose:
+            os.remove(os.path.join(changes_dir, str(timestamp)))
+
+    return len(loose)
+
+
+def timestamp_exists(backup_index: int, timestamp: int):
+    """Check if a backup with the given timestamp exists for the specified file index.
+
+    Parameters
+    ----------
+    backup_index: int
+        The backup index of the file that's suposed to contain the timestamp.
+
+    timestamp: int
+        The timestamp expected.
+
+    Raises
+    ------
+    TimestampNotFound
+        If the timestamp is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    # check if the given backup exists
+    backup_list = _list_backups(backup_index)  # implicitly check if this backup index is being used
+    position = bisect.bisect_left(backup_list, timestamp)
+    if position == len(backup_list) or backup_list[position] != timestamp:
+        raise BackupExceptions.TimestampNotFound(f"A backup with timestamp '{timestamp}' does not exist for the file '{get_tracked_path(backup_index)}'")
+
+
+def get_backup_message(backup_index: int, timestamp: int) -> str:
+    """Get the message of a given backup.
 
     Arguments
     ---------
@@ -646,9 +1682,7 @@ def get_backup_message(backup_index: int, timestamp: int) -> str:
     timestamp_exists(backup_index, timestamp)
 
     # read messages.json
-    messages_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "messages.json")
-    messages_manager = JSONManager(messages_path, {})
-    messages_json = messages_manager.read()
+    messages_json = _read_metadata(backup_index, "messages.json")
 
     # return the message associated with the backup
     try:
@@ -683,17 +1717,13 @@ def create_backup_message(backup_index: int, timestamp: int, message: str) -> No
     BackupNotFoundError
         If the given backup index doesn't corespond to any of the tracked files.
     """
-    # check if the given backup exists
-    timestamp_exists(backup_index, timestamp)
-
-    # read messages.json
-    messages_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "messages.json")
-    messages_manager = JSONManager(messages_path, {})
-    messages_json = messages_manager.read()
+    # lock the backup folder so messages saved at the same time aren't lost
+    with _lock_backup_index(backup_index):
+        # check if the given backup exists
+        timestamp_exists(backup_index, timestamp)
 
-    # save the new message to messages.json
-    messages_json.update({str(timestamp): message})
-    messages_manager.save(messages_json)
+        # save the new message
+        _append_journal({"op": "message", "index": backup_index, "timestamp": timestamp, "message": message})
 
 
 def get_checksum(backup_index: int, timestamp: int) -> str:
@@ -724,15 +1754,395 @@ def get_checksum(backup_index: int, timestamp: int) -> str:
     timestamp_exists(backup_index, timestamp)
 
     # read checksums.json
-    checksums_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "checksums.json")
-    checksums_manager = JSONManager(checksums_path, {})
-    checksums_json = checksums_manager.read()
+    checksums_json = _read_metadata(backup_index, "checksums.json")
 
     # return the checksum associated with the backup
     return checksums_json[str(timestamp)]
 
 
-def create_global_backup(file_path: str, message: str = "") -> None:
+def get_backup_chain(backup_index: int, timestamp: int) -> list[int]:
+    """Get the list of backups that need to be restored in sequence to reconstruct a given version.
+
+    Each backup is created against a base (see `create_global_backup`), so the chain is found by following the base of every backup (see `get_backup_bases`) until the first one.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the backup belongs.
+
+    timestamp: int
+        The timestamp of the version being reconstructed.
+
+    Returns
+    -------
+    list[int]
+        A list containing the timestamps of every backup needed ordered from the first one to be restored up until the given timestamp.
+
+    Raises
+    ------
+    TimestampNotFound
+        If the timestamp is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    # check if the given backup exists
+    timestamp_exists(backup_index, timestamp)
+
+    # follow the bases back to the first backup
+    bases = get_backup_bases(backup_index)
+    chain = []
+    step = timestamp
+    while step is not None:
+        chain.append(step)
+        step = bases[step]
+    chain.reverse()
+
+    return chain
+
+
+def get_backup_bases(backup_index: int) -> dict[int, int | None]:
+    """Get the base of every backup of a given tracked file (see `create_global_backup`).
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file whose bases need to be retrieved.
+
+    Returns
+    -------
+    dict[int, int | None]
+        A dict linking the timestamp of every backup, from oldest to newest, to the timestamp of its base or None for backups created against an empty file.
+        Backups without an entry on "bases.json" use the previous backup as base.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    backup_list = list_file_backups(backup_index)
+
+    # read bases.json
+    bases_json = _read_metadata(backup_index, "bases.json")
+
+    # link every backup to the previous one for backups without a base
+    previous_backups = dict(zip(backup_list, [None] + backup_list))
+
+    return {backup: bases_json.get(str(backup), previous_backups[backup]) for backup in backup_list}
+
+
+def get_file_checksum(file_path: str) -> str:
+    """Get the sha256 checksum of a file, reading it in blocks."""
+    with profiler.span("hash") as span:
+        checksum = hashlib.sha256()
+        block_size = get_settings()["read_block_size"]
+        with open(file_path, "rb") as file:
+            while block := file.read(block_size):
+                checksum.update(block)
+            size = file.tell()
+
+        span.set(bytes=size)
+        profiler.count("hash.bytes", size)
+
+    return checksum.hexdigest()
+
+
+def _choose_backup_base(backup_index: int, backup_list: list[int], signature: array) -> int | None:
+    """Choose the version a new backup should be created against, among the last `BASE_CANDIDATES` versions.
+
+    Head (the last version) is used unless the signature of another candidate indicates a backup at most half as big, since any other base needs to be restored first.
+    """
+    if not backup_list:
+        return None
+
+    # get the signature of head, calculating it for backups created before signatures existed
+    signatures_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "signatures")
+    head_signature_path = os.path.join(signatures_dir, str(backup_list[-1]))
+    if os.path.exists(head_signature_path):
+        head_signature = _read_signature(head_signature_path)
+    else:
+        head_signature = get_signature(os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "head"))
+
+    head_size = estimate_changes_size(head_signature, signature)
+    best_base = backup_list[-1]
+    best_size = head_size
+
+    # look for a better candidate among the previous versions that have a signature, starting from the newest
+    for candidate in reversed(backup_list[-BASE_CANDIDATES:-1]):
+        if best_size == 0:
+            break
+
+        candidate_signature_path = os.path.join(signatures_dir, str(candidate))
+        if not os.path.exists(candidate_signature_path):
+            continue
+
+        candidate_size = estimate_changes_size(_read_signature(candidate_signature_path), signature)
+        if candidate_size * 2 < head_size and candidate_size < best_size:
+            best_base = candidate
+            best_size = candidate_size
+
+    return best_base
+
+
+def _read_signature(signature_path: str) -> array:
+    """Read a signature saved by `create_global_backup`."""
+    signature = array("Q")
+    with open(signature_path, "rb") as signature_file:
+        signature.frombytes(signature_file.read())
+
+    return signature
+
+
+def _reconstruct_version(backup_index: int, timestamp: int, output_path: str) -> None:
+    """Reconstruct a version of a tracked file into the given path, restoring every backup on its chain (see `get_backup_chain`)."""
+    backup_list = list_file_backups(backup_index)
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+
+    # the last version is always stored as head
+    if timestamp == backup_list[-1]:
+        shutil.copy(os.path.join(backups_dir, "head"), output_path)
+        return
+
+    # apply all backups on the chain in sequence starting from an empty file
+    open(output_path, "wb").close()
+    for step in get_backup_chain(backup_index, timestamp):
+        restore_backup(_get_backup_file(os.path.join(backups_dir, "changes"), step), output_path)
+
+
+def _get_journal() -> Journal:
+    """Get the journal of the backup directory, see `_append_journal`."""
+    backup_data_dir = _get_path("BACKUP_DATA_DIR")
+    with _journals_lock:
+        if backup_data_dir not in _journals:
+            os.makedirs(os.path.join(backup_data_dir, "locks"), exist_ok=True)
+            _journals[backup_data_dir] = Journal(os.path.join(backup_data_dir, "journal"), os.path.join(backup_data_dir, "locks", "journal"))
+        return _journals[backup_data_dir]
+
+
+def _append_journal(record: dict) -> None:
+    """Save a change to the metadata of a tracked file by appending it to the journal of the backup directory, which is the moment the change happens.
+
+    Instead of rewriting "bases.json", "checksums.json", "messages.json" and "timestamp" on every change, each change is a single record appended to the "journal" file, which is read on top of those files (see `_read_metadata`).
+    A change is either on the journal or not, so a crash never leaves the metadata files out of sync with each other.
+    Depending on the "journal_fsync" setting (see `get_settings`), the record is synced to disk before returning, in which case records appended at the same time by other threads are synced along with it.
+
+    Records must be appended while holding the lock of the backup folder they belong to, and hold the "index" and "timestamp" of the backup, along with the fields in `JOURNAL_FIELDS` that changed.
+    Records of creations and restorations ("op" being "create" or "restore") also make their timestamp the current one.
+
+    The journal is compacted into the metadata files once it gets larger than `JOURNAL_MAX_SIZE` (see `_compact_journal`).
+    """
+    journal = _get_journal()
+    journal.append(record, sync=get_settings()["journal_fsync"] == "always")
+    if journal.size() > JOURNAL_MAX_SIZE:
+        _compact_journal()
+
+
+def _get_journal_records(backup_index: int) -> list[dict]:
+    """Get the records of a tracked file on the journal, which are read incrementally and kept between calls."""
+    journal = _get_journal()
+    try:
+        key = get_file_key(journal.path)
+    except FileNotFoundError:
+        return []
+
+    cache = _get_metadata_cache()
+    cached = cache.get(journal.path)
+    if cached is None or cached[0] != key:
+        position, records = (None, {}) if cached is None else cached[1]
+        new_records, position, reset = journal.read(position)
+        if reset:
+            records = {}
+        else:
+            records = {index: list(index_records) for index, index_records in records.items()}
+        for record in new_records:
+            records.setdefault(record["index"], []).append(record)
+        cached = (key, (position, records))
+        cache[journal.path] = cached
+
+    return cached[1][1].get(backup_index, [])
+
+
+def _read_metadata(backup_index: int, file_name: str) -> dict:
+    """Read one of the metadata files in `JOURNAL_FIELDS` of a tracked file, along with the changes on the journal (see `_append_journal`).
+
+    The content is shared between calls and must not be changed.
+    """
+    # the journal is read first, since it may be compacted into the file in between
+    records = _get_journal_records(backup_index)
+    content = JSONManager(os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), file_name), {}, _get_metadata_cache()).read()
+
+    field = JOURNAL_FIELDS[file_name]
+    if any(field in record for record in records):
+        content = dict(content)
+        for record in records:
+            if field in record:
+                content[str(record["timestamp"])] = record[field]
+
+    return content
+
+
+def _compact_journal() -> None:
+    """Save every change on the journal to the metadata files of each tracked file and empty it.
+
+    Only the journal is locked, since the metadata files of a tracked file are only ever written here or while holding the lock of its backup folder after compacting the journal (so with no records of it on the journal).
+    """
+    journal = _get_journal()
+    fsync = get_settings()["journal_fsync"] == "always"
+    with journal.lock:
+        records, _, _ = journal.read()
+        if not records:
+            return
+
+        with profiler.span("journal.compact", records=len(records)):
+            indexes = {}
+            for record in records:
+                indexes.setdefault(record["index"], []).append(record)
+
+            for backup_index, index_records in indexes.items():
+                backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+                if not os.path.isdir(backups_dir):
+                    continue
+
+                for file_name, field in JOURNAL_FIELDS.items():
+                    changes = {str(record["timestamp"]): record[field] for record in index_records if field in record}
+                    if changes:
+                        metadata_manager = JSONManager(os.path.join(backups_dir, file_name), {}, _get_metadata_cache())
+                        metadata_manager.save({**metadata_manager.read(), **changes}, fsync)
+
+                current = [record["timestamp"] for record in index_records if record["op"] in ("create", "restore")]
+                if current:
+                    _write_current_timestamp(backup_index, current[-1])
+
+            journal.reset()
+
+
+def _get_current_timestamp(backup_index: int) -> int:
+    """Get the timestamp of the current active backup of a tracked file."""
+    records = [record for record in _get_journal_records(backup_index) if record["op"] in ("create", "restore")]
+    if records:
+        return records[-1]["timestamp"]
+
+    with open(os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "timestamp"), "r") as curr_timestamp_file:
+        return int(curr_timestamp_file.read())
+
+
+def _write_current_timestamp(backup_index: int, timestamp: int) -> None:
+    """Replace the "timestamp" file of a tracked file at once."""
+    curr_timestamp_path = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "timestamp")
+    with open(f"{curr_timestamp_path}.tmp", "w") as curr_timestamp:
+        curr_timestamp.write(str(timestamp))
+    os.replace(f"{curr_timestamp_path}.tmp", curr_timestamp_path)
+
+
+def _recover_backup_index(backup_index: int) -> None:
+    """Finish or undo a backup interrupted while being created, see `_create_global_backup`.
+
+    New backups are written to a "pending" folder and only moved in place after their record is on the journal, so pending backups with a checksum are finished and the others are removed.
+    """
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+    pending_dir = os.path.join(backups_dir, "pending")
+    if not os.path.isdir(pending_dir):
+        return
+
+    checksums_json = _read_metadata(backup_index, "checksums.json")
+    for name in sorted(os.listdir(pending_dir)):
+        timestamp, _, suffix = name.partition(".")
+        pending_path = os.path.join(pending_dir, name)
+        if timestamp not in checksums_json:
+            os.remove(pending_path)
+        elif suffix == "head":
+            os.replace(pending_path, os.path.join(backups_dir, "head"))
+        else:
+            os.replace(pending_path, os.path.join(backups_dir, "changes", timestamp))
+            _write_current_timestamp(backup_index, int(timestamp))
+    os.rmdir(pending_dir)
+
+
+def _sync_file(file_path: str) -> None:
+    """Make sure the content of a file is written to disk."""
+    with open(file_path, "rb") as file:
+        os.fsync(file.fileno())
+
+
+class _BackupLock(FileLock):
+    """A lock inside the backup directory, which can't be acquired once the backups were moved away by `migrate_global_backups`.
+
+    A migration holds every lock of the backup directory while it moves it, so anything that waited for one of them finds its lock file gone (or replaced) once acquired.
+    """
+
+    def __enter__(self):
+        super().__enter__()
+        if self._held.locks[self.path][1] == 1:
+            try:
+                lock_file = self._held.locks[self.path][0]
+                try:
+                    moved = os.stat(self.path).st_ino != os.fstat(lock_file.fileno()).st_ino
+                except FileNotFoundError:
+                    moved = True
+                if moved:
+                    _forget_moved_backups()
+                    raise BackupExceptions.MigrationInProgressError(f"The backups were migrated away from '{os.path.dirname(os.path.dirname(self.path))}' while waiting for them, try again.")
+            except BaseException:
+                super().__exit__(None, None, None)
+                raise
+
+        return self
+
+
+class _BackupIndexLock(_BackupLock):
+    """The lock of a backup folder, which also finishes any backup interrupted while being created once acquired (see `_recover_backup_index`)."""
+
+    def __init__(self, path: str, backup_index: int):
+        super().__init__(path)
+        self.backup_index = backup_index
+
+    def __enter__(self):
+        super().__enter__()
+        if self._held.locks[self.path][1] == 1:
+            try:
+                _recover_backup_index(self.backup_index)
+            except BaseException:
+                super().__exit__(None, None, None)
+                raise
+
+        return self
+
+
+def _get_locks_dir() -> str:
+    """Get the directory of the lock files inside the backup directory, checking if the backups are still there."""
+    backup_data_dir = _get_path("BACKUP_DATA_DIR")
+
+    # the backup directory of a long running process may have been migrated by another process since it was resolved
+    if not os.path.isdir(backup_data_dir):
+        _forget_moved_backups()
+        raise BackupExceptions.MigrationInProgressError(f"The backups were migrated away from '{backup_data_dir}', try again.")
+
+    locks_dir = os.path.join(backup_data_dir, "locks")
+    os.makedirs(locks_dir, exist_ok=True)
+    return locks_dir
+
+
+def _forget_moved_backups() -> None:
+    """Resolve the paths inside the backup directory again on their next use, after finding it was migrated (see `_get_path`)."""
+    if _repository.get() is None:
+        globals().pop("BACKUP_DATA_DIR", None)
+        globals().pop("TRACKED_FILES_LIST_PATH", None)
+
+
+def _lock_tracked_files() -> FileLock:
+    """Get the lock held while "tracked.json" is changed, such as when a new tracked file gets its backup index (see `FileLock`)."""
+    return _BackupLock(os.path.join(_get_locks_dir(), "tracked"))
+
+
+def _lock_backup_index(backup_index: int) -> FileLock:
+    """Get the lock held while the backup folder of a tracked file is changed (see `FileLock`).
+
+    Every backup folder has its own lock, so different files can be backed up at the same time, even by different processes.
+    """
+    return _BackupIndexLock(os.path.join(_get_locks_dir(), str(backup_index)), backup_index)
+
+
+def create_global_backup(file_path: str, message: str = "", mode: str | None = None) -> None:
     """Create a globally accessible and automatically managed delta backup with version history.
 
     This funtion uses the `create_backup` function to create a backup file following a set of restrictions that allows for a version history to be created and accesed from anywhere on the system.
@@ -744,20 +2154,34 @@ def create_global_backup(file_path: str, message: str = "") -> None:
     - "checksums.json", where the sha264 checksums of each backup are stored and linked to their respective backup timestamp;
     - "messages.json", where the messages of each backup are stored and linked to their respective backup timestamp;
     - "timestamps", where the timestamp of the current active backup is stored for reference when looking up its checksum;
-    - "head", which stores a full copy of the last backed up version of the original file for quick lookup when creating a new backup.
+    - "head", which stores a full copy of the last backed up version of the original file for quick lookup when creating a new backup;
+    - "bases.json", where the timestamp of the version each backup was created against (its "base") is stored and linked to the backup timestamp;
+    - "stats.json", where the size of each backup and version and the cost of restoring it are stored and linked to the backup timestamp (see `get_backup_stats`);
+    - a folder named "signatures", where the chunk signature of every version is stored (see `get_signature`) with its timestamp as the file name.
+
+    Instead of always creating the backup against the last version ("head"), the signature of the file is compared to the signatures of the last `BASE_CANDIDATES` versions and the version that should result on the smallest backup is used as base.
+    This keeps backups small for files that alternate between a few states. Since the base of a backup isn't always the previous one, restoring a version means following its bases back to the first backup (see `get_backup_chain`).
 
     In sumary, the folder structure of the global backups folder looks something like this:
     ```
     | 0/    # a backup folder named after the backup index of a tracked file
     | | changes/    # a folder storing all the backup files
     | | | 1743175897507    # a backup file created at March 28 2025 15:31:37.507 UTC
+    | | signatures/ # a folder storing the signature of every version
+    | | | 1743175897507    # the signature of the version created at March 28 2025 15:31:37.507 UTC
+    | | bases.json      # a file linking each backup to the timestamp of its base
     | | messages.json   # a file linking each backup message to its timestamp
     | | checksums.json  # a file linking each backup checksum to its timestamp
+    | | stats.json      # a file linking the sizes and restore cost of each backup to its timestamp
     | | timestamp       # a file storing the timestamp of the last active backup
     | | head            # a file storing a full copy of the last backed version of the file
+    | locks/    # a folder storing the lock files of "tracked.json" and of each backup folder
     | tracked.json  # a file linking the full path of each tracked file to its backup index
     ```
 
+    Backups of the same file are created one at a time, while backups of different files can be created at the same time, even by different processes.
+    Only assigning the backup index of a new tracked file locks "tracked.json" (see `_lock_tracked_files`), everything else only locks the backup folder (see `_lock_backup_index`).
+
     Parameters
     ----------
     file_path: str
@@ -766,9 +2190,13 @@ def create_global_backup(file_path: str, message: str = "") -> None:
     message: str, optional
         A message describing the current backup.
 
+    mode: str, None, optional
+        The diff mode used for the tracked file (see `get_file_changes`).
+        When given, it's saved to "tracked.json" and used for all subsequent backups of the file, otherwise the saved mode (or "auto") is used.
+
     Effects
     -------
-    Create a backup file at the "changes" directory for the tracked file and update "head", "timestamp", "checksums.json" and "messages.json".
+    Create a backup file at the "changes" directory and a signature at the "signatures" directory for the tracked file and update "head", "timestamp", "bases.json", "checksums.json" and "messages.json".
 
     If the file being backed up doesn't have a backup index or backup folder yet, a backup index will be assigned to it and added to "tracked.json".
     A backup folder will also be created along with all the other necessary files.
@@ -778,76 +2206,131 @@ def create_global_backup(file_path: str, message: str = "") -> None:
     NoChangesException
         If the content of the file being backed up is exactly equal to the content from the last backup.
     """
+    if mode is not None and mode not in DIFF_MODES:
+        raise ValueError(f"Invalid diff mode '{mode}', expected one of {DIFF_MODES}.")
+
     file_path = os.path.realpath(file_path)  # get the normalized absolute path of the file
-    timestamp = time.time_ns()  # get the timestamp of the backup
-
-    # get the list of tracked files and index of a possible new tracked file
-    tracked_list_manager = JSONManager(TRACKED_FILES_LIST_PATH, {"last": -1, "list": []})
-    tracked_list = tracked_list_manager.read()
-    next_entry = tracked_list["last"] + 1
-
-    # check if a backup already exists for the file and get its index
-    backup_exists = False
-    backup_index = next_entry
-    for backup in tracked_list["list"]:
-        if backup["path"] == file_path:
-            backup_exists = True
-            backup_index = backup["index"]
-
-    # get the appropriate directory for backups of the selected file and the
-    # exact path where the new backup and head will be stored
-    backups_dir = os.path.join(BACKUP_DATA_DIR, f"{backup_index}/")
+
+    with _lock_tracked_files():
+        # get the list of tracked files and index of a possible new tracked file
+        tracked_list_manager = JSONManager(_get_path("TRACKED_FILES_LIST_PATH"), {"last": -1, "list": []}, _get_metadata_cache())
+        tracked_list = tracked_list_manager.read()
+        next_entry = tracked_list["last"] + 1
+
+        # check if a backup already exists for the file and get its index
+        backup_exists = False
+        backup_index = next_entry
+        tracked_entry = {"index": backup_index, "path": file_path}
+        for backup in tracked_list["list"]:
+            if backup["path"] == file_path:
+                backup_exists = True
+                backup_index = backup["index"]
+                tracked_entry = backup
+
+        # save the diff mode of the file if a new one was given
+        # (the read list is shared with the metadata cache, so the changes are saved as a new list)
+        if mode is not None and mode != tracked_entry.get("mode", "auto"):
+            tracked_entry = {**tracked_entry, "mode": mode}
+            if backup_exists:
+                tracked_list_manager.save({**tracked_list, "list": [tracked_entry if entry["index"] == backup_index else entry for entry in tracked_list["list"]]})
+
+        # get the appropriate directory for backups of the selected file and the
+        # exact path where the head will be stored
+        backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), f"{backup_index}/")
+        head_file_path = os.path.join(backups_dir, "head")
+
+        # if the file is being backed up for the first time
+        if not backup_exists:
+            # create backup directory
+            os.makedirs(os.path.join(backups_dir, "changes"), exist_ok=True)
+
+            # creat an empty head file
+            open(head_file_path, "wb").close()
+
+            # add the new file to the list of backups
+            tracked_list_manager.save({**tracked_list, "last": backup_index, "list": [*tracked_list["list"], tracked_entry]})
+
+    with _lock_backup_index(backup_index):
+        _create_global_backup(file_path, message, backup_index, tracked_entry.get("mode", "auto"))
+
+
+def _create_global_backup(file_path: str, message: str, backup_index: int, mode: str) -> None:
+    """Create the backup of a tracked file once its backup index is assigned, while holding the lock of its backup folder (see `create_global_backup`)."""
+    # the timestamp is only taken once the lock is held, so backups of the same file are always ordered
+    timestamp = time.time_ns()
+
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), f"{backup_index}/")
     new_backup_path = os.path.join(backups_dir, f"changes/{timestamp}")
     head_file_path = os.path.join(backups_dir, "head")
+    pending_dir = os.path.join(backups_dir, "pending")
+    pending_backup_path = os.path.join(pending_dir, str(timestamp))
+    pending_head_path = os.path.join(pending_dir, f"{timestamp}.head")
+
+    # check if the file changed since the last backup
+    checksum = get_file_checksum(file_path)
+    backup_list = list_file_backups(backup_index)  # listed again since another backup of the file may have been created before the lock was acquired
+    if backup_list and checksum == get_checksum(backup_index, backup_list[-1]):
+        raise BackupExceptions.NoChangesException("The file is exactly the same as the last backup.")
 
-    # if the file is being backed up for the first time
-    if not backup_exists:
-        # create backup directory
-        os.makedirs(os.path.dirname(new_backup_path), exist_ok=True)
-
-        # creat an empty head file
-        open(head_file_path, "wb").close()
-
-        # add the new file to the list of backups
-        new_backup = {"index": backup_index, "path": file_path}
-        tracked_list["list"].append(new_backup)
-        tracked_list["last"] = backup_index
-        tracked_list_manager.save(tracked_list)
+    # choose the version used as base for the new backup
+    signature = get_signature(file_path)
+    base = _choose_backup_base(backup_index, backup_list, signature)
 
     # create a temporary backup file
     with tempfile.TemporaryDirectory() as temp_dir:
+        # use head directly if it's the base, otherwise restore the base to a temporary file
+        base_file_path = head_file_path
+        if backup_list and base != backup_list[-1]:
+            base_file_path = os.path.join(temp_dir, "base")
+            _reconstruct_version(backup_index, base, base_file_path)
+
         # create backup
+        # the backup may be empty if the file went back to the exact content of its base
+        changes = get_file_changes(base_file_path, file_path, mode)
+        if not changes and not backup_list:
+            raise BackupExceptions.NoChangesException("The file is exactly the same as the last backup.")
         temp_bak_path = os.path.join(temp_dir, "bak")
-        create_backup(head_file_path, file_path, temp_bak_path)
-
-        # copy temporary backup to its approrpiate path
-        shutil.move(temp_bak_path, new_backup_path)
-
-    # save backup checksum
-    with open(file_path, "rb") as file:
-        # get checksum
-        checksum = hashlib.sha256(file.read()).hexdigest()
-
-        # read checksums.json
-        checksums_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "checksums.json")
-        checksums_manager = JSONManager(checksums_path, {})
-        checksums_json = checksums_manager.read()
-
-        # save the new checksum to checksums.json
-        checksums_json.update({str(timestamp): checksum})
-        checksums_manager.save(checksums_json)
-
-    # save backup message
+        write_backup(changes, temp_bak_path)
+
+        # move the temporary backup next to the others, where it waits until its record is on the journal
+        os.makedirs(pending_dir, exist_ok=True)
+        shutil.move(temp_bak_path, pending_backup_path)
+
+    # save the signature of the new version
+    signatures_dir = os.path.join(backups_dir, "signatures")
+    os.makedirs(signatures_dir, exist_ok=True)
+    with open(os.path.join(signatures_dir, str(timestamp)), "wb") as signature_file:
+        signature.tofile(signature_file)
+
+    # copy current version of the file next to the new backup, to become the new head
+    shutil.copy(file_path, pending_head_path)
+    if get_settings()["journal_fsync"] == "always":
+        _sync_file(pending_backup_path)
+        _sync_file(pending_head_path)
+
+    # save the base, checksum and message of the backup, which is the moment the backup is created
+    # if interrupted after this, the backup is finished the next time the backup folder is locked (see `_recover_backup_index`)
+    record = {"op": "create", "index": backup_index, "timestamp": timestamp, "base": base, "checksum": checksum}
     if message:
-        create_backup_message(backup_index, timestamp, message)
+        record["message"] = message
 
-    # copy current version of the file to head
-    shutil.copy(file_path, head_file_path)
+    # the stats of the backup follow from the ones of its base, which backups created before stats existed don't have yet (see `get_backup_stats`)
+    base_stats = _read_metadata(backup_index, "stats.json").get(str(base)) if base is not None else {"chain": 0, "restore": 0}
+    if base_stats is not None:
+        size = os.path.getsize(pending_backup_path)
+        record["stats"] = {"size": size, "file_size": os.path.getsize(pending_head_path), "chain": base_stats["chain"] + 1, "restore": base_stats["restore"] + size}
+    _append_journal(record)
 
-    # update current timestamp
-    curr_timestamp_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "timestamp")
-    with open(curr_timestamp_path, "w") as curr_timestamp:
-        curr_timestamp.write(str(timestamp))
+    # move the backup and head in place and update current timestamp
+    os.replace(pending_head_path, head_file_path)
+    os.replace(pending_backup_path, new_backup_path)
+    _write_current_timestamp(backup_index, timestamp)
+    os.rmdir(pending_dir)
+
+    # pack the loose backups once there are too many of them
+    changes_dir = os.path.dirname(new_backup_path)
+    if len(_get_changes_index(changes_dir).loose) >= PACK_THRESHOLD:
+        _pack_backups(changes_dir)
 
 
 # TODO: make it also work form newest to oldest backup
@@ -857,8 +2340,8 @@ def restore_global_backup(backup_index: int, timestamp: int, unsaved_changes_ok:
     See `create_global_backup`for more information on how global backups work.
 
     This function starts by checking if the backup exists and the file being restored doesn't contain unsaved changes, which is done by comparing its checksum to the checksum of the current active backup, avoiding accidently overwriting any new data.
-    After that, it starts the reconstruction by geting a list of all the backups within the "changes" directory and searching for the one with the specified timestamp, this list is then sliced and only the timestamps necessary to reconstruct the target backup are left.
-    This new list is then iterated through and each backup is restored sequentially up until the target backup.
+    After that, it starts the reconstruction by geting the chain of backups necessary to reconstruct the target backup, found by following the base of each backup (see `get_backup_chain`).
+    This chain is then iterated through and each backup is restored sequentially up until the target backup.
     The function finishes by changing the value of the current active backup to the one that was just restored by updating the "timestamp" file.
 
     Parameters
@@ -889,98 +2372,2059 @@ def restore_global_backup(backup_index: int, timestamp: int, unsaved_changes_ok:
     UnsavedChangesException
         If the file being restored contains unsaved changes.
     """
-    # check if the given backup exists
-    timestamp_exists(backup_index, timestamp)
+    # lock the backup folder so the file isn't backed up while being restored
+    with _lock_backup_index(backup_index):
+        # check if the given backup exists
+        timestamp_exists(backup_index, timestamp)
 
-    # get path to the original file
-    for file in list_tracked_files():
-        if file["index"] == backup_index:
-            file_path = file["path"]
+        # get path to the original file
+        file_path = get_tracked_path(backup_index)
 
-    # check if there's unsaved changes
-    if not unsaved_changes_ok:
-        # get checksum of the original file before being restored
-        with open(file_path, "rb") as original_file:
-            original_checksum = hashlib.sha256(original_file.read()).hexdigest()
+        # check if there's unsaved changes
+        if not unsaved_changes_ok:
+            # get checksum of the original file before being restored
+            original_checksum = get_file_checksum(file_path)
 
-        # get current timestamp
-        curr_timestamp_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "timestamp")
-        with open(curr_timestamp_path, "r") as curr_timestamp_file:
-            curr_timestamp = int(curr_timestamp_file.read())
+            # get current timestamp
+            curr_timestamp = _get_current_timestamp(backup_index)
 
-        # get checksum of the current backup
-        backup_checksum = get_checksum(backup_index, curr_timestamp)
+            # get checksum of the current backup
+            backup_checksum = get_checksum(backup_index, curr_timestamp)
 
-        # check if the checksums are different
-        if original_checksum != backup_checksum:
-            raise BackupExceptions.UnsavedChangesException("The original file contains unsaved changes")
+            # check if the checksums are different
+            if original_checksum != backup_checksum:
+                raise BackupExceptions.UnsavedChangesException("The original file contains unsaved changes")
 
-    # get dir where the backups are stored
-    backups_dir = os.path.join(BACKUP_DATA_DIR, f"{backup_index}/changes/")
+        # apply all backups on the chain of the target backup to a temporary file
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_file = os.path.join(temp_dir, "temp")
+            _reconstruct_version(backup_index, timestamp, temp_file)
 
-    # get list of steps untill the target backup
-    backup_list = list_file_backups(backup_index)
-    for i, backup in enumerate(backup_list):
-        if backup == timestamp:
-            break
-    backup_steps = backup_list[0 : i + 1]
+            shutil.copy(temp_file, file_path)
 
-    # apply all backups in sequence from oldest to newest
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # save changes to a temporary file
-        temp_file = os.path.join(temp_dir, "temp")
-        open(temp_file, "wb").close()
-        for backup in backup_steps:
-            backup_path = os.path.join(backups_dir, str(backup))
-            restore_backup(backup_path, temp_file)
+        # update current timestamp
+        _append_journal({"op": "restore", "index": backup_index, "timestamp": timestamp})
+        _write_current_timestamp(backup_index, timestamp)
 
-        shutil.copy(temp_file, file_path)
 
-    # update current timestamp
-    curr_timestamp_path = os.path.join(BACKUP_DATA_DIR, str(backup_index), "timestamp")
-    with open(curr_timestamp_path, "w") as curr_timestamp:
-        curr_timestamp.write(str(timestamp))
+def iter_global_backup(backup_index: int, timestamp: int, block_size: int | None = None) -> Iterator[bytes]:
+    """Get the content of a version of a globally tracked file in blocks, without modifying the tracked file or the backups.
 
+    The base of the version is reconstructed into a temporary file (see `get_backup_chain`) and the content of the version is then produced while its backup is applied (see `iter_applied_changes`).
+    The last version is read directly from head.
 
-def migrate_global_backups(new_dir: str | None = None) -> None:
-    """Move global backups to some other folder.
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the backup belongs.
 
-    Parameters
-    ----------
-    new_dir: str, None, optional
-        The path of the folder to where the backups will be moved.
-        If omited, the backups will move back to the default directory.
+    timestamp: int
+        The timestamp of the version being read.
 
-    Effects
-    -------
-    Moves all the global backups to the specified folder.
+    block_size: int, None, optional
+        The maximum size of each block.
+        If omited, the "read_block_size" setting is used (see `get_settings`).
 
-    Creates a file named "new_dir.txt" inside the original directory to reference the new directory.
+    Yields
+    ------
+    bytes
+        The next block of the version.
 
-    Deletes the "new_dir.txt" file if moving back to the default directory instead.
+    Raises
+    ------
+    TimestampNotFound
+        If the timestamp is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
     """
-    # move backups to the new directory
-    if new_dir is not None:
-        new_dir = os.path.realpath(new_dir)
-        shutil.move(BACKUP_DATA_DIR, new_dir)
-        with open(NEW_DIR_FILE_PATH, "w", encoding="utf8") as new_dir_file:
-            new_dir_file.write(new_dir)
+    chain = get_backup_chain(backup_index, timestamp)
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+    block_size = block_size or get_settings()["read_block_size"]
 
-    # move backups to the default location if new_dir is None
-    else:
-        shutil.move(BACKUP_DATA_DIR, DEFAULT_BACKUP_DATA_DIR)
-        os.remove(NEW_DIR_FILE_PATH)
+    # the last version is always stored as head
+    if timestamp == list_file_backups(backup_index)[-1]:
+        with open(os.path.join(backups_dir, "head"), "rb") as head_file:
+            while block := head_file.read(block_size):
+                yield block
+        return
 
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # reconstruct the base of the version
+        base_file_path = os.path.join(temp_dir, "base")
+        if len(chain) > 1:
+            _reconstruct_version(backup_index, chain[-2], base_file_path)
+        else:
+            open(base_file_path, "wb").close()
 
-def main():
-    # arguments setup
-    parser = argparse.ArgumentParser()
-    subparser = parser.add_subparsers(dest="action", help="avaliable commands:")
+        # apply the last backup while yielding the result
+        changes = read_backup(_get_backup_file(os.path.join(backups_dir, "changes"), timestamp))
+        yield from iter_applied_changes(changes, base_file_path, block_size)
 
-    # arguments for creating backup
-    create_parser = subparser.add_parser("create", help="creates a new backup")
-    create_parser.add_argument("path_or_index", type=str, help="the path or backup index of the file being backed up")
-    create_parser.add_argument("message", nargs="?", type=str, help="message describing what changed")
+
+def cat_global_backup(backup_index: int, timestamp: int, output: "str | typing.BinaryIO | None" = None) -> None:
+    """Write a version of a globally tracked file to stdout, a file object or a path, without modifying the tracked file or the backups.
+
+    See `iter_global_backup` for more information on how the version is read.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the backup belongs.
+
+    timestamp: int
+        The timestamp of the version being written.
+
+    output: str, BinaryIO, None, optional
+        The path or binary file object where the version will be written to.
+        If omited, the version is written to stdout.
+
+    Raises
+    ------
+    TimestampNotFound
+        If the timestamp is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    if isinstance(output, str):
+        with open(output, "wb") as output_file:
+            cat_global_backup(backup_index, timestamp, output_file)
+        return
+
+    if output is None:
+        output = sys.stdout.buffer
+
+    for block in iter_global_backup(backup_index, timestamp):
+        output.write(block)
+        output.flush()
+
+
+def get_change_segments(changes: ChangeSet) -> tuple[array, array, array]:
+    """Map the changed file to the sections of the original file and the payload it's made out of.
+
+    The changed file is split into segments, each one either copied from the original file or added by a change.
+    The segments are returned as three parallel arrays:
+    - the position where each segment starts on the changed file, which works as a cumulative offset index that can be searched with `bisect`;
+    - the type of the segment (`types.RMV.value` for sections copied from the original file and `types.ADD.value` for added content);
+    - the position where the segment starts on the original file or on the payload, depending on its type.
+
+    The size of each segment is the distance to the next one, the last segment is always a copy of everything left on the original file.
+    """
+    starts = array("q")
+    segment_types = array("b")
+    sources = array("q")
+
+    new_pos = 0
+    old_pos = 0
+    for i in range(len(changes)):
+        # copy the unchanged section before the change
+        position = changes.positions[i]
+        if position > old_pos:
+            starts.append(new_pos)
+            segment_types.append(types.RMV.value)
+            sources.append(old_pos)
+            new_pos += position - old_pos
+            old_pos = position
+
+        # add the new content or skip the removed one
+        if changes.types[i] == types.ADD.value:
+            starts.append(new_pos)
+            segment_types.append(types.ADD.value)
+            sources.append(changes.offsets[i])
+            new_pos += changes.sizes[i]
+        else:
+            old_pos += changes.sizes[i]
+
+    # copy everything after the last change
+    starts.append(new_pos)
+    segment_types.append(types.RMV.value)
+    sources.append(old_pos)
+
+    return starts, segment_types, sources
+
+
+def read_backup_range(backup_index: int, timestamp: int, offset: int, length: int | None = None) -> bytes:
+    """Read a section of a version of a globally tracked file without reconstructing the whole version.
+
+    The section is mapped back through the chain of the version (see `get_backup_chain`) one backup at a time, starting from the version itself.
+    On each backup, the sections still needed are split using the segments of the backup (see `get_change_segments`): the ones added by the backup are read from its payload and the others become sections of its base, to be read from the next backup.
+    This way only the instructions of each backup and the parts of the payload actually needed are read, no version is ever reconstructed.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the backup belongs.
+
+    timestamp: int
+        The timestamp of the version being read.
+
+    offset: int
+        The position where the section starts.
+
+    length: int, None, optional
+        The size of the section. If omited, everything from the offset until the end of the version is read.
+
+    Returns
+    -------
+    bytes
+        The content of the section, which will be shorter than the given length if the version ends before it.
+
+    Raises
+    ------
+    TimestampNotFound
+        If the timestamp is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("The offset and length of the section can't be negative.")
+
+    chain = get_backup_chain(backup_index, timestamp)
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+
+    # the last version is always stored as head
+    if timestamp == list_file_backups(backup_index)[-1]:
+        with open(os.path.join(backups_dir, "head"), "rb") as head_file:
+            head_file.seek(offset)
+            return head_file.read(-1 if length is None else length)
+
+    # every piece is either content already read or a (start, end) section of the version of the current backup
+    end = sys.maxsize if length is None else offset + length
+    pieces = [(offset, end)]
+    for step in reversed(chain):
+        if all(isinstance(piece, bytes) for piece in pieces):
+            break
+
+        with zipfile.ZipFile(_get_backup_file(os.path.join(backups_dir, "changes"), step), "r") as zip_file:
+            instructions = zip_file.read("instructions").split()
+            changes = ChangeSet(array("b", map(int, instructions[0::3])), array("q", map(int, instructions[1::3])), array("q", map(int, instructions[2::3])), b"")
+            starts, segment_types, sources = get_change_segments(changes)
+
+            # split the sections into sections of the base and sections of the payload
+            new_pieces = []
+            payload_reads = []  # (payload position, size, index on new_pieces)
+            for piece in pieces:
+                if isinstance(piece, bytes):
+                    new_pieces.append(piece)
+                    continue
+
+                piece_start, piece_end = piece
+                if piece_start >= piece_end:
+                    continue
+
+                segment = bisect.bisect_right(starts, piece_start) - 1
+                while segment < len(starts) and starts[segment] < piece_end:
+                    segment_end = starts[segment + 1] if segment + 1 < len(starts) else sys.maxsize
+                    section_start = max(piece_start, starts[segment])
+                    section_end = min(piece_end, segment_end)
+                    source_start = sources[segment] + section_start - starts[segment]
+
+                    if segment_types[segment] == types.ADD.value:
+                        payload_reads.append((source_start, section_end - section_start, len(new_pieces)))
+                        new_pieces.append(b"")
+                    elif new_pieces and isinstance(new_pieces[-1], tuple) and new_pieces[-1][1] == source_start:
+                        new_pieces[-1] = (new_pieces[-1][0], source_start + section_end - section_start)
+                    else:
+                        new_pieces.append((source_start, source_start + section_end - section_start))
+
+                    segment += 1
+
+            # read the needed parts of the payload in order
+            if payload_reads:
+                with zip_file.open("changes") as payload_file:
+                    for position, size, piece_index in sorted(payload_reads):
+                        payload_file.seek(position)
+                        new_pieces[piece_index] = payload_file.read(size)
+
+        pieces = new_pieces
+
+    # sections left after the first backup are past the end of the version
+    return b"".join(piece for piece in pieces if isinstance(piece, bytes))
+
+
+def get_backup_changes(backup_index: int, old_timestamp: int, new_timestamp: int) -> ChangeSet:
+    """Get the changes between two versions of a globally tracked file from its backups, without reconstructing either version.
+
+    Both versions are reached from the last version their chains have in common (see `get_backup_chain`): the backups on the way to each version are merged into a single change set (see `compose_changes`), and the changes towards the old version are reversed (see `invert_changes`) and merged with the ones towards the new version.
+    When the old version is on the chain of the new one, as consecutive versions usually are, only the backups in between are read.
+    Versions on chains without any version in common (such as after a full copy was stored by `repack_global_backups`) are compared through an empty file, so their backups hold both versions whole.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the versions belong.
+
+    old_timestamp, new_timestamp: int
+        The timestamps of the versions being compared.
+
+    Returns
+    -------
+    ChangeSet
+        The changes from the old version to the new one.
+
+    Raises
+    ------
+    TimestampNotFound
+        If any of the timestamps is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    old_chain = get_backup_chain(backup_index, old_timestamp)
+    new_chain = get_backup_chain(backup_index, new_timestamp)
+    changes_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "changes")
+
+    # skip the versions both chains have in common
+    shared = 0
+    while shared < min(len(old_chain), len(new_chain)) and old_chain[shared] == new_chain[shared]:
+        shared += 1
+
+    def merge_backups(steps: list[int]) -> ChangeSet:
+        merged = ChangeSet()
+        for step in steps:
+            merged = compose_changes(merged, read_backup(_get_backup_file(changes_dir, step)))
+        return merged
+
+    with profiler.span("compose", backups=len(old_chain) + len(new_chain) - 2 * shared) as span:
+        changes = merge_backups(new_chain[shared:])
+        if len(old_chain) > shared:
+            changes = compose_changes(invert_changes(merge_backups(old_chain[shared:])), changes)
+        span.set(changes=len(changes))
+
+    return changes
+
+
+def iter_global_diff(backup_index: int, old_timestamp: int, new_timestamp: int, mode: str | None = None, context: int = DIFF_CONTEXT_LINES) -> Iterator[bytes]:
+    """Get the differences between two versions of a globally tracked file, without modifying the tracked file or the backups.
+
+    The changes between the versions are found from the backups alone (see `get_backup_changes`) and shown as:
+    - a unified diff for text, the same as `diff -u` would show, with `context` unchanged lines around each change;
+    - a summary for binary files, with the position and size of every section removed from the old version and added to the new one.
+    Binary diffs never reconstruct any version, while text diffs read the old version once to number its lines and show the unchanged ones (the new version is never reconstructed).
+    Since the old version is held in memory for that, versions larger than `TEXT_DIFF_MAX_SIZE` always get the binary summary.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the versions belong.
+
+    old_timestamp, new_timestamp: int
+        The timestamps of the versions being compared.
+
+    mode: str, None, optional
+        Either "text", "binary" or "auto", which shows a text diff if both versions look like text (see `is_text_file`).
+        Either way, the binary summary is shown if the old version is larger than `TEXT_DIFF_MAX_SIZE`.
+        If omited, the diff mode of the tracked file is used (see `create_global_backup`).
+
+    context: int, optional
+        How many unchanged lines are shown around each change on text diffs.
+
+    Yields
+    ------
+    bytes
+        The next lines of the diff, nothing if the versions are the same.
+
+    Raises
+    ------
+    TimestampNotFound
+        If any of the timestamps is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    mode = mode or _get_tracked_entry(backup_index).get("mode", "auto")
+    if mode not in DIFF_MODES:
+        raise ValueError(f"Invalid diff mode '{mode}', expected one of {DIFF_MODES}.")
+
+    changes = get_backup_changes(backup_index, old_timestamp, new_timestamp)
+    if not changes:
+        return
+
+    # text diffs hold the old version in memory, so larger ones are always shown as binary
+    if mode != "binary" and _get_version_size(backup_index, old_timestamp) > TEXT_DIFF_MAX_SIZE:
+        mode = "binary"
+
+    # only the start of each version is read to tell if it's text
+    if mode == "auto":
+        mode = "binary"
+        if _is_text_sample(read_backup_range(backup_index, old_timestamp, 0, TEXT_SAMPLE_SIZE)):
+            if _is_text_sample(read_backup_range(backup_index, new_timestamp, 0, TEXT_SAMPLE_SIZE)):
+                mode = "text"
+
+    path = get_tracked_path(backup_index)
+    yield f"--- {path}\t{date_from_ms(old_timestamp)} ({old_timestamp})\n".encode()
+    yield f"+++ {path}\t{date_from_ms(new_timestamp)} ({new_timestamp})\n".encode()
+
+    runs = list(_iter_change_runs(changes))
+    if mode == "binary":
+        removed = sum(len(run[2]) for run in runs)
+        added = sum(len(run[3]) for run in runs)
+        yield f"Binary versions differ in {len(runs)} sections: {removed} bytes removed and {added} bytes added\n".encode()
+        for old_position, new_position, removed_content, added_content in runs:
+            yield f"@@ -{old_position},{len(removed_content)} +{new_position},{len(added_content)} @@\n".encode()
+        return
+
+    old_content = b"".join(iter_global_backup(backup_index, old_timestamp))
+    yield from _iter_unified_diff(old_content, runs, context)
+
+
+def diff_global_backup(backup_index: int, old_timestamp: int, new_timestamp: int, output: "str | typing.BinaryIO | None" = None, mode: str | None = None, context: int = DIFF_CONTEXT_LINES) -> None:
+    """Write the differences between two versions of a globally tracked file to stdout, a file object or a path.
+
+    See `iter_global_diff` for more information on how the differences are found and shown.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file to which the versions belong.
+
+    old_timestamp, new_timestamp: int
+        The timestamps of the versions being compared.
+
+    output: str, BinaryIO, None, optional
+        The path or binary file object where the diff will be written to.
+        If omited, the diff is written to stdout.
+
+    mode, context: optional
+        How the differences are shown, see `iter_global_diff`.
+
+    Raises
+    ------
+    TimestampNotFound
+        If any of the timestamps is not found within the given backup index.
+
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    if isinstance(output, str):
+        with open(output, "wb") as output_file:
+            diff_global_backup(backup_index, old_timestamp, new_timestamp, output_file, mode, context)
+        return
+
+    if output is None:
+        output = sys.stdout.buffer
+
+    for block in iter_global_diff(backup_index, old_timestamp, new_timestamp, mode, context):
+        output.write(block)
+    output.flush()
+
+
+def _get_version_size(backup_index: int, timestamp: int) -> int:
+    """Get the size of a version of a tracked file from its stats (see `get_backup_stats`)."""
+    stats_json = _read_metadata(backup_index, "stats.json")
+    if str(timestamp) not in stats_json:
+        get_backup_stats(backup_index)
+        stats_json = _read_metadata(backup_index, "stats.json")
+
+    return stats_json[str(timestamp)]["file_size"]
+
+
+def _iter_change_runs(changes: ChangeSet) -> Iterator[tuple[int, int, bytes, bytes]]:
+    """Group the consecutive changes of a change set, yielding the position of each group on the original and on the changed file, the content it removes and the content it adds."""
+    old_position = new_position = 0
+    run = None
+    for operation, value in _change_operations(changes):
+        if operation == "keep":
+            if run is not None:
+                yield run[0], run[1], bytes(run[2]), bytes(run[3])
+                run = None
+            if value == sys.maxsize:
+                break
+            old_position += value
+            new_position += value
+            continue
+
+        if run is None:
+            run = (old_position, new_position, bytearray(), bytearray())
+        if operation == "add":
+            run[3].extend(value)
+            new_position += len(value)
+        else:
+            run[2].extend(value)
+            old_position += len(value)
+
+
+def _split_lines(content: bytes) -> list[bytes]:
+    """Split content into lines, keeping their line breaks (only "\n" ends a line, unlike `bytes.splitlines`)."""
+    lines = content.split(b"\n")
+    last = lines.pop()
+    lines = [line + b"\n" for line in lines]
+    if last:
+        lines.append(last)
+
+    return lines
+
+
+def _iter_unified_diff(old_content: bytes, runs: list[tuple[int, int, bytes, bytes]], context: int) -> Iterator[bytes]:
+    """Show the changes made to some content as the hunks of a unified diff, see `iter_global_diff`.
+
+    The groups of changes (see `_iter_change_runs`) are widened to whole lines of the old content, merging the ones that touch the same lines, and hunks are formed by the changed lines closer than `2 * context` lines to each other.
+    """
+
+    def at_line_start(position: int) -> bool:
+        return position == 0 or old_content[position - 1] == 10  # "\n"
+
+    # widen every group of changes to whole lines
+    groups = []  # [start, end, runs] on the old content
+    for run in runs:
+        start = old_content.rfind(b"\n", 0, run[0]) + 1
+        end = run[0] + len(run[2])
+        if not (start == run[0] and at_line_start(end) and (not run[3] or run[3].endswith(b"\n"))):
+            line_end = old_content.find(b"\n", end)
+            end = len(old_content) if line_end == -1 else line_end + 1
+
+        if groups and start < groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(run)
+        else:
+            groups.append([start, end, [run]])
+
+    # get the lines each group removes and adds, leaving out the ones that didn't change
+    edits = []  # (start, end, line number, old lines, new lines) on the old content
+    line_number = 0
+    counted = 0
+    for start, end, group_runs in groups:
+        new_section = bytearray()
+        position = start
+        for old_position, _, removed, added in group_runs:
+            new_section += old_content[position:old_position]
+            new_section += added
+            position = old_position + len(removed)
+        new_section += old_content[position:end]
+
+        old_lines = _split_lines(old_content[start:end])
+        new_lines = _split_lines(bytes(new_section))
+        while old_lines and new_lines and old_lines[0] == new_lines[0]:
+            start += len(old_lines.pop(0))
+            new_lines.pop(0)
+        while old_lines and new_lines and old_lines[-1] == new_lines[-1]:
+            end -= len(old_lines.pop())
+            new_lines.pop()
+        if not old_lines and not new_lines:
+            continue
+
+        line_number += old_content.count(b"\n", counted, start)
+        counted = start
+        edits.append((start, end, line_number, old_lines, new_lines))
+
+    # join the edits close to each other into hunks
+    hunks = []
+    for edit in edits:
+        if hunks and old_content.count(b"\n", hunks[-1][-1][1], edit[0]) <= 2 * context:
+            hunks[-1].append(edit)
+        else:
+            hunks.append([edit])
+
+    def format_lines(prefix: bytes, lines: list[bytes]) -> bytes:
+        formatted = b"".join(prefix + line for line in lines)
+        if lines and not lines[-1].endswith(b"\n"):
+            formatted += b"\n\\ No newline at end of file\n"
+        return formatted
+
+    offset = 0  # how many more lines the new content has before the current hunk
+    for hunk in hunks:
+        # get the unchanged lines around the hunk
+        before_start = hunk[0][0]
+        for _ in range(context):
+            if before_start == 0:
+                break
+            before_start = old_content.rfind(b"\n", 0, before_start - 1) + 1
+        before = _split_lines(old_content[before_start : hunk[0][0]])
+
+        after_end = hunk[-1][1]
+        for _ in range(context):
+            if after_end == len(old_content):
+                break
+            line_end = old_content.find(b"\n", after_end)
+            after_end = len(old_content) if line_end == -1 else line_end + 1
+        after = _split_lines(old_content[hunk[-1][1] : after_end])
+
+        body = [format_lines(b" ", before)]
+        old_count = new_count = len(before)
+        position = hunk[0][0]
+        for start, end, _, old_lines, new_lines in hunk:
+            unchanged = _split_lines(old_content[position:start])
+            body.append(format_lines(b" ", unchanged))
+            body.append(format_lines(b"-", old_lines))
+            body.append(format_lines(b"+", new_lines))
+            old_count += len(unchanged) + len(old_lines)
+            new_count += len(unchanged) + len(new_lines)
+            position = end
+        body.append(format_lines(b" ", after))
+        old_count += len(after)
+        new_count += len(after)
+
+        # lines are numbered from 1, empty sides point to the line before them and single lines leave out their count
+        old_start = hunk[0][2] - len(before)
+        new_start = old_start + offset
+        old_range = f"{old_start + 1}" if old_count == 1 else f"{old_start + 1 if old_count else old_start},{old_count}"
+        new_range = f"{new_start + 1}" if new_count == 1 else f"{new_start + 1 if new_count else new_start},{new_count}"
+        yield f"@@ -{old_range} +{new_range} @@\n".encode()
+        yield b"".join(body)
+
+        offset += sum(len(edit[4]) - len(edit[3]) for edit in hunk)
+
+
+def iter_file_versions(backup_index: int, timestamps: Iterable[int] | None = None) -> Iterator[tuple[int, str, str]]:
+    """Reconstruct the versions of a globally tracked file in order, restoring every backup only once.
+
+    Instead of restoring the chain of each version separately (see `get_backup_chain`), every version is restored from the already reconstructed version of its base, which is only kept in a temporary directory while some later version still needs it.
+    Each version is written in a single pass (see `iter_applied_changes`) and hashed while it's written.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file whose versions will be reconstructed.
+
+    timestamps: Iterable[int], None, optional
+        The timestamps of the versions to yield. Only these versions and the ones on their chains are reconstructed.
+        If omited, every version is yielded.
+
+    Yields
+    ------
+    tuple[int, str, str]
+        The timestamp of the version, the path of a temporary file containing it and its sha256 checksum, from oldest to newest.
+        The file is only valid until the next version is requested.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    bases = get_backup_bases(backup_index)
+    changes_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "changes")
+
+    yield from _iter_versions(bases, changes_dir, timestamps)
+
+
+def _iter_versions(bases: dict[int, int | None], changes_dir: str, timestamps: Iterable[int] | None = None) -> Iterator[tuple[int, str, str]]:
+    """Reconstruct versions from the given bases and directory of backups, see `iter_file_versions`."""
+    # get every version needed for the requested ones
+    wanted = set(bases) if timestamps is None else set(timestamps)
+    needed = set()
+    for timestamp in wanted:
+        while timestamp is not None and timestamp not in needed:
+            needed.add(timestamp)
+            timestamp = bases[timestamp]
+
+    # count how many versions still need each version as base
+    references = {}
+    for timestamp in needed:
+        references[bases[timestamp]] = references.get(bases[timestamp], 0) + 1
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        empty_file_path = os.path.join(temp_dir, "empty")
+        open(empty_file_path, "wb").close()
+
+        paths = {None: empty_file_path}
+        for timestamp in bases:
+            if timestamp not in needed:
+                continue
+
+            # restore the version from its base while hashing it
+            base = bases[timestamp]
+            version_path = os.path.join(temp_dir, str(timestamp))
+            changes = read_backup(_get_backup_file(changes_dir, timestamp))
+            checksum = hashlib.sha256()
+            with profiler.span("apply", changes=len(changes)):
+                with open(version_path, "wb") as version_file:
+                    for block in iter_applied_changes(changes, paths[base]):
+                        checksum.update(block)
+                        version_file.write(block)
+                profiler.count("hash.bytes", os.path.getsize(version_path))
+            paths[timestamp] = version_path
+
+            if timestamp in wanted:
+                yield timestamp, version_path, checksum.hexdigest()
+
+            # remove the versions that aren't needed anymore
+            references[base] -= 1
+            if base is not None and references[base] == 0:
+                os.remove(paths.pop(base))
+            if references.get(timestamp, 0) == 0:
+                os.remove(paths.pop(timestamp))
+
+
+def repack_global_backups(backup_index: int, keyframe_interval: int = KEYFRAME_INTERVAL) -> dict:
+    """Recreate every backup of a globally tracked file to reduce its size and the time it takes to restore.
+
+    Every version is reconstructed once, in order (see `iter_file_versions`), and a new backup is created for it against the best base among:
+    - an empty file, which results on a full copy of the version (a "keyframe");
+    - the last `BASE_CANDIDATES` versions, as long as the chain of the version doesn't get longer than `keyframe_interval`.
+    The best base is the one whose signature indicates the smallest backup (see `estimate_changes_size`), and each backup is saved with whichever compression results on the smallest file.
+
+    Every new backup is verified against "checksums.json" before anything is replaced.
+    The new backups are then swapped in place of the "changes" directory and "bases.json" together, in a way that can be finished by `list_file_backups` if the process is interrupted.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file being repacked.
+
+    keyframe_interval: int, optional
+        The maximum amount of backups needed to restore any version.
+
+    Returns
+    -------
+    dict
+        A report containing the amount of versions, the total size of the backups, the longest chain and the time it takes to restore the version with the longest chain, before and after the repack.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+
+    CorruptedBackupError
+        If any version doesn't match its checksum, either before or after being repacked.
+    """
+    # lock the backup folder so no backups are created while they're being repacked
+    with _lock_backup_index(backup_index):
+        # the metadata files are used directly from here on
+        _compact_journal()
+
+        backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+        changes_dir = os.path.join(backups_dir, "changes")
+        repack_dir = os.path.join(backups_dir, "changes.repack")
+        signatures_dir = os.path.join(backups_dir, "signatures")
+        mode = _get_tracked_entry(backup_index).get("mode", "auto")
+
+        report = {"index": backup_index, "versions": len(list_file_backups(backup_index))}
+        report.update(_measure_backups(backup_index, "before"))
+
+        # remove leftovers from an interrupted repack
+        shutil.rmtree(repack_dir, ignore_errors=True)
+        os.makedirs(repack_dir)
+        os.makedirs(signatures_dir, exist_ok=True)
+
+        checksums_manager = JSONManager(os.path.join(backups_dir, "checksums.json"), {}, _get_metadata_cache())
+        checksums_json = checksums_manager.read()
+
+        new_bases = {}
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                empty_file_path = os.path.join(temp_dir, "empty")
+                open(empty_file_path, "wb").close()
+
+                candidates = []  # (timestamp, path, signature, chain length) of the last versions
+                for timestamp, version_path, version_checksum in iter_file_versions(backup_index):
+                    checksum = checksums_json[str(timestamp)]
+                    if version_checksum != checksum:
+                        raise BackupExceptions.CorruptedBackupError(f"The backup with timestamp '{timestamp}' of the file '{get_tracked_path(backup_index)}' doesn't match its checksum.")
+
+                    # get the signature of the version, saving it for backups created before signatures existed
+                    signature_path = os.path.join(signatures_dir, str(timestamp))
+                    if os.path.exists(signature_path):
+                        signature = _read_signature(signature_path)
+                    else:
+                        signature = get_signature(version_path)
+                        with open(signature_path, "wb") as signature_file:
+                            signature.tofile(signature_file)
+
+                    # choose the best base, starting with a full copy
+                    base, base_path, chain_length = None, empty_file_path, 1
+                    best_size = estimate_changes_size(array("Q"), signature)
+                    for candidate, candidate_path, candidate_signature, candidate_chain_length in reversed(candidates):
+                        candidate_size = estimate_changes_size(candidate_signature, signature)
+                        if candidate_chain_length < keyframe_interval and candidate_size < best_size:
+                            base, base_path, chain_length = candidate, candidate_path, candidate_chain_length + 1
+                            best_size = candidate_size
+
+                    # create the new backup
+                    changes = get_file_changes(base_path, version_path, mode)
+                    new_backup_path = os.path.join(repack_dir, str(timestamp))
+                    _write_smallest_backup(changes, new_backup_path)
+                    new_bases[str(timestamp)] = base
+
+                    # verify the new backup
+                    verify_path = os.path.join(temp_dir, "verify")
+                    restore_backup(new_backup_path, base_path, verify_path)
+                    if get_file_checksum(verify_path) != checksum:
+                        raise BackupExceptions.CorruptedBackupError(f"The repacked backup with timestamp '{timestamp}' of the file '{get_tracked_path(backup_index)}' doesn't match its checksum.")
+
+                    # keep the version as a candidate for the next ones
+                    candidate_path = os.path.join(temp_dir, str(timestamp))
+                    shutil.copy(version_path, candidate_path)
+                    candidates.append((timestamp, candidate_path, signature, chain_length))
+                    if len(candidates) > BASE_CANDIDATES:
+                        os.remove(candidates.pop(0)[1])
+
+            _pack_backups(repack_dir)
+
+        except BaseException:
+            shutil.rmtree(repack_dir, ignore_errors=True)
+            raise
+
+        # write the new bases and stats next to the current ones and swap everything in place
+        with open(os.path.join(backups_dir, "bases.json.repack"), "w", encoding="utf8") as bases_file:
+            bases_file.write(json.dumps(new_bases, indent=2))
+        _write_repacked_stats(backup_index, new_bases)
+        os.rename(changes_dir, os.path.join(backups_dir, "changes.old"))
+        _finish_repack(backups_dir)
+
+        report.update(_measure_backups(backup_index, "after"))
+        return report
+
+
+def _finish_repack(backups_dir: str) -> None:
+    """Finish swapping the backups created by `repack_global_backups` in place of the old ones.
+
+    The old "changes" directory is always moved away first, so its absence means the swap was interrupted and the new backups, bases and stats are complete.
+    """
+    for file_name in ("bases.json", "stats.json"):
+        repack_path = os.path.join(backups_dir, f"{file_name}.repack")
+        if os.path.exists(repack_path):
+            os.replace(repack_path, os.path.join(backups_dir, file_name))
+
+    os.rename(os.path.join(backups_dir, "changes.repack"), os.path.join(backups_dir, "changes"))
+    shutil.rmtree(os.path.join(backups_dir, "changes.old"), ignore_errors=True)
+
+
+def _write_repacked_stats(backup_index: int, new_bases: dict[str, int | None]) -> None:
+    """Write the stats of the backups created by `repack_global_backups` or `prune_global_backups` next to the current ones, to be swapped in place by `_finish_repack`."""
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+    file_sizes = {timestamp: entry["file_size"] for timestamp, entry in JSONManager(os.path.join(backups_dir, "stats.json"), {}, _get_metadata_cache()).read().items()}
+    bases = {int(timestamp): base for timestamp, base in new_bases.items()}
+    stats_json = _compute_backup_stats(bases, _ChangesIndex(os.path.join(backups_dir, "changes.repack")), file_sizes)
+
+    with open(os.path.join(backups_dir, "stats.json.repack"), "w", encoding="utf8") as stats_file:
+        stats_file.write(json.dumps(stats_json, indent=2))
+
+
+def _write_smallest_backup(changes: ChangeSet, backup_file: str) -> None:
+    """Save a change set to a backup file using the compression that results on the smallest file."""
+    best_size = None
+    for compression in (zipfile.ZIP_LZMA, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+        candidate_file = f"{backup_file}.{compression}"
+        write_backup(changes, candidate_file, compression)
+
+        candidate_size = os.path.getsize(candidate_file)
+        if best_size is None or candidate_size < best_size:
+            os.replace(candidate_file, backup_file)
+            best_size = candidate_size
+        else:
+            os.remove(candidate_file)
+
+
+def _measure_backups(backup_index: int, suffix: str) -> dict:
+    """Measure the total size of the backups of a tracked file, its longest chain and how long that chain takes to restore."""
+    changes_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index), "changes")
+    size = sum(os.path.getsize(os.path.join(changes_dir, backup)) for backup in os.listdir(changes_dir))
+
+    # find the version with the longest chain
+    bases = get_backup_bases(backup_index)
+    chain_lengths = {}
+    for timestamp, base in bases.items():
+        chain_lengths[timestamp] = chain_lengths.get(base, 0) + 1
+    longest = max(chain_lengths, key=chain_lengths.get)
+
+    # time the restoration of the longest chain, without using head
+    timer = time.perf_counter()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_file = os.path.join(temp_dir, "temp")
+        open(temp_file, "wb").close()
+        for step in get_backup_chain(backup_index, longest):
+            restore_backup(_get_backup_file(changes_dir, step), temp_file)
+    restore_time = time.perf_counter() - timer
+
+    return {f"size_{suffix}": size, f"longest_chain_{suffix}": chain_lengths[longest], f"restore_seconds_{suffix}": restore_time}
+
+
+def select_retained_backups(timestamps: Iterable[int], keep_last: int = 1, hourly: int = 0, daily: int = 0, weekly: int = 0) -> set[int]:
+    """Select which backups to keep using grandfather-father-son retention rules.
+
+    Besides the last `keep_last` backups, the newest backup of each of the last `hourly` hours, `daily` days and `weekly` weeks that have backups is kept.
+
+    Arguments
+    ---------
+    timestamps: Iterable[int]
+        The timestamps of all the backups.
+
+    keep_last: int, optional
+        How many of the most recent backups to keep.
+
+    hourly: int, optional
+        For how many hours (with backups) to keep the last backup of the hour.
+
+    daily: int, optional
+        For how many days (with backups) to keep the last backup of the day.
+
+    weekly: int, optional
+        For how many weeks (with backups) to keep the last backup of the week.
+
+    Returns
+    -------
+    set[int]
+        The timestamps of the backups that should be kept.
+    """
+    timestamps = sorted(timestamps, reverse=True)
+    retained = set(timestamps[:keep_last])
+
+    periods = (
+        (hourly, lambda date: (date.year, date.month, date.day, date.hour)),
+        (daily, lambda date: (date.year, date.month, date.day)),
+        (weekly, lambda date: date.isocalendar()[:2]),
+    )
+    for amount, get_period in periods:
+        seen_periods = set()
+        for timestamp in timestamps:
+            if len(seen_periods) >= amount:
+                break
+
+            # keep the newest backup of every period
+            period = get_period(date_from_ms(timestamp))
+            if period not in seen_periods:
+                seen_periods.add(period)
+                retained.add(timestamp)
+
+    return retained
+
+
+def prune_global_backups(backup_index: int, keep_last: int = 1, hourly: int = 0, daily: int = 0, weekly: int = 0, dry_run: bool = False, verify: bool = True) -> list[int]:
+    """Delete old backups of a globally tracked file according to retention rules, merging them into the backups that depend on them.
+
+    The backups to keep are chosen by `select_retained_backups`, the last backup and the current active backup are always kept.
+    Every kept backup whose base is going to be deleted is merged with the backups of the deleted versions it depends on (see `compose_changes`), so it's created against the closest kept version instead.
+    This shrinks both the storage used and the chains needed to restore the kept versions.
+
+    The new backups are swapped in place of the "changes" directory the same way as `repack_global_backups` does.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file being pruned.
+
+    keep_last, hourly, daily, weekly: int, optional
+        The retention rules, see `select_retained_backups`.
+
+    dry_run: bool, optional
+        If set to True, the backups that would be deleted are returned without deleting anything.
+
+    verify: bool, optional
+        If set to True, every kept version is checked against "checksums.json" before anything is replaced.
+
+    Returns
+    -------
+    list[int]
+        The timestamps of the deleted backups.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+
+    CorruptedBackupError
+        If any kept version doesn't match its checksum after being pruned.
+    """
+    # lock the backup folder so no backups are created while they're being pruned
+    with _lock_backup_index(backup_index):
+        # the metadata files are changed directly from here on
+        _compact_journal()
+
+        backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+        changes_dir = os.path.join(backups_dir, "changes")
+        repack_dir = os.path.join(backups_dir, "changes.repack")
+
+        # choose the backups to keep, including the last one (head) and the current active one
+        bases = get_backup_bases(backup_index)
+        backup_list = list(bases)
+        retained = select_retained_backups(backup_list, max(keep_last, 1), hourly, daily, weekly)
+        retained.add(_get_current_timestamp(backup_index))
+
+        dropped = [backup for backup in backup_list if backup not in retained]
+        if dry_run or not dropped:
+            return dropped
+
+        # create the new backups next to the current ones
+        shutil.rmtree(repack_dir, ignore_errors=True)
+        os.makedirs(repack_dir)
+        new_bases = {}
+        try:
+            for backup in backup_list:
+                if backup not in retained:
+                    continue
+
+                # get the deleted versions in between the backup and its closest kept ancestor
+                merged = [backup]
+                base = bases[backup]
+                while base is not None and base not in retained:
+                    merged.insert(0, base)
+                    base = bases[base]
+                new_bases[str(backup)] = base
+
+                # reuse backups that don't depend on any deleted version
+                new_backup_path = os.path.join(repack_dir, str(backup))
+                if len(merged) == 1:
+                    backup_file = _get_backup_file(changes_dir, backup)
+                    if not isinstance(backup_file, str):
+                        with open(new_backup_path, "wb") as new_backup_file:
+                            new_backup_file.write(backup_file.getbuffer())
+                        continue
+                    try:
+                        os.link(backup_file, new_backup_path)
+                    except OSError:
+                        shutil.copy(backup_file, new_backup_path)
+                    continue
+
+                # merge the backups of the deleted versions into the kept one
+                changes = read_backup(_get_backup_file(changes_dir, merged[0]))
+                for step in merged[1:]:
+                    changes = compose_changes(changes, read_backup(_get_backup_file(changes_dir, step)))
+                write_backup(changes, new_backup_path)
+
+            _pack_backups(repack_dir)
+
+            # check every kept version against its checksum
+            if verify:
+                checksums_manager = JSONManager(os.path.join(backups_dir, "checksums.json"), {}, _get_metadata_cache())
+                checksums_json = checksums_manager.read()
+                new_bases_list = {int(backup): base for backup, base in new_bases.items()}
+                for timestamp, version_path, version_checksum in _iter_versions(new_bases_list, repack_dir):
+                    if version_checksum != checksums_json[str(timestamp)]:
+                        raise BackupExceptions.CorruptedBackupError(f"The pruned backup with timestamp '{timestamp}' of the file '{get_tracked_path(backup_index)}' doesn't match its checksum.")
+
+        except BaseException:
+            shutil.rmtree(repack_dir, ignore_errors=True)
+            raise
+
+        # swap the new backups, bases and stats in place
+        with open(os.path.join(backups_dir, "bases.json.repack"), "w", encoding="utf8") as bases_file:
+            bases_file.write(json.dumps(new_bases, indent=2))
+        _write_repacked_stats(backup_index, new_bases)
+        os.rename(changes_dir, os.path.join(backups_dir, "changes.old"))
+        _finish_repack(backups_dir)
+
+        # remove the metadata of the deleted backups
+        dropped_keys = {str(backup) for backup in dropped}
+        for file_name in ("checksums.json", "messages.json"):
+            metadata_manager = JSONManager(os.path.join(backups_dir, file_name), {}, _get_metadata_cache())
+            metadata_manager.save({timestamp: value for timestamp, value in metadata_manager.read().items() if timestamp not in dropped_keys})
+
+        for backup in dropped:
+            try:
+                os.remove(os.path.join(backups_dir, "signatures", str(backup)))
+            except FileNotFoundError:
+                pass
+
+        return dropped
+
+
+def verify_global_backups(backup_index: int, sample: int | None = None) -> dict:
+    """Check if the versions of a globally tracked file still match their checksums, without modifying anything.
+
+    Every version is reconstructed and hashed a single time, in order, while walking the chains of the file (see `iter_file_versions`).
+    Head is also checked against the checksum of the last version.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file being verified.
+
+    sample: int, None, optional
+        If given, only this many randomly chosen versions (and the ones on their chains) are reconstructed.
+
+    Returns
+    -------
+    dict
+        A report containing the amount of versions checked, the timestamps of the ones that don't match their checksums, whether head matches, the error that stopped the verification (if any), the amount of bytes reconstructed, the time it took and the resulting throughput.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    timer = time.perf_counter()
+    backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+    backup_list = list_file_backups(backup_index)
+    checksums_json = _read_metadata(backup_index, "checksums.json")
+
+    timestamps = backup_list
+    if sample is not None and sample < len(backup_list):
+        timestamps = sorted(random.sample(backup_list, sample))
+
+    report = {"index": backup_index, "versions": len(backup_list), "checked": 0, "failed": [], "head_ok": None, "error": None, "bytes": 0}
+
+    # check head against the last version
+    if backup_list:
+        report["head_ok"] = get_file_checksum(os.path.join(backups_dir, "head")) == checksums_json.get(str(backup_list[-1]))
+
+    # reconstruct and check every version, stopping if a backup can't be read
+    try:
+        for timestamp, version_path, checksum in iter_file_versions(backup_index, timestamps):
+            report["checked"] += 1
+            report["bytes"] += os.path.getsize(version_path)
+            if checksum != checksums_json.get(str(timestamp)):
+                report["failed"].append(timestamp)
+    except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+
+    report["seconds"] = time.perf_counter() - timer
+    report["bytes_per_second"] = report["bytes"] / report["seconds"] if report["seconds"] else 0.0
+    report["ok"] = not report["failed"] and report["error"] is None and report["head_ok"] is not False
+
+    return report
+
+
+def verify_all_global_backups(backup_indexes: Iterable[int] | None = None, sample: int | None = None, workers: int | None = None) -> list[dict]:
+    """Verify several globally tracked files in parallel, spreading them across a pool of processes.
+
+    See `verify_global_backups` for more information on how each file is verified.
+
+    Arguments
+    ---------
+    backup_indexes: Iterable[int], None, optional
+        The backup indexes of the files being verified. If omited, every tracked file is verified.
+
+    sample: int, None, optional
+        How many randomly chosen versions to check on each file, see `verify_global_backups`.
+
+    workers: int, None, optional
+        The maximum amount of processes used. If omited, the amount of CPUs is used.
+
+    Returns
+    -------
+    list[dict]
+        The report of each file, in the same order as the given indexes.
+    """
+    if backup_indexes is None:
+        backup_indexes = [file["index"] for file in list_tracked_files()]
+    backup_indexes = list(backup_indexes)
+
+    if len(backup_indexes) <= 1 or workers == 1:
+        return [verify_global_backups(backup_index, sample) for backup_index in backup_indexes]
+
+    # each process needs to know where the backups are, since they might not be at the default directory
+    with concurrent_futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_verify_worker, _get_path("BACKUP_DATA_DIR"), _get_path("TRACKED_FILES_LIST_PATH"), backup_index, sample) for backup_index in backup_indexes]
+        return [future.result() for future in futures]
+
+
+def _verify_worker(backup_data_dir: str, tracked_files_list_path: str, backup_index: int, sample: int | None) -> dict:
+    """Verify a single file from a worker process of `verify_all_global_backups`."""
+    global BACKUP_DATA_DIR, TRACKED_FILES_LIST_PATH
+    BACKUP_DATA_DIR = backup_data_dir
+    TRACKED_FILES_LIST_PATH = tracked_files_list_path
+
+    return verify_global_backups(backup_index, sample)
+
+
+def get_backup_stats(backup_index: int) -> dict:
+    """Get how much storage the backups of a globally tracked file use and how costly its versions are to restore.
+
+    The figures of every backup are saved along with its other metadata when it's created, on "stats.json" (see `_append_journal`): the size of the backup, the size of the version, the length of its chain since the last full copy (see `get_backup_chain`) and how many bytes of backups are read to restore it, which follow from the ones of its base.
+    `repack_global_backups` and `prune_global_backups` save them again for the backups they create, so getting the stats only adds them up, without reading any backup.
+    Backups created before stats existed (or imported from older bundles) are measured once, the first time the stats of their file are requested.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file whose stats need to be retrieved.
+
+    Returns
+    -------
+    dict
+        The index and path of the file, the amount of versions, the total and average size of its backups, the size of head, the total size of every version, the storage used (backups and head), the compression ratio (the size of every version divided by the storage used),
+        the length of the chain of the last version, the longest chain and how many bytes of backups are read to restore the costliest version.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    backup_list = list_file_backups(backup_index)
+    stats_json = _read_metadata(backup_index, "stats.json")
+
+    # measure the backups created before stats existed
+    if any(str(backup) not in stats_json for backup in backup_list):
+        with _lock_backup_index(backup_index):
+            _compact_journal()  # the metadata files are changed directly
+
+            backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+            stats_manager = JSONManager(os.path.join(backups_dir, "stats.json"), {}, _get_metadata_cache())
+            file_sizes = {timestamp: entry["file_size"] for timestamp, entry in stats_manager.read().items()}
+            bases = get_backup_bases(backup_index)
+            stats_json = _compute_backup_stats(bases, _get_changes_index(os.path.join(backups_dir, "changes")), file_sizes)
+            stats_manager.save(stats_json)
+            backup_list = list(bases)
+
+    entries = [stats_json[str(backup)] for backup in backup_list]
+    backups_size = sum(entry["size"] for entry in entries)
+    head_size = entries[-1]["file_size"] if entries else 0
+    versions_size = sum(entry["file_size"] for entry in entries)
+    stored_size = backups_size + head_size
+
+    return {
+        "index": backup_index,
+        "path": get_tracked_path(backup_index),
+        "versions": len(entries),
+        "backups_size": backups_size,
+        "average_backup_size": backups_size / len(entries) if entries else 0.0,
+        "head_size": head_size,
+        "versions_size": versions_size,
+        "stored_size": stored_size,
+        "compression_ratio": versions_size / stored_size if stored_size else 0.0,
+        "chain_length": entries[-1]["chain"] if entries else 0,
+        "longest_chain": max((entry["chain"] for entry in entries), default=0),
+        "restore_size": max((entry["restore"] for entry in entries), default=0),
+    }
+
+
+def _compute_backup_stats(bases: dict[int, int | None], changes_index: _ChangesIndex, file_sizes: dict[str, int]) -> dict[str, dict]:
+    """Measure the stats of every backup saved on "stats.json" (see `get_backup_stats`) from their bases and sizes.
+
+    The sizes of the versions are kept from `file_sizes`, since they don't change when backups are recreated, and the others are found by reading their backups, which hold how much they add and remove from their bases.
+    """
+    stats_json = {}
+    for timestamp, base in bases.items():
+        base_stats = stats_json[str(base)] if base is not None else {"file_size": 0, "chain": 0, "restore": 0}
+        size = changes_index.size(timestamp)
+
+        file_size = file_sizes.get(str(timestamp))
+        if file_size is None:
+            changes = read_backup(changes_index.open(timestamp))
+            file_size = base_stats["file_size"]
+            for change_type, change_size in zip(changes.types, changes.sizes):
+                file_size += change_size if change_type == types.ADD.value else -change_size
+
+        stats_json[str(timestamp)] = {"size": size, "file_size": file_size, "chain": base_stats["chain"] + 1, "restore": base_stats["restore"] + size}
+
+    return stats_json
+
+
+def export_global_backups(backup_index: int, output: "str | typing.BinaryIO | None" = None) -> None:
+    """Write every backup of a globally tracked file and its metadata to stdout, a file object or a path as a single bundle, which can be imported elsewhere by `import_global_backups`.
+
+    The bundle is a tar stream written in a single sequential pass, so it can be piped straight to another host.
+    Its first member is a manifest with the path and diff mode of the file, followed by the files of its backup folder (see `create_global_backup`) as they are, loose backups and pack files alike.
+    Its last member holds the sha256 checksum of every other member, computed while they're written.
+
+    Arguments
+    ---------
+    backup_index: int
+        The backup index of the file being exported.
+
+    output: str, BinaryIO, None, optional
+        The path or binary file object where the bundle will be written to.
+        If omited, the bundle is written to stdout.
+
+    Raises
+    ------
+    BackupNotFoundError
+        If the given backup index doesn't corespond to any of the tracked files.
+    """
+    if isinstance(output, str):
+        with open(output, "wb") as output_file:
+            export_global_backups(backup_index, output_file)
+        return
+
+    if output is None:
+        output = sys.stdout.buffer
+
+    tracked_entry = _get_tracked_entry(backup_index)
+    backup_list = list_file_backups(backup_index)
+
+    # lock the backup folder so the bundle has a consistent copy of it
+    block_size = get_settings()["read_block_size"]
+    with _lock_backup_index(backup_index), tarfile.open(fileobj=output, mode="w|", bufsize=block_size, copybufsize=block_size) as bundle:
+        _compact_journal()  # so the metadata files are complete
+        backups_dir = os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index))
+        manifest = {"format": BUNDLE_FORMAT, "index": backup_index, "path": tracked_entry["path"], "mode": tracked_entry.get("mode", "auto"), "versions": len(backup_list)}
+        _add_bundle_member(bundle, BUNDLE_MANIFEST, json.dumps(manifest, indent=2).encode())
+
+        # the metadata goes first so it can be checked against the backups while importing, and head goes last since it's checked against the metadata
+        names = [name for name in BUNDLE_METADATA if os.path.exists(os.path.join(backups_dir, name))]
+        for directory in ("signatures", "changes"):
+            if os.path.isdir(os.path.join(backups_dir, directory)):
+                names.extend(f"{directory}/{name}" for name in sorted(os.listdir(os.path.join(backups_dir, directory))) if not name.endswith(".tmp"))
+        names.append("head")
+
+        checksums = {}
+        with profiler.span("export", members=len(names)):
+            for name in names:
+                path = os.path.join(backups_dir, name)
+                with open(path, "rb") as member_file:
+                    reader = _HashingReader(member_file)
+                    bundle.addfile(bundle.gettarinfo(path, name), reader)
+                checksums[name] = reader.checksum.hexdigest()
+                profiler.count("export.bytes", reader.size)
+
+        _add_bundle_member(bundle, BUNDLE_CHECKSUMS, json.dumps(checksums, indent=2).encode())
+
+    output.flush()
+
+
+def import_global_backups(bundle: "str | typing.BinaryIO | None" = None, file_path: str | None = None) -> int:
+    """Add a tracked file with every backup from a bundle created by `export_global_backups`.
+
+    The bundle is read in a single sequential pass into a temporary folder inside the backup directory, checking every member against its checksum as it's written.
+    The checksum of head is also checked against the one of the last version on "checksums.json", so a bundle whose head doesn't match its backups is never imported.
+    Only after everything is checked does the folder get the next free backup index and the file get added to "tracked.json", so an interrupted or failed import leaves nothing behind.
+
+    Arguments
+    ---------
+    bundle: str, BinaryIO, None, optional
+        The path or binary file object the bundle is read from.
+        If omited, the bundle is read from stdin.
+
+    file_path: str, None, optional
+        The path the file is tracked at, by default the same path it had where it was exported from.
+
+    Returns
+    -------
+    int
+        The backup index assigned to the imported file.
+
+    Raises
+    ------
+    FileAlreadyTrackedError
+        If the file is already tracked.
+
+    CorruptedBackupError
+        If any member of the bundle doesn't match its checksum, or the bundle is incomplete.
+
+    ValueError
+        If the bundle isn't a bundle, or uses a newer format.
+    """
+    if isinstance(bundle, str):
+        with open(bundle, "rb") as bundle_file:
+            return import_global_backups(bundle_file, file_path)
+
+    if bundle is None:
+        bundle = sys.stdin.buffer
+
+    block_size = get_settings()["read_block_size"]
+    import_dir = tempfile.mkdtemp(prefix="import.", dir=_get_path("BACKUP_DATA_DIR"))
+    try:
+        with tarfile.open(fileobj=bundle, mode="r|", bufsize=block_size) as bundle_tar:
+            members = iter(bundle_tar)
+
+            # read the manifest
+            member = next(members, None)
+            if member is None or member.name != BUNDLE_MANIFEST:
+                raise ValueError("The given file isn't a backup bundle.")
+            manifest = json.loads(bundle_tar.extractfile(member).read())
+            if manifest["format"] > BUNDLE_FORMAT:
+                raise ValueError(f"The bundle uses format {manifest['format']}, but only formats up to {BUNDLE_FORMAT} can be imported.")
+
+            file_path = os.path.realpath(file_path or manifest["path"])
+            if _find_tracked_index(file_path) is not None:
+                raise BackupExceptions.FileAlreadyTrackedError(f"The file '{file_path}' is already tracked.")
+
+            # write every member while hashing it
+            checksums = {}
+            expected = None
+            with profiler.span("import") as span:
+                for member in members:
+                    if member.name == BUNDLE_CHECKSUMS:
+                        expected = json.loads(bundle_tar.extractfile(member).read())
+                        break
+
+                    # only accept files inside the backup folder
+                    name = os.path.normpath(member.name)
+                    if not member.isfile() or os.path.isabs(name) or name.startswith(".."):
+                        raise BackupExceptions.CorruptedBackupError(f"The bundle contains an invalid member '{member.name}'.")
+
+                    path = os.path.join(import_dir, name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    checksum = hashlib.sha256()
+                    member_file = bundle_tar.extractfile(member)
+                    with open(path, "wb") as output_file:
+                        while block := member_file.read(block_size):
+                            checksum.update(block)
+                            output_file.write(block)
+                    checksums[member.name] = checksum.hexdigest()
+                    profiler.count("import.bytes", member.size)
+                span.set(members=len(checksums))
+
+        # check every member and head against their checksums
+        if expected is None or expected != checksums:
+            damaged = sorted(name for name in set(expected or {}) | set(checksums) if (expected or {}).get(name) != checksums.get(name))
+            raise BackupExceptions.CorruptedBackupError(f"The bundle is incomplete or doesn't match its checksums: {', '.join(damaged) or 'missing checksums'}.")
+
+        version_checksums = JSONManager(os.path.join(import_dir, "checksums.json"), {}).read()
+        last_timestamp = max(int(timestamp) for timestamp in version_checksums) if version_checksums else None
+        if last_timestamp is not None and get_file_checksum(os.path.join(import_dir, "head")) != version_checksums[str(last_timestamp)]:
+            raise BackupExceptions.CorruptedBackupError("The head of the bundle doesn't match its last backup.")
+        os.makedirs(os.path.join(import_dir, "changes"), exist_ok=True)
+
+        # move the backups in place under a new backup index
+        with _lock_tracked_files():
+            tracked_list_manager = JSONManager(_get_path("TRACKED_FILES_LIST_PATH"), {"last": -1, "list": []}, _get_metadata_cache())
+            tracked_list = tracked_list_manager.read()
+            if any(entry["path"] == file_path for entry in tracked_list["list"]):
+                raise BackupExceptions.FileAlreadyTrackedError(f"The file '{file_path}' is already tracked.")
+
+            backup_index = tracked_list["last"] + 1
+            tracked_entry = {"index": backup_index, "path": file_path}
+            if manifest.get("mode", "auto") != "auto":
+                tracked_entry["mode"] = manifest["mode"]
+
+            os.rename(import_dir, os.path.join(_get_path("BACKUP_DATA_DIR"), str(backup_index)))
+            tracked_list_manager.save({**tracked_list, "last": backup_index, "list": [*tracked_list["list"], tracked_entry]})
+
+    except BaseException:
+        shutil.rmtree(import_dir, ignore_errors=True)
+        raise
+
+    return backup_index
+
+
+def _find_tracked_index(file_path: str) -> int | None:
+    """Get the backup index of a tracked file from its normalized path, or None if it isn't tracked."""
+    for entry in _read_tracked_list():
+        if entry["path"] == file_path:
+            return entry["index"]
+
+    return None
+
+
+def _add_bundle_member(bundle: "tarfile.TarFile", name: str, content: bytes) -> None:
+    """Add a member with the given content to a bundle being written."""
+    member = tarfile.TarInfo(name)
+    member.size = len(content)
+    member.mtime = int(time.time())
+    bundle.addfile(member, io.BytesIO(content))
+
+
+class _HashingReader:
+    """A binary file object that hashes everything read from another one."""
+
+    def __init__(self, file: "typing.BinaryIO"):
+        self.file = file
+        self.checksum = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        block = self.file.read(size)
+        self.checksum.update(block)
+        self.size += len(block)
+        return block
+
+
+def push_global_backups(target: "storage.StorageBackend | str", delete: bool = True) -> dict:
+    """Copy the backup directory to another storage backend, such as an object store, only sending what changed since the last push.
+
+    Each tracked file is copied while holding the lock of its backup folder (see `_lock_backup_index`), so every copy is consistent even while other backups are being created.
+    "tracked.json" is copied last, so the target never lists a file whose backups aren't there yet.
+    See `storage.sync` for more information on how files are copied.
+
+    Arguments
+    ---------
+    target: StorageBackend, str
+        The backend, url or directory the backups are copied to (see `storage.open_storage`).
+
+    delete: bool, optional
+        Whether to delete files of the backup folders on the target that don't exist locally anymore (such as pruned backups).
+
+    Returns
+    -------
+    dict
+        A report with how many files and bytes were copied and how many files were deleted.
+    """
+    if isinstance(target, str):
+        target = storage.open_storage(target)
+    source = storage.DirectoryBackend(_get_path("BACKUP_DATA_DIR"))
+
+    report = {"copied": 0, "bytes": 0, "deleted": 0}
+    for entry in list_tracked_files():
+        with _lock_backup_index(entry["index"]):
+            _compact_journal()  # so the metadata files are complete
+            _add_reports(report, storage.sync(source, target, f"{entry['index']}/", delete, _is_transient))
+
+    with _lock_tracked_files():
+        _add_reports(report, storage.sync(source, target, os.path.basename(_get_path("TRACKED_FILES_LIST_PATH"))))
+
+    return report
+
+
+def pull_global_backups(source: "storage.StorageBackend | str", delete: bool = True) -> dict:
+    """Copy backups pushed by `push_global_backups` back to the backup directory, only receiving what changed since the last pull.
+
+    Every tracked file of the source replaces the local one with the same backup index, and "tracked.json" is copied last, replacing the local list of tracked files.
+
+    Arguments
+    ---------
+    source: StorageBackend, str
+        The backend, url or directory the backups are copied from (see `storage.open_storage`).
+
+    delete: bool, optional
+        Whether to delete files of the local backup folders that don't exist on the source.
+
+    Returns
+    -------
+    dict
+        A report with how many files and bytes were copied and how many files were deleted.
+    """
+    if isinstance(source, str):
+        source = storage.open_storage(source)
+    target = storage.DirectoryBackend(_get_path("BACKUP_DATA_DIR"))
+    tracked_files_key = os.path.basename(_get_path("TRACKED_FILES_LIST_PATH"))
+
+    report = {"copied": 0, "bytes": 0, "deleted": 0}
+    for entry in json.loads(source.get(tracked_files_key))["list"]:
+        with _lock_backup_index(entry["index"]):
+            _compact_journal()  # so the metadata files are complete
+            _add_reports(report, storage.sync(source, target, f"{entry['index']}/", delete, _is_transient))
+
+    with _lock_tracked_files():
+        _add_reports(report, storage.sync(source, target, tracked_files_key))
+
+    return report
+
+
+def _is_transient(key: str) -> bool:
+    """Whether a file of the backup directory only exists while an operation is running, so it's never copied by `push_global_backups` and `pull_global_backups`."""
+    parts = key.split("/")
+    return parts[0] == "locks" or parts[0].startswith("import.") or "changes.repack" in parts or "changes.old" in parts or key.endswith((".tmp", ".repack"))
+
+
+def _add_reports(report: dict, other: dict) -> None:
+    for name in report:
+        report[name] += other[name]
+
+
+def get_settings() -> dict:
+    """Get the settings used by every operation, reading them from the config file saved by `tune_settings` on the first call.
+
+    Any setting missing from the config file (or all of them, if it doesn't exist) uses its value from `DEFAULT_SETTINGS`.
+    """
+    global _settings
+    if _settings is None:
+        settings = dict(DEFAULT_SETTINGS)
+        if os.path.exists(_get_path("CONFIG_FILE_PATH")):
+            config = JSONManager(_get_path("CONFIG_FILE_PATH"), {}).content
+            settings.update({name: value for name, value in config.items() if name in DEFAULT_SETTINGS})
+        _settings = settings
+
+    return _settings
+
+
+def save_settings(settings: dict) -> None:
+    """Save settings to the config file, where they're read from by `get_settings`, and start using them right away."""
+    global _settings
+    _settings = {**DEFAULT_SETTINGS, **{name: value for name, value in settings.items() if name in DEFAULT_SETTINGS}}
+    JSONManager(_get_path("CONFIG_FILE_PATH"), {}).save(_settings)
+
+
+def _best_time(function, repeat: int) -> float:
+    """Get the fastest time out of a few runs of a function."""
+    timings = []
+    for _ in range(repeat):
+        timer = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - timer)
+
+    return min(timings)
+
+
+def tune_settings(sample_size: int = TUNE_SAMPLE_SIZE, save: bool = True) -> dict:
+    """Find the settings that work best on this machine and backup directory by running a few short benchmarks, then save them to the config file (see `get_settings`).
+
+    A sample file is created inside the backup directory, so the storage where backups are kept is the one being measured. Then:
+    - every read block size is timed reading the sample file;
+    - every group size, and then every amount of workers, is timed applying thousands of small changes to the sample file;
+    - every compression preset is timed saving the whole sample file as a backup, and the one resulting on the smallest backup is chosen among the ones that aren't more than `TUNE_MAX_COMPRESSION_SLOWDOWN` times slower than the fastest.
+
+    Parameters
+    ----------
+    sample_size: int, optional
+        The size of the sample file, larger samples take longer but give more accurate results.
+
+    save: bool, optional
+        Whether the tuned settings are saved to the config file.
+
+    Returns
+    -------
+    dict
+        The tuned settings in "settings" and the time (and size, for compression) of every candidate in "measurements".
+    """
+    rng = random.Random(0)
+    measurements = {"read_block_size": {}, "apply_group_size": {}, "apply_workers": {}, "compression": {}}
+    settings = dict(get_settings())
+
+    with tempfile.TemporaryDirectory(dir=_get_path("BACKUP_DATA_DIR")) as temp_dir:
+        # create a sample file made out of random lines, which compresses about as well as common text files do
+        words = [rng.randbytes(rng.randint(2, 8)).hex().encode() for _ in range(512)]
+        sample = bytearray()
+        while len(sample) < sample_size:
+            sample += b" ".join(rng.choices(words, k=rng.randint(2, 12))) + b"\n"
+        sample_path = os.path.join(temp_dir, "sample")
+        with open(sample_path, "wb") as sample_file:
+            sample_file.write(sample[:sample_size])
+
+        # read block size
+        def read_sample(block_size: int) -> None:
+            with open(sample_path, "rb") as sample_file:
+                while sample_file.read(block_size):
+                    pass
+
+        for block_size in (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+            measurements["read_block_size"][block_size] = _best_time(lambda: read_sample(block_size), 3)
+        settings["read_block_size"] = min(measurements["read_block_size"], key=measurements["read_block_size"].get)
+
+        # create a change every few hundred bytes of the sample, alternating between additions and deletions
+        changes = ChangeSet()
+        for i, position in enumerate(sorted(rng.sample(range(sample_size // 256), sample_size // 512))):
+            if i % 2:
+                changes.append(types.RMV.value, position * 256, b"\0" * 16)
+            else:
+                changes.append(types.ADD.value, position * 256, rng.randbytes(16))
+
+        applied_path = os.path.join(temp_dir, "applied")
+
+        def apply_sample(group_size: int, workers: int) -> None:
+            shutil.copy(sample_path, applied_path)
+            _apply_changes(changes, applied_path, group_size, workers)
+
+        # tune the group size first and then the amount of workers using the best group size
+        for group_size in (64, 255, 1024):
+            measurements["apply_group_size"][group_size] = _best_time(lambda: apply_sample(group_size, settings["apply_workers"]), 2)
+        settings["apply_group_size"] = min(measurements["apply_group_size"], key=measurements["apply_group_size"].get)
+
+        cpus = os.cpu_count() or 1
+        for workers in sorted({1, 2, 4, cpus, cpus * 2}):
+            measurements["apply_workers"][workers] = _best_time(lambda: apply_sample(settings["apply_group_size"], workers), 2)
+        settings["apply_workers"] = min(measurements["apply_workers"], key=measurements["apply_workers"].get)
+
+        # compression preset
+        sample_changes = ChangeSet()
+        sample_changes.append(types.ADD.value, 0, bytes(sample[:sample_size]))
+        backup_path = os.path.join(temp_dir, "backup")
+        for compression, compresslevel in (("deflate", 1), ("deflate", 6), ("deflate", 9), ("bzip2", 9), ("lzma", None)):
+            seconds = _best_time(lambda: write_backup(sample_changes, backup_path, COMPRESSION_METHODS[compression], compresslevel), 1)
+            measurements["compression"][f"{compression}:{compresslevel}"] = {"seconds": seconds, "size": os.path.getsize(backup_path)}
+
+        fastest = min(measurement["seconds"] for measurement in measurements["compression"].values())
+        candidates = [preset for preset, measurement in measurements["compression"].items() if measurement["seconds"] <= fastest * TUNE_MAX_COMPRESSION_SLOWDOWN]
+        compression, compresslevel = min(candidates, key=lambda preset: measurements["compression"][preset]["size"]).split(":")
+        settings["compression"] = compression
+        settings["compresslevel"] = None if compresslevel == "None" else int(compresslevel)
+
+    if save:
+        save_settings(settings)
+
+    return {"settings": settings, "measurements": measurements}
+
+
+def migrate_global_backups(new_dir: str | None = None, workers: int = MIGRATE_WORKERS, progress=None) -> dict:
+    """Move global backups to some other folder.
+
+    The backups are renamed into place when both folders are on the same file system, otherwise they're copied by several threads and checked against the originals (see `_move_directory`).
+    The progress is saved to "migration.json" in the user data folder, so an interrupted migration is finished by calling this function again with the same folder.
+    Until then, every other function raises `MigrationInProgressError`, since the backups may be only half copied.
+    Every lock of the backup directory is held while it's moved, so nothing changes the backups in the meantime, and processes that were already using the old directory get `MigrationInProgressError` instead of changing it afterwards.
+
+    Parameters
+    ----------
+    new_dir: str, None, optional
+        The path of the folder to where the backups will be moved, which must be empty or not exist yet.
+        If omited, the backups will move back to the default directory.
+
+    workers: int, optional
+        How many files are copied at the same time.
+
+    progress: Callable[[int, int], None], None, optional
+        Called after each file is copied, with the amount of bytes copied so far and the total amount of bytes.
+
+    Returns
+    -------
+    dict
+        A report containing the old and new folders, whether the backups were renamed instead of copied, the amount of files and bytes copied and the time it took.
+
+    Effects
+    -------
+    Moves all the global backups to the specified folder.
+
+    Creates a file named "new_dir.txt" inside the user data directory to reference the new directory, which is replaced at once only after every backup is in place.
+
+    Deletes the "new_dir.txt" file if moving back to the default directory instead.
+
+    Raises
+    ------
+    MigrationInProgressError
+        If an interrupted migration to another folder needs to be finished first.
+
+    FileExistsError
+        If the new folder isn't empty.
+
+    CorruptedBackupError
+        If a copied file doesn't match the original.
+    """
+    migration_path = _get_path("MIGRATION_FILE_PATH")
+    target = _get_path("DEFAULT_BACKUP_DATA_DIR") if new_dir is None else os.path.realpath(new_dir)
+
+    # finish the migration that was interrupted, if any
+    if os.path.exists(migration_path):
+        migration = JSONManager(migration_path, {}).read()
+        if migration["target"] != target:
+            raise BackupExceptions.MigrationInProgressError(f"The migration to '{migration['target']}' was interrupted, run 'bak migrate {migration['target']}' to finish it first.")
+        source = migration["source"]
+    else:
+        source = _get_path("BACKUP_DATA_DIR")
+
+    def switch_directory():
+        # point to the new directory at once
+        if new_dir is None:
+            if os.path.exists(_get_path("NEW_DIR_FILE_PATH")):
+                os.remove(_get_path("NEW_DIR_FILE_PATH"))
+        else:
+            temp_path = f"{_get_path('NEW_DIR_FILE_PATH')}.tmp"
+            with open(temp_path, "w", encoding="utf8") as new_dir_file:
+                new_dir_file.write(target)
+            os.replace(temp_path, _get_path("NEW_DIR_FILE_PATH"))
+
+    with _lock_backup_directory(source):
+        report = _move_directory(source, target, migration_path, workers, progress, switch_directory)
+
+    # resolve the paths inside the backup directory again on their next use, which matters for long running processes like the backup server
+    globals().pop("BACKUP_DATA_DIR", None)
+    globals().pop("TRACKED_FILES_LIST_PATH", None)
+
+    return report
+
+
+@contextlib.contextmanager
+def _lock_backup_directory(root: str) -> Iterator[None]:
+    """Hold every lock of a backup directory while it's moved by a migration, so nothing is written to it in the meantime.
+
+    Anything waiting for those locks finds the backups gone once it gets them (see `_BackupLock`).
+    """
+    with contextlib.ExitStack() as locks:
+        if os.path.isdir(root):
+            locks_dir = os.path.join(root, "locks")
+            os.makedirs(locks_dir, exist_ok=True)
+            locks.enter_context(FileLock(os.path.join(locks_dir, "tracked")))
+
+            backup_indexes = {name for name in os.listdir(locks_dir) if name.isdigit()}
+            tracked_files_list_path = os.path.join(root, "tracked.json")
+            if os.path.exists(tracked_files_list_path):
+                backup_indexes.update(str(entry["index"]) for entry in JSONManager(tracked_files_list_path, {}).read()["list"])
+            for backup_index in sorted(backup_indexes, key=int):
+                locks.enter_context(FileLock(os.path.join(locks_dir, backup_index)))
+            locks.enter_context(FileLock(os.path.join(locks_dir, "journal")))
+
+        yield
+
+
+def _move_directory(source: str, target: str, journal_path: str, workers: int = MIGRATE_WORKERS, progress=None, on_copied=None) -> dict:
+    """Move a directory of backups, in a way that's finished by calling this function again with the same arguments if interrupted.
+
+    The directory is renamed when the target is on the same file system.
+    Otherwise every file is copied by `workers` threads (see `_copy_file`) and checked against the original by size and checksum.
+    The files already copied are saved to `journal_path` every `MIGRATE_CHECKPOINT_INTERVAL` seconds, so they're not copied again unless the original changed.
+
+    Once everything is in place `on_copied` is called, and only then the original directory and the journal are removed.
+    See `migrate_global_backups` for the arguments and the report returned.
+    """
+    timer = time.perf_counter()
+    report = {"source": source, "target": target, "renamed": False, "files": 0, "bytes": 0}
+
+    if not os.path.exists(journal_path):
+        if source == target:
+            report["seconds"] = time.perf_counter() - timer
+            return report
+        if os.path.commonpath([source, target]) in (source, target):
+            raise ValueError(f"Can't move '{source}' to '{target}', since one is inside the other.")
+        if os.path.exists(target) and os.listdir(target):
+            raise FileExistsError(f"Can't move '{source}' to '{target}', since it's not empty.")
+
+    journal_manager = JSONManager(journal_path, {"source": source, "target": target, "files": {}, "copied": False})
+    journal = journal_manager.read()
+
+    if not journal["copied"]:
+        # the source only doesn't exist anymore if it was already renamed
+        if os.path.exists(source):
+            if _same_file_system(source, target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.exists(target):
+                    os.rmdir(target)
+                os.rename(source, target)
+                report["renamed"] = True
+            else:
+                _copy_directory(source, target, journal_manager, workers, progress, report)
+
+        journal["copied"] = True
+        journal_manager.save(journal)
+
+    if on_copied is not None:
+        on_copied()
+    shutil.rmtree(source, ignore_errors=True)
+    os.remove(journal_path)
+
+    report["seconds"] = time.perf_counter() - timer
+    return report
+
+
+def _copy_directory(source: str, target: str, journal_manager: JSONManager, workers: int, progress, report: dict) -> None:
+    """Copy every file of a directory that isn't on the journal yet, adding them to the journal as they're done (see `_move_directory`)."""
+    journal = journal_manager.content
+    copied_files = journal["files"]
+
+    # find the files that weren't copied yet, or changed since they were copied
+    pending = []
+    total = copied = 0
+    for directory, _, names in os.walk(source):
+        target_directory = os.path.join(target, os.path.relpath(directory, source))
+        os.makedirs(target_directory, exist_ok=True)
+        for name in names:
+            source_path = os.path.join(directory, name)
+            target_path = os.path.join(target_directory, name)
+            relative_path = os.path.relpath(source_path, source)
+            stat = os.stat(source_path)
+            key = [stat.st_size, stat.st_mtime_ns]
+
+            total += stat.st_size
+            if copied_files.get(relative_path) == key and os.path.exists(target_path) and os.path.getsize(target_path) == stat.st_size:
+                copied += stat.st_size
+            else:
+                pending.append((source_path, target_path, relative_path, key))
+
+    last_checkpoint = time.monotonic()
+    executor = concurrent_futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(_copy_verified, source_path, target_path): (relative_path, key) for source_path, target_path, relative_path, key in pending}
+        for future in concurrent_futures.as_completed(futures):
+            future.result()
+
+            relative_path, key = futures[future]
+            copied_files[relative_path] = key
+            copied += key[0]
+            report["files"] += 1
+            report["bytes"] += key[0]
+            if progress is not None:
+                progress(copied, total)
+
+            if time.monotonic() - last_checkpoint >= MIGRATE_CHECKPOINT_INTERVAL:
+                journal_manager.save(journal)
+                last_checkpoint = time.monotonic()
+    finally:
+        # keep the files copied so far even if something went wrong
+        executor.shutdown(cancel_futures=True)
+        journal_manager.save(journal)
+
+
+def _copy_verified(source_path: str, target_path: str) -> None:
+    """Copy a file and check the copy against the original by size and checksum."""
+    _copy_file(source_path, target_path)
+    if os.path.getsize(target_path) != os.path.getsize(source_path) or get_file_checksum(target_path) != get_file_checksum(source_path):
+        raise BackupExceptions.CorruptedBackupError(f"The copy of '{source_path}' at '{target_path}' doesn't match the original.")
+
+
+def _copy_file(source_path: str, target_path: str) -> None:
+    """Copy a file with `os.copy_file_range` where available, falling back to `shutil.copy2` (which uses `os.sendfile` on Linux), so the data doesn't go through Python."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source_path, "rb") as source_file, open(target_path, "wb") as target_file:
+                while os.copy_file_range(source_file.fileno(), target_file.fileno(), COPY_CHUNK_SIZE):
+                    pass
+            shutil.copystat(source_path, target_path)
+            return
+        except OSError:
+            pass  # not supported between these file systems
+
+    shutil.copy2(source_path, target_path)
+
+
+def _same_file_system(source: str, target: str) -> bool:
+    """Check if a path and the closest existing parent of another are on the same file system."""
+    while not os.path.exists(target):
+        target = os.path.dirname(target)
+
+    return os.stat(source).st_dev == os.stat(target).st_dev
+
+
+class Repository:
+    """A directory of global backups, so several of them can be used by the same process, even at the same time.
+
+    The module functions (such as `create_global_backup`) use the repository activated in the current thread or task (see `activate`), or the default backup directory otherwise.
+    The methods of a repository are shortcuts for activating it and calling one of them.
+    Each repository keeps the json files it reads parsed in memory, so they're only read again once they change.
+
+    Parameters
+    ----------
+    root: str
+        The directory of the backups, created if it doesn't exist yet.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self.tracked_files_list_path = os.path.join(self.root, "tracked.json")
+        self.metadata_cache = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"Repository({self.root!r})"
+
+    def __reduce__(self):
+        # the cache isn't sent along when the repository is sent to another process
+        return Repository, (self.root,)
+
+    def activate(self) -> "_RepositoryActivation":
+        """Make the module functions use this repository inside a `with` block, only for the current thread or task."""
+        return _RepositoryActivation(self)
+
+    def create(self, file_path: str, message: str = "", mode: str | None = None) -> None:
+        """Back up a file to this repository, see `create_global_backup`."""
+        with self.activate():
+            create_global_backup(file_path, message, mode)
+
+    def restore(self, backup_index: int, timestamp: int, unsaved_changes_ok: bool = False) -> None:
+        """Restore a file from this repository, see `restore_global_backup`."""
+        with self.activate():
+            restore_global_backup(backup_index, timestamp, unsaved_changes_ok)
+
+    def cat(self, backup_index: int, timestamp: int, output: "str | typing.BinaryIO | None" = None) -> None:
+        """Write a version of a file from this repository, see `cat_global_backup`."""
+        with self.activate():
+            cat_global_backup(backup_index, timestamp, output)
+
+    def list_tracked_files(self) -> list[dict]:
+        """List the files tracked by this repository, see `list_tracked_files`."""
+        with self.activate():
+            return list_tracked_files()
+
+    def list_backups(self, backup_index: int, reverse: bool = False) -> list[int]:
+        """List the backups of a file from this repository, see `list_file_backups`."""
+        with self.activate():
+            return list_file_backups(backup_index, reverse)
+
+    def get_message(self, backup_index: int, timestamp: int) -> str:
+        """Get the message of a backup from this repository, see `get_backup_message`."""
+        with self.activate():
+            return get_backup_message(backup_index, timestamp)
+
+    def reword(self, backup_index: int, timestamp: int, message: str) -> None:
+        """Change the message of a backup from this repository, see `create_backup_message`."""
+        with self.activate():
+            create_backup_message(backup_index, timestamp, message)
+
+    def migrate(self, new_root: str, workers: int = MIGRATE_WORKERS, progress=None) -> dict:
+        """Move this repository to another directory, the same way `migrate_global_backups` moves the default one.
+
+        The progress is saved next to the new directory, so an interrupted migration is finished by calling this method again with the same directory.
+        """
+        new_root = os.path.realpath(new_root)
+        with _lock_backup_directory(self.root):
+            report = _move_directory(self.root, new_root, f"{new_root}.migration.json", workers, progress)
+
+            # switch before the locks are released, so whatever was waiting for them uses the new directory when trying again
+            self.root = new_root
+            self.tracked_files_list_path = os.path.join(self.root, "tracked.json")
+            self.metadata_cache.clear()
+
+        return report
+
+
+class _RepositoryActivation:
+    """The context manager returned by `Repository.activate`."""
+
+    def __init__(self, repository: Repository):
+        self.repository = repository
+        self.token = None
+
+    def __enter__(self) -> Repository:
+        self.token = _repository.set(self.repository)
+        return self.repository
+
+    def __exit__(self, *exc_info):
+        _repository.reset(self.token)
+        return False
+
+
+def get_repository() -> Repository:
+    """Get the repository used by the module functions, which is the one activated in the current context or the one of the default backup directory."""
+    repository = _repository.get()
+    if repository is None:
+        root = _get_path("BACKUP_DATA_DIR")
+        if root not in _repositories:
+            _repositories[root] = Repository(root)
+        repository = _repositories[root]
+
+    return repository
+
+
+def main():
+    # let the backup server run the command if it's running
+    if _forward_to_server(sys.argv[1:]):
+        return
+
+    parser = _get_parser()
+    args = parser.parse_args()
+
+    # run the command normally unless profiling is requested
+    profile_path = args.profile or os.environ.get("BAK_PROFILE")
+    profile_format = args.profile_format or os.environ.get("BAK_PROFILE_FORMAT") or "jsonl"
+    if not profile_path:
+        _run_command(parser, args)
+
+    elif profile_format == "cprofile":
+        cprofile = cProfile.Profile()
+        try:
+            cprofile.runcall(_run_command, parser, args)
+        finally:
+            cprofile.dump_stats(profile_path)
+
+    else:
+        profiler.enable()
+        try:
+            with profiler.span("command", action=args.action):
+                _run_command(parser, args)
+        finally:
+            profiler.disable()
+            profiler.export(profile_path)
+
+
+def _forward_to_server(arguments: list[str]) -> bool:
+    """Run a command on the backup server and write its output, if the server is running (see `server.send_command`).
+
+    Commands that must run on their own process (like `watch`), commands that stream through stdin and stdout (`import` and `export`) and profiled commands are never forwarded, neither is anything when the BAK_NO_SERVER environment variable is set.
+
+    Returns
+    -------
+    bool
+        Whether the command was run by the server.
+
+    Effects
+    -------
+    Exits with the exit code of the command if it failed.
+    """
+    if os.environ.get("BAK_NO_SERVER") or os.environ.get("BAK_PROFILE") or not arguments:
+        return False
+    if arguments[0] in ("server", "watch", "import", "export") or any(argument.startswith("--profile") for argument in arguments):
+        return False
+
+    # check if the server is running without importing anything else when it isn't
+    if not os.path.exists(_get_path("SERVER_SOCKET_PATH")):
+        return False
+
+    from server import send_command
+
+    try:
+        exit_code = send_command(arguments)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # the server stopped without removing its socket
+        return False
+
+    if exit_code:
+        sys.exit(exit_code)
+
+    return True
+
+
+def _get_parser() -> "argparse.ArgumentParser":
+    """Get the parser of the command line arguments used by `main`."""
+    # arguments setup
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", type=str, default=None, help="record how long each step of the command takes and save it to this path (also enabled by the BAK_PROFILE environment variable)")
+    parser.add_argument("--profile-format", choices=("jsonl", "cprofile"), default=None, help="save the profile as json lines with nested spans and counters (default) or as a cProfile dump")
+    subparser = parser.add_subparsers(dest="action", help="avaliable commands:")
+
+    # arguments for creating backup
+    create_parser = subparser.add_parser("create", help="creates a new backup")
+    create_parser.add_argument("path_or_index", type=str, help="the path or backup index of the file being backed up")
+    create_parser.add_argument("message", nargs="?", type=str, help="message describing what changed")
+    create_parser.add_argument("--mode", choices=DIFF_MODES, default=None, help="how changes are detected for this file from now on: line-aware for text, byte by byte for binary or auto-detected (default)")
 
     # arguments for restoring a backup
     restore_parser = subparser.add_parser("restore", help="restores a backup")
@@ -991,6 +4435,61 @@ def main():
     list_parser = subparser.add_parser("list", help="lists all the tracked files and their respective indexes or backups with their respective timestamps")
     list_parser.add_argument("index", nargs="?", type=int, default=None, help="the index of the file whose backups you want to list, omit it to get a list of all tracked files")
 
+    # arguments for writing a backup to stdout or another file
+    cat_parser = subparser.add_parser("cat", help="writes a backup to stdout or another file without restoring it")
+    cat_parser.add_argument("index", type=int, help="the index of the file being read")
+    cat_parser.add_argument("timestamp_or_index", type=int, help="the timestamp of the backup you want to read")
+    cat_parser.add_argument("-o", "--output", type=str, default=None, help="the path where the backup will be written, omit it to write to stdout")
+    cat_parser.add_argument("--offset", type=int, default=None, help="only write the section of the backup starting at this byte")
+    cat_parser.add_argument("--length", type=int, default=None, help="only write this many bytes of the backup")
+
+    # arguments for showing the differences between two backups
+    diff_parser = subparser.add_parser("diff", help="shows what changed between two backups without restoring them")
+    diff_parser.add_argument("index", type=int, help="the index of the file being compared")
+    diff_parser.add_argument("old_timestamp_or_index", type=int, help="the timestamp of the older backup")
+    diff_parser.add_argument("new_timestamp_or_index", nargs="?", type=int, default=0, help="the timestamp of the newer backup, omit it to compare with the last backup")
+    diff_parser.add_argument("-o", "--output", type=str, default=None, help="the path where the diff will be written, omit it to write to stdout")
+    diff_parser.add_argument("--mode", choices=DIFF_MODES, default=None, help="show a unified diff for text, a summary of the changed sections for binary files or choose based on the content (by default the mode of the file)")
+    diff_parser.add_argument("-U", "--unified", type=int, default=DIFF_CONTEXT_LINES, help=f"how many unchanged lines are shown around each change (default: {DIFF_CONTEXT_LINES})")
+
+    # arguments for repacking backups
+    repack_parser = subparser.add_parser("repack", help="recreates all backups of a file to make them smaller and faster to restore")
+    repack_parser.add_argument("index", nargs="?", type=int, default=None, help="the index of the file being repacked, omit it to repack all tracked files")
+    repack_parser.add_argument("--keyframe-interval", type=int, default=KEYFRAME_INTERVAL, help="the maximum amount of backups needed to restore any version")
+
+    # arguments for pruning backups
+    prune_parser = subparser.add_parser("prune", help="deletes old backups according to retention rules, merging them into the backups that are kept")
+    prune_parser.add_argument("index", nargs="?", type=int, default=None, help="the index of the file being pruned, omit it to prune all tracked files")
+    prune_parser.add_argument("--keep-last", type=int, default=1, help="how many of the most recent backups to keep")
+    prune_parser.add_argument("--hourly", type=int, default=0, help="for how many hours to keep the last backup of the hour")
+    prune_parser.add_argument("--daily", type=int, default=0, help="for how many days to keep the last backup of the day")
+    prune_parser.add_argument("--weekly", type=int, default=0, help="for how many weeks to keep the last backup of the week")
+    prune_parser.add_argument("--dry-run", action="store_true", help="only list the backups that would be deleted")
+
+    # arguments for verifying backups
+    verify_parser = subparser.add_parser("verify", help="checks if backups still match their checksums without modifying anything")
+    verify_parser.add_argument("index", nargs="?", type=int, default=None, help="the index of the file being verified, omit it to verify all tracked files")
+    verify_parser.add_argument("--sample", type=int, default=None, help="only check this many randomly chosen backups of each file")
+    verify_parser.add_argument("--workers", type=int, default=None, help="the maximum amount of files verified in parallel")
+    verify_parser.add_argument("--json", action="store_true", help="print the full report as json")
+
+    # arguments for showing storage stats
+    stats_parser = subparser.add_parser("stats", help="shows how much storage the backups of each file use and how costly they are to restore")
+    stats_parser.add_argument("index", nargs="?", type=int, default=None, help="the index of the file whose stats you want to see, omit it to see the stats of all tracked files")
+    stats_parser.add_argument("--json", action="store_true", help="print the full stats as json")
+
+    # arguments for watching tracked files
+    watch_parser = subparser.add_parser("watch", help="keeps backing up every tracked file as soon as it changes, until interrupted")
+    watch_parser.add_argument("--debounce", type=float, default=None, help="how many seconds a file must go without changes before being backed up (default: 1)")
+    watch_parser.add_argument("--workers", type=int, default=None, help="how many files can be backed up at the same time (default: 2)")
+    watch_parser.add_argument("--poll", action="store_true", help="check files for changes periodically instead of using inotify")
+    watch_parser.add_argument("--poll-interval", type=float, default=None, help="how often files are checked for changes when polling, in seconds (default: 1)")
+
+    # arguments for tuning the settings
+    tune_parser = subparser.add_parser("tune", help="measures which settings work best on this machine and saves them for every other command")
+    tune_parser.add_argument("--sample-size", type=int, default=TUNE_SAMPLE_SIZE, help="the size in bytes of the sample file used by the measurements")
+    tune_parser.add_argument("--dry-run", action="store_true", help="only show the tuned settings without saving them")
+
     # arguments for creating or updating a backup message
     reword_parser = subparser.add_parser("reword", help="creates or updates a backup message")
     reword_parser.add_argument("index", type=int, help="the index of the file being restored")
@@ -1000,9 +4499,32 @@ def main():
     # arguments for migrating backups to another directory
     migrate_parser = subparser.add_parser("migrate", help="migrate all backups to some other directory")
     migrate_parser.add_argument("new_dir", nargs="?", type=str, default=None, help="the path of the new directory, omit this to migrate back to the default directory")
+    migrate_parser.add_argument("--workers", type=int, default=MIGRATE_WORKERS, help=f"how many files are copied at the same time when moving to another file system (default: {MIGRATE_WORKERS})")
+
+    # arguments for exporting and importing the backups of a file
+    export_parser = subparser.add_parser("export", help="writes every backup of a file to stdout or another file as a single bundle")
+    export_parser.add_argument("index", type=int, help="the index of the file being exported")
+    export_parser.add_argument("-o", "--output", type=str, default=None, help="the path where the bundle will be written, omit it to write to stdout")
+    import_parser = subparser.add_parser("import", help="tracks a file with every backup from a bundle written by export")
+    import_parser.add_argument("bundle", nargs="?", type=str, default=None, help="the path of the bundle, omit it to read from stdin")
+    import_parser.add_argument("--path", type=str, default=None, help="the path the file is tracked at, by default the one it had where it was exported from")
+
+    # arguments for copying backups to and from other storage
+    push_parser = subparser.add_parser("push", help="copies every backup to an object store or another directory, only sending what changed")
+    push_parser.add_argument("location", type=str, help="the http or https url of the object store, or the path of the directory")
+    pull_parser = subparser.add_parser("pull", help="copies every backup back from an object store or another directory, replacing the local ones")
+    pull_parser.add_argument("location", type=str, help="the http or https url of the object store, or the path of the directory")
+
+    # arguments for running the backup server
+    server_parser = subparser.add_parser("server", help="runs a server that keeps everything loaded and runs the commands of every other bak process, making them faster")
+    server_parser.add_argument("--stop", action="store_true", help="stop the server that's currently running")
+
+    return parser
 
+
+def _run_command(parser: "argparse.ArgumentParser", args: "argparse.Namespace") -> None:
+    """Run the command parsed by `main`."""
     # main cli logic
-    args = parser.parse_args()
     match args.action:
         case "create":
             # convert backup index into file path
@@ -1010,7 +4532,7 @@ def main():
                 args.path_or_index = get_tracked_path(int(args.path_or_index))
 
             # run command
-            create_global_backup(args.path_or_index, args.message)
+            create_global_backup(args.path_or_index, args.message, args.mode)
 
             # success message
             print(f"New backup created for file '{os.path.realpath(args.path_or_index)}'")
@@ -1050,6 +4572,171 @@ def main():
                     print(f'{i} | {timestamp} | {date_from_ms(timestamp)} | "{get_backup_message(args.index, timestamp)}"')
                     i += 1
 
+        case "cat":
+            # convert timestamp index into timestamp
+            backup_list = list_file_backups(args.index, True)
+            if args.timestamp_or_index < len(backup_list):
+                args.timestamp_or_index = backup_list[args.timestamp_or_index]
+
+            # run command, stopping quietly if the output is closed early (e.g. when piped to `head`)
+            try:
+                # read only the requested section
+                if args.offset is not None or args.length is not None:
+                    content = read_backup_range(args.index, args.timestamp_or_index, args.offset or 0, args.length)
+                    if args.output is not None:
+                        with open(args.output, "wb") as output_file:
+                            output_file.write(content)
+                    else:
+                        sys.stdout.buffer.write(content)
+                        sys.stdout.flush()
+
+                else:
+                    cat_global_backup(args.index, args.timestamp_or_index, args.output)
+            except BrokenPipeError:
+                # point stdout to devnull so python doesn't fail again while flushing it on exit
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+        case "diff":
+            # convert timestamp indexes into timestamps
+            backup_list = list_file_backups(args.index, True)
+            if args.old_timestamp_or_index < len(backup_list):
+                args.old_timestamp_or_index = backup_list[args.old_timestamp_or_index]
+            if args.new_timestamp_or_index < len(backup_list):
+                args.new_timestamp_or_index = backup_list[args.new_timestamp_or_index]
+
+            # run command, stopping quietly if the output is closed early (e.g. when piped to `head`)
+            try:
+                diff_global_backup(args.index, args.old_timestamp_or_index, args.new_timestamp_or_index, args.output, args.mode, args.unified)
+            except BrokenPipeError:
+                # point stdout to devnull so python doesn't fail again while flushing it on exit
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+        case "repack":
+            indexes = [args.index] if args.index is not None else [file["index"] for file in list_tracked_files()]
+            for index in indexes:
+                report = repack_global_backups(index, args.keyframe_interval)
+
+                # success message
+                print(f"Repacked {report['versions']} backups for file '{get_tracked_path(index)}'")
+                print(f"  size: {report['size_before']} -> {report['size_after']} bytes")
+                print(f"  longest chain: {report['longest_chain_before']} -> {report['longest_chain_after']} backups")
+                print(f"  restore time: {report['restore_seconds_before']:.3f} -> {report['restore_seconds_after']:.3f} seconds")
+
+        case "prune":
+            indexes = [args.index] if args.index is not None else [file["index"] for file in list_tracked_files()]
+            for index in indexes:
+                dropped = prune_global_backups(index, args.keep_last, args.hourly, args.daily, args.weekly, args.dry_run)
+
+                # success message
+                if args.dry_run:
+                    print(f"Would delete {len(dropped)} backups from file '{get_tracked_path(index)}':")
+                    for timestamp in dropped:
+                        print(f"  {timestamp} | {date_from_ms(timestamp)}")
+                else:
+                    print(f"Deleted {len(dropped)} backups from file '{get_tracked_path(index)}'")
+
+        case "verify":
+            indexes = [args.index] if args.index is not None else None
+            reports = verify_all_global_backups(indexes, args.sample, args.workers)
+
+            if args.json:
+                print(json.dumps(reports, indent=2))
+            else:
+                print("( backup index | result | backups checked | throughput )")
+                for report in reports:
+                    result = "ok" if report["ok"] else "FAILED"
+                    print(f"{report['index']} | {result} | {report['checked']}/{report['versions']} | {report['bytes_per_second'] / 1024 / 1024:.2f} MiB/s")
+                    for timestamp in report["failed"]:
+                        print(f"  backup with timestamp '{timestamp}' doesn't match its checksum")
+                    if report["head_ok"] is False:
+                        print("  head doesn't match the last backup")
+                    if report["error"] is not None:
+                        print(f"  {report['error']}")
+
+            if not all(report["ok"] for report in reports):
+                sys.exit(1)
+
+        case "stats":
+            indexes = [args.index] if args.index is not None else [file["index"] for file in list_tracked_files()]
+            stats = [get_backup_stats(index) for index in indexes]
+
+            if args.json:
+                print(json.dumps(stats, indent=2))
+            else:
+                print("( backup index | backups | storage used | compression ratio | chain length | longest chain | restore size | file path )")
+                for file_stats in stats:
+                    print(f"{file_stats['index']} | {file_stats['versions']} | {file_stats['stored_size'] / 1024 / 1024:.2f} MiB | {file_stats['compression_ratio']:.2f}x | {file_stats['chain_length']} | {file_stats['longest_chain']} | {file_stats['restore_size'] / 1024 / 1024:.2f} MiB | {file_stats['path']}")
+
+        case "watch":
+            from watch import BackupWatcher
+
+            def report_backup(path: str, error: Exception | None) -> None:
+                if error is None:
+                    print(f"New backup created for file '{path}'", flush=True)
+                else:
+                    print(f"Could not back up file '{path}': {error}", file=sys.stderr, flush=True)
+
+            options = {"debounce": args.debounce, "workers": args.workers, "poll_interval": args.poll_interval}
+            watcher = BackupWatcher(polling=args.poll, on_backup=report_backup, **{name: value for name, value in options.items() if value is not None})
+            print(f"Watching {len(list_tracked_files())} tracked files, press Ctrl+C to stop", flush=True)
+            try:
+                watcher.run()
+            except KeyboardInterrupt:
+                pass
+
+        case "export":
+            try:
+                export_global_backups(args.index, args.output)
+            except BrokenPipeError:
+                # point stdout to devnull so python doesn't fail again while flushing it on exit
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                sys.exit(1)
+
+        case "import":
+            index = import_global_backups(args.bundle, args.path)
+
+            # success message
+            print(f"Imported {len(list_file_backups(index))} backups for file '{get_tracked_path(index)}' with backup index {index}")
+
+        case "push" | "pull":
+            function = push_global_backups if args.action == "push" else pull_global_backups
+            report = function(args.location)
+
+            # success message
+            print(f"Copied {report['copied']} files ({report['bytes'] / 1024 / 1024:.2f} MiB) and deleted {report['deleted']} files {'to' if args.action == 'push' else 'from'} '{args.location}'")
+
+        case "server":
+            from server import BackupServer, send_command
+
+            if args.stop:
+                send_command(["server", "--stop"])
+                print("Stopped the backup server")
+            else:
+                print(f"Backup server listening on '{_get_path('SERVER_SOCKET_PATH')}', press Ctrl+C to stop", flush=True)
+                try:
+                    BackupServer().serve_forever()
+                except KeyboardInterrupt:
+                    pass
+
+        case "tune":
+            report = tune_settings(args.sample_size, save=not args.dry_run)
+
+            # show the measurements of every setting
+            for setting, measurements in report["measurements"].items():
+                print(f"{setting}:")
+                for candidate, measurement in measurements.items():
+                    if setting == "compression":
+                        print(f"  {candidate} | {measurement['seconds']:.4f} seconds | {measurement['size']} bytes")
+                    else:
+                        print(f"  {candidate} | {measurement:.4f} seconds")
+
+            # success message
+            print("Tuned settings:")
+            for setting, value in report["settings"].items():
+                print(f"  {setting}: {value}")
+            if not args.dry_run:
+                print(f"Saved to '{_get_path('CONFIG_FILE_PATH')}'")
+
         case "reword":
             # conver timestamp index into timestamp
             backup_list = list_file_backups(args.index, True)
@@ -1064,12 +4751,18 @@ def main():
             print(f"Update message from '{original_message}' to '{args.message}' for backup with timestamp '{args.timestamp_or_index}' from file '{get_tracked_path(args.index)}'")
 
         case "migrate":
-            migrate_global_backups(args.new_dir)
+            # show the progress of copies between file systems on terminals
+            progress = None
+            if sys.stderr.isatty():
 
-            if args.new_dir is not None:
-                print(f"Successfully migrate backups from '{BACKUP_DATA_DIR}' to '{os.path.abspath(args.new_dir)}'")
-            else:
-                print(f"Successfully migrated backups from '{BACKUP_DATA_DIR}' to '{DEFAULT_BACKUP_DATA_DIR}'")
+                def progress(copied, total):
+                    print(f"\rCopied {copied / 1024 / 1024:.1f} of {total / 1024 / 1024:.1f} MiB", end="", file=sys.stderr, flush=True)
+
+            report = migrate_global_backups(args.new_dir, args.workers, progress)
+            if progress is not None and report["files"]:
+                print(file=sys.stderr)
+
+            print(f"Successfully migrated backups from '{report['source']}' to '{report['target']}'")
 
         case _:
             parser.print_help()
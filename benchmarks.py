@@ -0,0 +1,314 @@
+import tracemalloc
+import statistics
+import subprocess
+import argparse
+import platform
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+import backup
+
+
+# kinds of changes covered by the synthetic corpus
+CASES = ("text_edits", "binary_inserts", "binary_deletes", "append", "moved_blocks", "sparse")
+OPERATIONS = ("get_changes", "apply_changes", "create_backup", "restore_backup", "restore_global_backup", "startup")
+STARTUP_COMMANDS = {"import": ["-c", "import backup"], "help": ["-c", "import backup; backup.main()", "-h"], "list": ["-c", "import backup; backup.main()", "list"]}
+BLOCK_SIZE = 64 * 1024  # the corpus is generated one block at a time, so any size can be written without keeping it in memory
+WORDS = [b"alpha", b"beta", b"gamma", b"delta", b"option", b"value", b"true", b"false", b"name", b"path", b"=", b"#"]
+
+
+def parse_size(size: str) -> int:
+    """Convert a size such as "64K", "10M" or "2G" to bytes."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    size = size.strip().upper()
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+def _text_block(rng: random.Random, size: int) -> bytes:
+    """Generate a block of text lines made out of common words."""
+    lines = []
+    length = 0
+    while length < size:
+        line = b" ".join(rng.choices(WORDS, k=rng.randint(2, 10))) + b"\n"
+        lines.append(line)
+        length += len(line)
+
+    return b"".join(lines)[:size]
+
+
+def _old_block(case: str, seed: int, index: int, size: int) -> bytes:
+    """Generate a block of the old file of a case."""
+    rng = random.Random(f"{seed}-{case}-{index}")
+    match case:
+        case "text_edits":
+            return _text_block(rng, size)
+        case "sparse":
+            block = bytearray(size)
+            for _ in range(4):
+                position = rng.randrange(size)
+                block[position : position + 64] = rng.randbytes(64)
+            return bytes(block[:size])
+        case _:
+            return rng.randbytes(size)
+
+
+def _new_block(case: str, seed: int, index: int, old_block: bytes) -> bytes:
+    """Generate the block of the new file of a case that corresponds to a block of the old file.
+
+    Besides the sections moved inside each block, moved blocks are also handled by `generate_case`, which swaps every pair of blocks.
+    """
+    rng = random.Random(f"{seed}-{case}-{index}-new")
+    block = bytearray(old_block)
+    match case:
+        case "text_edits":
+            # change, add and remove a few lines
+            lines = block.split(b"\n")
+            for _ in range(max(1, len(lines) // 100)):
+                line = rng.randrange(len(lines))
+                match rng.randrange(3):
+                    case 0:
+                        lines[line] = lines[line].replace(b"true", b"false") + b" edited"
+                    case 1:
+                        lines.insert(line, _text_block(rng, 40).rstrip(b"\n"))
+                    case 2:
+                        del lines[line]
+            return b"\n".join(lines)
+        case "binary_inserts":
+            for _ in range(4):
+                position = rng.randrange(len(block) + 1)
+                block[position:position] = rng.randbytes(rng.randint(1, 256))
+        case "binary_deletes":
+            for _ in range(4):
+                position = rng.randrange(len(block) + 1)
+                del block[position : position + rng.randint(1, 256)]
+        case "moved_blocks":
+            # move a section of the block somewhere else
+            size = max(len(block) // 8, 1)
+            position = rng.randrange(len(block) - size + 1)
+            section = block[position : position + size]
+            del block[position : position + size]
+            position = rng.randrange(len(block) + 1)
+            block[position:position] = section
+        case "sparse":
+            for _ in range(2):
+                position = rng.randrange(len(block))
+                block[position : position + 16] = rng.randbytes(16)
+
+    return bytes(block)
+
+
+def generate_case(case: str, size: int, old_file_path: str, new_file_path: str, seed: int = 0) -> None:
+    """Write the old and new files of a case of the synthetic corpus, one block at a time.
+
+    The same case, size and seed always result on the exact same files.
+    """
+    with open(old_file_path, "wb") as old_file:
+        with open(new_file_path, "wb") as new_file:
+            blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            held_block = b""
+            for index in range(blocks):
+                block_size = min(BLOCK_SIZE, size - index * BLOCK_SIZE)
+                old_block = _old_block(case, seed, index, block_size)
+                old_file.write(old_block)
+
+                new_block = _new_block(case, seed, index, old_block)
+                if case == "moved_blocks" and index % 2 == 0:
+                    # hold the block until the next one is written, so both swap places
+                    held_block = new_block
+                else:
+                    new_file.write(new_block + held_block)
+                    held_block = b""
+
+            new_file.write(held_block)
+
+            if case == "append":
+                new_file.write(random.Random(f"{seed}-append").randbytes(max(size // 10, 1)))
+
+
+def measure(function, repeat: int) -> dict:
+    """Time a function, then run it once more while tracing memory to get its peak usage."""
+    timings = []
+    for _ in range(repeat):
+        timer = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - timer)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": min(timings), "median_seconds": statistics.median(timings), "peak_bytes": peak}
+
+
+def benchmark_case(case: str, size: int, operations: list[str], repeat: int, chain_length: int, seed: int) -> list[dict]:
+    """Run every operation on a case of the corpus."""
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        old_file_path = os.path.join(temp_dir, "old")
+        new_file_path = os.path.join(temp_dir, "new")
+        work_file_path = os.path.join(temp_dir, "work")
+        backup_file_path = os.path.join(temp_dir, "backup")
+        generate_case(case, size, old_file_path, new_file_path, seed)
+
+        # the binary diff is used for everything except text, which uses the same diff as backups do
+        mode = "text" if case == "text_edits" else "binary"
+        changes = backup.get_file_changes(old_file_path, new_file_path, mode)
+        backup.create_backup(old_file_path, new_file_path, backup_file_path, mode)
+
+        def run_apply_changes():
+            shutil.copy(old_file_path, work_file_path)
+            backup.apply_changes(changes, work_file_path)
+
+        def run_restore_backup():
+            backup.restore_backup(backup_file_path, old_file_path, work_file_path)
+
+        def run_restore_global_backup():
+            backup.restore_global_backup(0, timestamps[0], unsaved_changes_ok=True)
+
+        functions = {
+            "get_changes": lambda: backup.get_file_changes(old_file_path, new_file_path, mode),
+            "apply_changes": run_apply_changes,
+            "create_backup": lambda: backup.create_backup(old_file_path, new_file_path, backup_file_path, mode),
+            "restore_backup": run_restore_backup,
+            "restore_global_backup": run_restore_global_backup,
+        }
+
+        # set up an isolated history, alternating between both files, for the global restore
+        if "restore_global_backup" in operations:
+            backup.BACKUP_DATA_DIR = os.path.join(temp_dir, "backups")
+            backup.TRACKED_FILES_LIST_PATH = os.path.join(backup.BACKUP_DATA_DIR, "tracked.json")
+            os.makedirs(backup.BACKUP_DATA_DIR)
+
+            tracked_file_path = os.path.join(temp_dir, "tracked")
+            for i in range(chain_length):
+                shutil.copy(new_file_path if i % 2 else old_file_path, tracked_file_path)
+                with open(tracked_file_path, "ab") as tracked_file:
+                    tracked_file.write(str(i).encode())
+                backup.create_global_backup(tracked_file_path, mode=mode)
+            timestamps = backup.list_file_backups(0)
+
+        for operation in operations:
+            result = {"case": case, "size": size, "operation": operation}
+            if operation == "get_changes":
+                result["changes"] = len(changes)
+                result["payload_bytes"] = len(changes.payload)
+            if operation == "create_backup":
+                result["backup_bytes"] = os.path.getsize(backup_file_path)
+            if operation == "restore_global_backup":
+                result["chain_length"] = len(backup.get_backup_chain(0, timestamps[0]))
+
+            result.update(measure(functions[operation], repeat))
+            results.append(result)
+            print(f"{case:>15} {size:>12} {operation:>22} {result['seconds']:10.4f}s {result['peak_bytes'] / 1024:12.1f} KiB", file=sys.stderr)
+
+    return results
+
+
+def benchmark_startup(repeat: int) -> list[dict]:
+    """Time how long importing the module and running quick commands takes, each on a new interpreter using an empty data directory."""
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # platformdirs only uses XDG_DATA_HOME on linux, other systems will use their usual data directory
+        environment = {**os.environ, "XDG_DATA_HOME": temp_dir}
+        module_dir = os.path.dirname(os.path.abspath(backup.__file__))
+        for name, arguments in STARTUP_COMMANDS.items():
+            command = [sys.executable, *arguments]
+
+            # run once to make sure the bytecode is cached
+            subprocess.run(command, env=environment, cwd=module_dir, stdout=subprocess.DEVNULL, check=True)
+
+            timings = []
+            for _ in range(repeat):
+                timer = time.perf_counter()
+                subprocess.run(command, env=environment, cwd=module_dir, stdout=subprocess.DEVNULL, check=True)
+                timings.append(time.perf_counter() - timer)
+
+            # the memory of a new interpreter isn't measured, since the peak reported for child processes includes the memory of this one before they start
+            result = {"case": "startup", "size": 0, "operation": f"startup_{name}", "seconds": min(timings), "median_seconds": statistics.median(timings), "peak_bytes": 0}
+            results.append(result)
+            print(f"{'startup':>15} {0:>12} {result['operation']:>22} {result['seconds']:10.4f}s {result['peak_bytes'] / 1024:12.1f} KiB", file=sys.stderr)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compare the results of a run to a baseline run, returning a description of every regression."""
+    baseline_results = {(result["case"], result["size"], result["operation"]): result for result in baseline["results"]}
+    regressions = []
+    print(f"{'case':>15} {'size':>12} {'operation':>22} {'time':>8} {'memory':>8}")
+    for result in results["results"]:
+        key = (result["case"], result["size"], result["operation"])
+        if key not in baseline_results:
+            continue
+
+        # compare the ratio between the current and the baseline values
+        time_ratio = result["seconds"] / max(baseline_results[key]["seconds"], 1e-9)
+        memory_ratio = result["peak_bytes"] / max(baseline_results[key]["peak_bytes"], 1)
+        print(f"{key[0]:>15} {key[1]:>12} {key[2]:>22} {time_ratio:7.2f}x {memory_ratio:7.2f}x")
+        if time_ratio > 1 + threshold:
+            regressions.append(f"{key[2]} on {key[0]} ({key[1]} bytes) is {time_ratio:.2f}x slower")
+        if memory_ratio > 1 + threshold:
+            regressions.append(f"{key[2]} on {key[0]} ({key[1]} bytes) uses {memory_ratio:.2f}x more memory")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks the diff, apply, compression and restore paths on a synthetic corpus")
+    parser.add_argument("--cases", type=str, default=",".join(CASES), help="comma separated list of cases to run")
+    parser.add_argument("--sizes", type=str, default="1K,64K,256K", help="comma separated list of file sizes (e.g. 1K,10M,2G)")
+    parser.add_argument("--operations", type=str, default=",".join(OPERATIONS), help="comma separated list of operations to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times each operation is timed, the fastest run is reported")
+    parser.add_argument("--chain-length", type=int, default=5, help="how many versions are restored by restore_global_backup")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the synthetic corpus")
+    parser.add_argument("-o", "--output", type=str, default="bench_results.json", help="the path where the json results will be saved")
+    parser.add_argument("--compare", type=str, default=None, help="the path of a previous json result to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="how much slower (or more memory) counts as a regression when comparing")
+    args = parser.parse_args()
+
+    operations = args.operations.split(",")
+    case_operations = [operation for operation in operations if operation != "startup"]
+    results = {
+        "meta": {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "created": time.time(),
+        },
+        "results": [],
+    }
+    if "startup" in operations:
+        results["results"] += benchmark_startup(args.repeat)
+
+    for case in args.cases.split(",") if case_operations else []:
+        for size in args.sizes.split(","):
+            results["results"] += benchmark_case(case, parse_size(size), case_operations, args.repeat, args.chain_length, args.seed)
+
+    with open(args.output, "w", encoding="utf8") as output_file:
+        output_file.write(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf8") as baseline_file:
+            baseline = json.loads(baseline_file.read())
+
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import contextlib
+import threading
+import socket
+import struct
+import json
+import sys
+import io
+import os
+
+import backup
+from backup import _get_path
+
+
+# the protocol used between the server and `send_command` is made out of frames, each one being a kind followed by the size of its content and the content itself
+# the client sends a single request frame and the server answers with any amount of stdout and stderr frames followed by an exit frame
+FRAME_HEADER = struct.Struct(">cI")
+REQUEST = b"r"  # the arguments and working directory of the command as json
+STDOUT = b"1"  # a section of the output of the command
+STDERR = b"2"  # a section of the error output of the command
+EXIT = b"x"  # the exit code of the command, ending the response
+
+EXCLUSIVE_COMMANDS = ("migrate", "tune")  # commands that never run at the same time as any other command, every other one locks what it changes (see `utils.FileLock`)
+STOP_ARGUMENTS = ["server", "--stop"]
+
+
+class BackupServer:
+    """A server that runs `bak` commands sent by `send_command` over a Unix domain socket.
+
+    Since the server keeps running, every command it runs skips starting the interpreter, importing modules and resolving paths and settings.
+    Each command runs on its own thread as soon as it arrives, except for `EXCLUSIVE_COMMANDS`, which wait for every running command to finish and run alone.
+    Backups of the same file still wait for each other, the same way they do when created by different processes (see `backup.create_global_backup`).
+
+    Parameters
+    ----------
+    socket_path: str, None, optional
+        The path of the socket the server listens on, by default "server.sock" inside the user data directory, which is where `main` looks for the server.
+    """
+
+    def __init__(self, socket_path: str | None = None):
+        self.socket_path = socket_path or _get_path("SERVER_SOCKET_PATH")
+        self.exclusive_lock = _SharedLock()
+        self._stopped = False
+        self._stdout = self._stderr = None
+
+    def serve_forever(self) -> None:
+        """Accept and run commands until `stop` is called.
+
+        Raises
+        ------
+        FileExistsError
+            If another server is already listening on the same socket.
+        """
+        # remove the socket left behind by a server that didn't stop properly
+        if os.path.exists(self.socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                    connection.connect(self.socket_path)
+                raise FileExistsError(f"A backup server is already listening on '{self.socket_path}'.")
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen()
+
+        # send the output of each command to the client that sent it
+        original_streams = sys.stdout, sys.stderr
+        self._stdout, self._stderr = _ThreadStream(sys.stdout), _ThreadStream(sys.stderr)
+        sys.stdout, sys.stderr = self._stdout, self._stderr
+        try:
+            while not self._stopped:
+                connection, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            sys.stdout, sys.stderr = original_streams
+            listener.close()
+            os.remove(self.socket_path)
+
+    def stop(self) -> None:
+        """Make `serve_forever` return, commands that are still running are left to finish on their own."""
+        self._stopped = True
+
+        # connect to the server so it stops waiting for connections
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_path)
+
+    def run_command(self, arguments: list[str], cwd: str) -> int:
+        """Run a command the same way `main` does, returning its exit code.
+
+        Relative paths on the arguments are relative to `cwd`, the working directory of the client.
+        """
+        parser = backup._get_parser()
+        try:
+            args = parser.parse_args(arguments)
+            if args.action in ("server", "watch") or (args.action == "import" and args.bundle is None):
+                parser.error(f"the '{args.action}' command can't be run by the server")
+
+            # resolve paths from the working directory of the client
+            if args.action == "create" and not args.path_or_index.isdigit():
+                args.path_or_index = os.path.join(cwd, args.path_or_index)
+            if args.action in ("cat", "diff", "export") and args.output is not None:
+                args.output = os.path.join(cwd, args.output)
+            if args.action == "migrate" and args.new_dir is not None:
+                args.new_dir = os.path.join(cwd, args.new_dir)
+            if args.action in ("push", "pull") and "://" not in args.location:
+                args.location = os.path.join(cwd, args.location)
+            if args.action == "import":
+                args.bundle = os.path.join(cwd, args.bundle)
+                if args.path is not None:
+                    args.path = os.path.join(cwd, args.path)
+
+            if args.action in EXCLUSIVE_COMMANDS:
+                with self.exclusive_lock.exclusive():
+                    backup._run_command(parser, args)
+            else:
+                with self.exclusive_lock.shared():
+                    backup._run_command(parser, args)
+
+        except SystemExit as e:
+            # exit codes follow the same rules as the interpreter
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            return 1
+
+        return 0
+
+    def _handle(self, connection: socket.socket) -> None:
+        """Run the command sent through a connection, sending its output back."""
+        with connection:
+            try:
+                kind, content = _receive_frame(connection)
+            except ConnectionError:
+                return  # the connection made by `stop`, or a client that gave up
+            request = json.loads(content)
+
+            if request["arguments"] == STOP_ARGUMENTS:
+                _send_frame(connection, EXIT, b"0")
+                self.stop()
+                return
+
+            # send everything the command writes to stdout and stderr from this thread to the client
+            stdout = io.TextIOWrapper(io.BufferedWriter(_FrameWriter(connection, STDOUT), 64 * 1024), encoding="utf8", write_through=True)
+            stderr = io.TextIOWrapper(io.BufferedWriter(_FrameWriter(connection, STDERR), 64 * 1024), encoding="utf8", write_through=True)
+            self._stdout.local.stream = stdout
+            self._stderr.local.stream = stderr
+            try:
+                exit_code = self.run_command(request["arguments"], request["cwd"])
+                stdout.flush()
+                stderr.flush()
+                _send_frame(connection, EXIT, str(exit_code).encode())
+            except OSError:
+                pass  # the client disconnected
+            finally:
+                self._stdout.local.stream = None
+                self._stderr.local.stream = None
+
+
+def send_command(arguments: list[str], cwd: str | None = None, output: io.BufferedIOBase | None = None, errors: io.BufferedIOBase | None = None, socket_path: str | None = None) -> int:
+    """Run a command on the backup server, as if running `bak` with the given arguments, and write its output.
+
+    Long running programs can call this directly to run commands without starting a new process every time.
+
+    Parameters
+    ----------
+    arguments: list[str]
+        The arguments of the command, such as `["create", "file.txt"]`.
+
+    cwd: str, None, optional
+        The directory relative paths are relative to, by default the current working directory.
+
+    output, errors: BufferedIOBase, None, optional
+        Where the output and error output of the command are written, by default stdout and stderr.
+
+    socket_path: str, None, optional
+        The path of the socket of the server, by default the same one used by `BackupServer`.
+
+    Returns
+    -------
+    int
+        The exit code of the command.
+
+    Raises
+    ------
+    FileNotFoundError, ConnectionRefusedError
+        If the server isn't running.
+    """
+    output = output or sys.stdout.buffer
+    errors = errors or sys.stderr.buffer
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path or _get_path("SERVER_SOCKET_PATH"))
+        _send_frame(connection, REQUEST, json.dumps({"arguments": arguments, "cwd": cwd or os.getcwd()}).encode())
+
+        while True:
+            kind, content = _receive_frame(connection)
+            if kind == STDOUT:
+                output.write(content)
+            elif kind == STDERR:
+                errors.write(content)
+            else:
+                output.flush()
+                errors.flush()
+                return int(content)
+
+
+class _SharedLock:
+    """A lock held either by any amount of threads at the same time (shared) or by a single thread (exclusive).
+
+    Threads waiting for the exclusive side go first, so a steady stream of shared holders can't keep it waiting forever.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0  # how many threads hold the shared side
+        self._exclusive = False
+        self._waiting = 0  # how many threads wait for the exclusive side
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and not self._waiting)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting += 1
+            try:
+                self._condition.wait_for(lambda: not self._exclusive and not self._shared)
+            finally:
+                self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class _ThreadStream:
+    """Stand-in for stdout or stderr that writes to the stream set on `local` by the current thread, or to the original stream if there's none."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self.local, "stream", None) or self.stream
+
+    def write(self, text: str) -> int:
+        return self.target.write(text)
+
+    def flush(self) -> None:
+        self.target.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.target, name)
+
+
+class _FrameWriter(io.RawIOBase):
+    """A binary stream that sends everything written to it as frames of the given kind."""
+
+    def __init__(self, connection: socket.socket, kind: bytes):
+        self.connection = connection
+        self.kind = kind
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, content: bytes) -> int:
+        _send_frame(self.connection, self.kind, bytes(content))
+        return len(content)
+
+
+def _send_frame(connection: socket.socket, kind: bytes, content: bytes) -> None:
+    connection.sendall(FRAME_HEADER.pack(kind, len(content)) + content)
+
+
+def _receive_frame(connection: socket.socket) -> tuple[bytes, bytes]:
+    kind, size = FRAME_HEADER.unpack(_receive_exactly(connection, FRAME_HEADER.size))
+    return kind, _receive_exactly(connection, size)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    """Receive exactly `size` bytes from a connection."""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("The connection was closed before the whole frame was received.")
+        received += count
+
+    return bytes(data)
@@ -7,7 +7,7 @@ setup(
     author="Huuuuuugo",
     description="simple tool for creating versioned delta backups",
     url="https://github.com/Huuuuuugo/backup-tool",
-    py_modules=["backup", "utils"],
+    py_modules=["backup", "utils", "watch", "server", "aio", "storage"],
     install_requires=["platformdirs"],
     entry_points={
         "console_scripts": [
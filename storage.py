@@ -0,0 +1,447 @@
+import threading
+import shutil
+import abc
+import json
+import os
+
+from collections.abc import Iterable, Iterator
+
+from utils import lazy_import, profiler
+
+concurrent_futures = lazy_import("concurrent.futures")
+http_client = lazy_import("http.client")
+urllib_parse = lazy_import("urllib.parse")
+tempfile = lazy_import("tempfile")
+
+
+# settings for object stores
+STORAGE_WORKERS = 8  # how many requests an object store backend makes at the same time
+CHUNK_SIZE = 4 * 1024 * 1024  # small objects are sent and received one after another by the same worker until a chunk reaches this many bytes
+CHUNK_MAX_OBJECTS = 256  # the most objects on a single chunk
+STREAM_THRESHOLD = 64 * 1024 * 1024  # objects larger than this are copied through files instead of being held in memory (see `sync`)
+TIMEOUT = 60.0  # how many seconds to wait for an object store to answer
+SYNC_STATE_KEY = ".sync.json"  # the object where `sync` saves the version every object had on the backend it was copied from
+
+
+class StorageBackend(abc.ABC):
+    """Where the files of a backup directory are stored, as objects addressed by keys.
+
+    Keys are relative paths separated by "/", using the same layout as the backup directory (see `backup.create_global_backup`), such as "0/changes/1743175897507".
+    Subclasses must implement `put`, `get`, `get_range`, `list` and `delete`, every other method works on top of those and can be replaced by faster versions.
+    """
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        """Store an object, replacing the previous one with the same key."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        """Get the content of an object, raising `FileNotFoundError` if it doesn't exist."""
+
+    @abc.abstractmethod
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Get up to `length` bytes of an object starting at `offset`, raising `FileNotFoundError` if it doesn't exist."""
+
+    @abc.abstractmethod
+    def list(self, prefix: str = "") -> dict[str, int]:
+        """Get the size of every object whose key starts with `prefix`."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete an object, raising `FileNotFoundError` if it doesn't exist."""
+
+    def versions(self, prefix: str = "") -> dict[str, list]:
+        """Get the size and version of every object whose key starts with `prefix`, the version being anything that changes whenever the object changes.
+
+        By default, the version is the one the object had on the backend it was copied from by `sync`, or None if it wasn't copied by it or changed size since then.
+        """
+        state = _read_state(self)
+        versions = {}
+        for key, size in self.list(prefix).items():
+            if key != SYNC_STATE_KEY:
+                recorded_size, version = state.get(key, (None, None))
+                versions[key] = [size, version if recorded_size == size else None]
+        return versions
+
+    def put_many(self, items: Iterable[tuple[str, bytes]]) -> None:
+        """Store every (key, data) pair."""
+        for key, data in items:
+            self.put(key, data)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        """Get the content of every object with the given keys."""
+        return {key: self.get(key) for key in keys}
+
+    def put_file(self, key: str, file_path: str) -> None:
+        """Store the content of a file as an object."""
+        with open(file_path, "rb") as file:
+            self.put(key, file.read())
+
+    def get_file(self, key: str, file_path: str) -> None:
+        """Write the content of an object to a file."""
+        data = self.get(key)
+        with open(file_path, "wb") as file:
+            file.write(data)
+
+
+class DirectoryBackend(StorageBackend):
+    """Store objects as files inside a directory, which is how backups are stored by default.
+
+    Every object is written to a temporary file first and then renamed over the previous one, so an object is never seen half written.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def __repr__(self) -> str:
+        return f"DirectoryBackend({self.root!r})"
+
+    def path(self, key: str) -> str:
+        """Get the path of the file of an object."""
+        parts = key.split("/")
+        if not key or any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid key '{key}'.")
+        return os.path.join(self.root, *parts)
+
+    def put(self, key: str, data: bytes) -> None:
+        with _TempFile(self.path(key)) as (temp_file, _):
+            temp_file.write(data)
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as file:
+            return file.read()
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        with open(self.path(key), "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
+    def list(self, prefix: str = "") -> dict[str, int]:
+        objects = {}
+        for current_dir, dir_names, file_names in os.walk(self.root):
+            relative_dir = os.path.relpath(current_dir, self.root).replace(os.sep, "/")
+
+            # only walk the directories that can contain keys with the prefix
+            dir_prefix = "" if relative_dir == "." else f"{relative_dir}/"
+            dir_names[:] = [name for name in dir_names if f"{dir_prefix}{name}/".startswith(prefix) or prefix.startswith(f"{dir_prefix}{name}/")]
+
+            for file_name in file_names:
+                key = file_name if relative_dir == "." else f"{relative_dir}/{file_name}"
+                if key.startswith(prefix):
+                    objects[key] = os.path.getsize(os.path.join(current_dir, file_name))
+
+        return objects
+
+    def delete(self, key: str) -> None:
+        os.remove(self.path(key))
+
+    def versions(self, prefix: str = "") -> dict[str, list]:
+        """Get the size and version of every object whose key starts with `prefix`, the version being the modification time of its file."""
+        versions = {}
+        for key in self.list(prefix):
+            if key != SYNC_STATE_KEY:
+                stat = os.stat(self.path(key))
+                versions[key] = [stat.st_size, stat.st_mtime_ns]
+        return versions
+
+    def put_file(self, key: str, file_path: str) -> None:
+        with _TempFile(self.path(key)) as (temp_file, _):
+            with open(file_path, "rb") as file:
+                shutil.copyfileobj(file, temp_file, 1024 * 1024)
+
+    def get_file(self, key: str, file_path: str) -> None:
+        shutil.copyfile(self.path(key), file_path)
+
+
+class ObjectStoreBackend(StorageBackend):
+    """Store objects on an HTTP object store, such as an S3 compatible bucket behind a proxy that handles authentication.
+
+    The store must answer the following requests, relative to `url`:
+    - `PUT /<key>` with the content of the object as body;
+    - `GET /<key>`, also with a `Range: bytes=<start>-<end>` header for partial reads;
+    - `DELETE /<key>`;
+    - `GET /?prefix=<prefix>`, answering with a json object containing the size of every object whose key starts with the prefix.
+
+    Each request waits for a round trip to the store, so `put_many` and `get_many` make several requests at once.
+    The objects are split into chunks of up to `chunk_size` bytes, and each chunk is sent one object per request by a single worker over its own persistent connection, with up to `workers` chunks in flight at once.
+
+    Parameters
+    ----------
+    url: str
+        The url of the store (or of a "directory" inside it), such as "http://localhost:9000/backups".
+
+    workers: int, optional
+        How many requests are made at the same time.
+
+    chunk_size: int, optional
+        How many bytes of small objects are sent by a worker before it takes the next chunk.
+
+    timeout: float, optional
+        How many seconds to wait for the store to answer.
+    """
+
+    def __init__(self, url: str, workers: int = STORAGE_WORKERS, chunk_size: int = CHUNK_SIZE, timeout: float = TIMEOUT):
+        parsed_url = urllib_parse.urlsplit(url)
+        if parsed_url.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported object store url '{url}', expected an http or https url.")
+
+        self.url = url
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._scheme = parsed_url.scheme
+        self._netloc = parsed_url.netloc
+        self._base_path = parsed_url.path.rstrip("/")
+        self._local = threading.local()  # the connection of every thread
+
+    def __repr__(self) -> str:
+        return f"ObjectStoreBackend({self.url!r})"
+
+    def __reduce__(self):
+        # connections can't be sent to other processes
+        return ObjectStoreBackend, (self.url, self.workers, self.chunk_size, self.timeout)
+
+    def put(self, key: str, data: bytes) -> None:
+        self._request("PUT", key, data)
+
+    def get(self, key: str) -> bytes:
+        return self._request("GET", key)
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        data = self._request("GET", key, headers={"Range": f"bytes={offset}-{offset + length - 1}"})
+
+        # stores that ignore ranges answer with the whole object
+        if self._last_status == 200:
+            data = data[offset : offset + length]
+        return data
+
+    def list(self, prefix: str = "") -> dict[str, int]:
+        return json.loads(self._request("GET", "", query={"prefix": prefix}))
+
+    def delete(self, key: str) -> None:
+        self._request("DELETE", key)
+
+    def put_many(self, items: Iterable[tuple[str, bytes]]) -> None:
+        def put_chunk(chunk: list[tuple[str, bytes]]) -> None:
+            for key, data in chunk:
+                self.put(key, data)
+
+        for _ in self._run_chunks(put_chunk, _chunk_items(items, self.chunk_size), "put"):
+            pass
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        def get_chunk(chunk: list[str]) -> list[tuple[str, bytes]]:
+            return [(key, self.get(key)) for key in chunk]
+
+        # the size of each object is only known once it's received, so chunks are made out of a fixed amount of keys instead
+        keys = list(keys)
+        chunk_length = max(min(CHUNK_MAX_OBJECTS, len(keys) // self.workers), 1)
+        chunks = (keys[i : i + chunk_length] for i in range(0, len(keys), chunk_length))
+
+        objects = {}
+        for chunk in self._run_chunks(get_chunk, chunks, "get"):
+            objects.update(chunk)
+        return objects
+
+    def put_file(self, key: str, file_path: str) -> None:
+        with open(file_path, "rb") as file:
+            self._request("PUT", key, file, headers={"Content-Length": str(os.path.getsize(file_path))})
+
+    def get_file(self, key: str, file_path: str) -> None:
+        with open(file_path, "wb") as file:
+            self._request("GET", key, output=file)
+
+    def _run_chunks(self, function, chunks: Iterator[list], name: str) -> Iterator:
+        """Run a function on every chunk using up to `workers` threads, without reading more chunks than the threads can take."""
+        with profiler.span(f"storage.{name}_many") as span:
+            with concurrent_futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storage") as executor:
+                pending = set()
+                count = 0
+                for chunk in chunks:
+                    pending.add(executor.submit(function, chunk))
+                    count += 1
+                    if len(pending) >= self.workers * 2:
+                        done, pending = concurrent_futures.wait(pending, return_when=concurrent_futures.FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+
+                for future in concurrent_futures.as_completed(pending):
+                    yield future.result()
+            span.set(chunks=count)
+
+    def _request(self, method: str, key: str, body=None, headers: dict | None = None, query: dict | None = None, output=None) -> bytes:
+        """Make a request for an object over the connection of the current thread, reconnecting once if the store closed it."""
+        path = f"{self._base_path}/{urllib_parse.quote(key)}"
+        if query:
+            path += "?" + urllib_parse.urlencode(query)
+
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                with profiler.span("storage.request", method=method):
+                    connection.request(method, path, body, headers or {})
+                    response = connection.getresponse()
+                    self._last_status = response.status
+                    if response.status == 404:
+                        response.read()
+                        raise FileNotFoundError(f"The object '{key}' doesn't exist on '{self.url}'.")
+                    if response.status >= 300:
+                        raise OSError(f"The object store at '{self.url}' answered {method} '{key}' with {response.status} {response.reason}: {response.read()[:200]!r}")
+
+                    if output is None:
+                        data = response.read()
+                        profiler.count(f"storage.{method.lower()}_bytes", len(data) if method == "GET" else len(body or b""))
+                        return data
+                    shutil.copyfileobj(response, output, 1024 * 1024)
+                    return b""
+
+            except (http_client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # persistent connections may be closed by the store while idle, in which case the request is sent again on a new one
+                connection.close()
+                self._local.connection = None
+                if attempt or hasattr(body, "read"):
+                    raise
+
+    def _get_connection(self) -> "http_client.HTTPConnection":
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = http_client.HTTPSConnection if self._scheme == "https" else http_client.HTTPConnection
+            connection = connection_class(self._netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    @property
+    def _last_status(self) -> int | None:
+        return getattr(self._local, "last_status", None)
+
+    @_last_status.setter
+    def _last_status(self, status: int) -> None:
+        self._local.last_status = status
+
+
+def open_storage(location: str) -> StorageBackend:
+    """Get the backend of an http or https url (see `ObjectStoreBackend`) or of the path of a directory (see `DirectoryBackend`)."""
+    if location.startswith(("http://", "https://")):
+        return ObjectStoreBackend(location)
+    return DirectoryBackend(os.path.realpath(location))
+
+
+def sync(source: StorageBackend, target: StorageBackend, prefix: str = "", delete: bool = False, exclude=None) -> dict:
+    """Copy every object that changed since the last sync from one backend to another.
+
+    The size and version of every copied object on the source (see `StorageBackend.versions`) are saved on the target as `SYNC_STATE_KEY`, so only objects whose version changed since then are copied again.
+    Objects are copied in chunks of up to `CHUNK_SIZE * STORAGE_WORKERS` bytes through `get_many` and `put_many`, so object stores transfer them concurrently.
+    Objects larger than `STREAM_THRESHOLD` are copied through a temporary file instead, so they're never fully held in memory.
+
+    Parameters
+    ----------
+    source, target: StorageBackend
+        The backends objects are copied from and to.
+
+    prefix: str, optional
+        Only copy objects whose key starts with this prefix.
+
+    delete: bool, optional
+        Whether to delete the objects of the target (under the prefix) that don't exist on the source, making it an exact copy.
+
+    exclude: Callable[[str], bool], None, optional
+        Objects whose key this returns True for are neither copied nor deleted.
+
+    Returns
+    -------
+    dict
+        A report with how many objects and bytes were copied and how many objects were deleted.
+    """
+    source_versions = {key: version for key, version in source.versions(prefix).items() if exclude is None or not exclude(key)}
+    target_objects = {key: size for key, size in target.list(prefix).items() if key != SYNC_STATE_KEY and (exclude is None or not exclude(key))}
+    state = _read_state(target)
+
+    # objects that weren't copied by `sync` or changed on either side since then are copied again
+    copied = [key for key, (size, version) in source_versions.items() if version is None or state.get(key) != [size, version] or target_objects.get(key) != size]
+    source_objects = {key: size for key, (size, _) in source_versions.items()}
+    report = {"copied": len(copied), "bytes": sum(source_objects[key] for key in copied), "deleted": 0}
+
+    # copy small objects in chunks, so every worker has something to do without holding everything in memory
+    small = [key for key in copied if source_objects[key] <= STREAM_THRESHOLD]
+    chunk, chunk_size = [], 0
+    for key in small + [None]:
+        if key is not None:
+            chunk.append(key)
+            chunk_size += source_objects[key]
+        if chunk and (key is None or chunk_size >= CHUNK_SIZE * STORAGE_WORKERS):
+            target.put_many(source.get_many(chunk).items())
+            chunk, chunk_size = [], 0
+
+    # copy large objects through a file, which is the object itself when either side is a directory
+    for key in copied:
+        if source_objects[key] <= STREAM_THRESHOLD:
+            continue
+        if isinstance(source, DirectoryBackend):
+            target.put_file(key, source.path(key))
+        elif isinstance(target, DirectoryBackend):
+            with _TempFile(target.path(key)) as (temp_file, temp_path):
+                temp_file.close()
+                source.get_file(key, temp_path)
+        else:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_path = os.path.join(temp_dir, "object")
+                source.get_file(key, temp_path)
+                target.put_file(key, temp_path)
+
+    if delete:
+        for key in target_objects.keys() - source_objects.keys():
+            target.delete(key)
+            state.pop(key, None)
+            report["deleted"] += 1
+
+    # save the state only after everything was copied, so an interrupted sync copies the same objects again
+    if copied or report["deleted"]:
+        state.update(source_versions)
+        target.put(SYNC_STATE_KEY, json.dumps(state).encode())
+
+    return report
+
+
+def _read_state(backend: StorageBackend) -> dict[str, list]:
+    """Read the versions saved on a backend by `sync`."""
+    try:
+        return json.loads(backend.get(SYNC_STATE_KEY))
+    except FileNotFoundError:
+        return {}
+
+
+def _chunk_items(items: Iterable[tuple[str, bytes]], chunk_size: int) -> Iterator[list[tuple[str, bytes]]]:
+    """Split (key, data) pairs into chunks of up to `chunk_size` bytes and `CHUNK_MAX_OBJECTS` objects, objects larger than that get a chunk of their own."""
+    chunk, size = [], 0
+    for key, data in items:
+        if chunk and (size + len(data) > chunk_size or len(chunk) >= CHUNK_MAX_OBJECTS):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((key, data))
+        size += len(data)
+
+    if chunk:
+        yield chunk
+
+
+class _TempFile:
+    """A temporary file next to `path` that's renamed over it if nothing goes wrong, giving `(file, temp_path)`."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        return self.file, self.temp_path
+
+    def __exit__(self, exc_type, *exc_info):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
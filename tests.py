@@ -1,17 +1,54 @@
+import concurrent.futures
+import difflib
 import tempfile
+import asyncio
+import io
 import zipfile
 import shutil
 import random
+import subprocess
+import threading
 import string
+import time
+import json
+import sys
 import os
 
 import pytest
 
-from backup import get_changes, apply_changes, create_backup, restore_backup, Change, BackupExceptions
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import benchmarks
+import backup
+import aio
+import utils
+import server
+import storage
+import watch
+from backup import get_changes, get_line_changes, compose_changes, invert_changes, get_file_changes, is_text_file, apply_changes, iter_applied_changes, create_backup, restore_backup, read_backup, Change, ChangeSet, BackupExceptions
 
 types = Change.ChangeTypes
 
 
+@pytest.fixture(autouse=True)
+def default_settings(tmp_path, monkeypatch):
+    """Use the default settings instead of the ones tuned for the machine running the tests."""
+    # paths are set straight on the module so the real ones are never resolved
+    monkeypatch.setitem(vars(backup), "CONFIG_FILE_PATH", str(tmp_path / "config.json"))
+    monkeypatch.setattr(backup, "_settings", None)
+
+
+@pytest.fixture
+def backup_data_dir(tmp_path, monkeypatch):
+    """Point the global backups to a temporary directory."""
+    data_dir = tmp_path / "backups"
+    data_dir.mkdir()
+    monkeypatch.setitem(vars(backup), "BACKUP_DATA_DIR", str(data_dir))
+    monkeypatch.setitem(vars(backup), "TRACKED_FILES_LIST_PATH", str(data_dir / "tracked.json"))
+
+    return str(data_dir)
+
+
 class TempFileHelper:
     temp_files = []
 
@@ -40,7 +77,7 @@ class TempFileHelper:
         return False
 
 
-def validate_changes_shortcut(old_file_content: bytes, new_file_content: bytes):
+def validate_changes_shortcut(old_file_content: bytes, new_file_content: bytes, get_changes=get_changes):
     """Shortcut for testing if the changes from `get_changes` result on the updated file.
 
     Steps taken:
@@ -60,6 +97,80 @@ def validate_changes_shortcut(old_file_content: bytes, new_file_content: bytes):
                 assert old_file.read() == new_file.read()
 
 
+def concurrent_backups_worker(backup_data_dir: str, file_path: str, shared_timestamps: list[int], worker: int) -> None:
+    """Back up a file of its own and reword backups of a file shared with other workers, from a separate process."""
+    vars(backup)["BACKUP_DATA_DIR"] = backup_data_dir
+    vars(backup)["TRACKED_FILES_LIST_PATH"] = os.path.join(backup_data_dir, "tracked.json")
+
+    for i, timestamp in enumerate(shared_timestamps):
+        with open(file_path, "a") as file:
+            file.write(f"worker {worker} version {i}\n")
+        backup.create_global_backup(file_path, f"{worker} {i}")
+        backup.create_backup_message(0, timestamp, f"{worker} {i}")
+
+
+class LocalObjectStore(ThreadingHTTPServer):
+    """A stand-in for an object store that keeps objects in memory, answering the requests made by `storage.ObjectStoreBackend`."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.objects = {}
+        self.connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), LocalObjectStoreHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/bucket"
+
+
+class LocalObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    disable_nagle_algorithm = True  # headers and content are written separately, which would otherwise wait for delayed acknowledgements
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.objects[self._key()] = data
+        self._answer(200, b"")
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if query:
+            prefix = storage.urllib_parse.parse_qs(query).get("prefix", [""])[0]
+            with self.server.lock:
+                listing = {key: len(data) for key, data in self.server.objects.items() if key.startswith(prefix)}
+            return self._answer(200, json.dumps(listing).encode())
+
+        data = self.server.objects.get(self._key())
+        if data is None:
+            return self._answer(404, b"")
+        if "Range" in self.headers:
+            start, end = map(int, self.headers["Range"].removeprefix("bytes=").split("-"))
+            return self._answer(206, data[start : end + 1])
+        self._answer(200, data)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            found = self.server.objects.pop(self._key(), None) is not None
+        self._answer(200 if found else 404, b"")
+
+    def _key(self) -> str:
+        return storage.urllib_parse.unquote(self.path.partition("?")[0].removeprefix("/bucket/"))
+
+    def _answer(self, status: int, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
 class TestCore:
     def test_apply_changes_add(self):
         """Test the `apply_changes` function with an addition"""
@@ -255,3 +366,1219 @@ class TestCore:
                 with open(old_file_path, "rb") as old_file:
                     with open(new_file_path, "rb") as new_file:
                         assert old_file.read() == new_file.read()
+
+    def test_iter_applied_changes(self):
+        """Test if applying changes in blocks results on the same file as `apply_changes` and leaves the original file untouched."""
+        with TempFileHelper() as helper:
+            old_file_path = helper.create(b"this is an example of very short a file")
+            new_file_path = helper.create(b"this is an example from a file")
+
+            changes = get_changes(old_file_path, new_file_path)
+            content = b"".join(iter_applied_changes(changes, old_file_path, block_size=4))
+
+            assert content == b"this is an example from a file"
+            with open(old_file_path, "rb") as old_file:
+                assert old_file.read() == b"this is an example of very short a file"
+
+    def test_compose_changes(self):
+        """Test if composing the changes from A to B and from B to C results on the changes from A to C."""
+        with TempFileHelper() as helper:
+            a_path = helper.create(b"the first version of the file")
+            b_path = helper.create(b"the second version of this file")
+            c_path = helper.create(b"a third version of this file!")
+
+            changes = compose_changes(get_changes(a_path, b_path), get_changes(b_path, c_path))
+            apply_changes(changes, a_path)
+
+            with open(a_path, "rb") as a_file:
+                assert a_file.read() == b"a third version of this file!"
+
+    def test_invert_changes(self):
+        """Test if inverting the changes from A to B results on the changes from B to A."""
+        with TempFileHelper() as helper:
+            a_path = helper.create(b"the first version of the file")
+            b_path = helper.create(b"a second version of this file!")
+
+            changes = invert_changes(get_changes(a_path, b_path))
+            apply_changes(changes, b_path)
+
+            with open(b_path, "rb") as b_file:
+                assert b_file.read() == b"the first version of the file"
+
+    def test_change_set_shares_payload(self):
+        """Test if a change set stores the content of every change on a single payload and returns views of it."""
+        changes = ChangeSet.from_changes([Change(types.ADD.value, 0, b"both"), Change(types.RMV.value, 0, b"apply")])
+
+        assert len(changes) == 2
+        assert changes.payload == b"bothapply"
+        assert isinstance(changes[1].content, memoryview)
+        assert (changes[1].type, changes[1].position, bytes(changes[1].content)) == (types.RMV.value, 0, b"apply")
+
+        # slices share the same payload
+        tail = changes[1:]
+        assert tail.payload is changes.payload
+        assert bytes(tail.payload_view()) == b"apply"
+
+    def test_read_backup(self):
+        """Test if the change set read from a backup file is the same one returned by `get_changes`."""
+        with TempFileHelper() as helper:
+            old_file_path = helper.create(b"initial file content")
+            new_file_path = helper.create(b"final file content")
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                backup_path = os.path.join(temp_dir, "backup")
+                create_backup(old_file_path, new_file_path, backup_path)
+
+                changes = get_changes(old_file_path, new_file_path)
+                stored_changes = read_backup(backup_path)
+
+                assert list(stored_changes.types) == list(changes.types)
+                assert list(stored_changes.positions) == list(changes.positions)
+                assert list(stored_changes.sizes) == list(changes.sizes)
+                assert bytes(stored_changes.payload) == bytes(changes.payload)
+
+    def test_get_line_changes(self):
+        """Test the line-aware diff with lines added, removed and edited."""
+        validate_changes_shortcut(
+            b"[section]\nflag = true\nname = example\nvalue = 10\n",
+            b"[section]\nflag = false\nvalue = 10\nextra = 1\n",
+            get_line_changes,
+        )
+
+    def test_get_line_changes_repeated_characters(self):
+        """Test if the line-aware diff results on smaller changes than the byte diff when an edit repeats nearby characters."""
+        old_content = b"".join(f"key_{i} = aaaa{i}\n".encode() for i in range(200))
+        new_content = old_content.replace(b"key_5 = aaaa5\n", b"key_5 = aaaaa5\nkey_5b = aaaa5\n")
+        validate_changes_shortcut(old_content, new_content, get_line_changes)
+
+        with TempFileHelper() as helper:
+            old_file_path = helper.create(old_content)
+            new_file_path = helper.create(new_content)
+
+            line_changes = get_line_changes(old_file_path, new_file_path)
+            byte_changes = get_changes(old_file_path, new_file_path)
+            assert len(line_changes.payload) <= len(byte_changes.payload)
+
+    def test_get_file_changes_auto(self):
+        """Test if the "auto" mode detects text and binary files."""
+        with TempFileHelper() as helper:
+            text_file_path = helper.create(b"some text\n")
+            binary_file_path = helper.create(b"\0\1\2 binary")
+
+            assert is_text_file(text_file_path)
+            assert not is_text_file(binary_file_path)
+            assert len(get_file_changes(text_file_path, binary_file_path, "auto")) > 0
+
+            with pytest.raises(ValueError):
+                get_file_changes(text_file_path, binary_file_path, "unknown")
+
+    def test_benchmark_corpus(self):
+        """Test if the benchmark corpus is reproducible and every case results on different files."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for case in benchmarks.CASES:
+                paths = [os.path.join(temp_dir, name) for name in ("old", "new", "old_again", "new_again")]
+                benchmarks.generate_case(case, 3000, paths[0], paths[1], seed=1)
+                benchmarks.generate_case(case, 3000, paths[2], paths[3], seed=1)
+
+                contents = []
+                for path in paths:
+                    with open(path, "rb") as file:
+                        contents.append(file.read())
+
+                assert contents[0] == contents[2] and contents[1] == contents[3]
+                assert contents[0] != contents[1]
+
+    def test_apply_changes_group_sizes(self):
+        """Test if changes are applied correctly with any group size and amount of workers."""
+        old_content = random.Random(0).randbytes(5000)
+        new_content = bytearray(old_content)
+        for position in range(4000, 0, -400):
+            new_content[position : position + 10] = b"new content"
+
+        for group_size, workers in ((1, 1), (2, 3), (255, 20)):
+            backup.save_settings({"apply_group_size": group_size, "apply_workers": workers})
+            validate_changes_shortcut(old_content, bytes(new_content))
+
+    def test_import_side_effects(self, tmp_path):
+        """Test if importing the module doesn't touch the file system or load slow modules, and paths are still resolved when used."""
+        script = "import os, sys, backup; print(os.path.exists(os.environ['XDG_DATA_HOME'])); print('zipfile' in sys.modules); print(backup.BACKUP_DATA_DIR)"
+        environment = {**os.environ, "XDG_DATA_HOME": str(tmp_path / "data")}
+        output = subprocess.run([sys.executable, "-c", script], env=environment, cwd=os.path.dirname(backup.__file__), capture_output=True, text=True, check=True).stdout.split("\n")
+
+        assert output[0] == "False"
+        assert output[1] == "False"
+        assert output[2] == str(tmp_path / "data" / "BackTrack" / "backups")
+        assert os.path.isdir(output[2])
+
+    def test_concurrent_first_use(self, tmp_path):
+        """Test if modules loaded lazily can be first used by several threads at the same time, on a fresh process."""
+        script = (
+            "import os, sys, threading, backup\n"
+            "paths = [os.path.join(sys.argv[1], f'file{i}.txt') for i in range(8)]\n"
+            "for path in paths:\n"
+            "    open(path, 'w').write(path)\n"
+            "threads = [threading.Thread(target=backup.create_global_backup, args=(path,)) for path in paths]\n"
+            "[thread.start() for thread in threads]\n"
+            "[thread.join() for thread in threads]\n"
+            "print(len(backup.list_tracked_files()))\n"
+        )
+        environment = {**os.environ, "XDG_DATA_HOME": str(tmp_path / "data"), "BAK_NO_SERVER": "1"}
+        for i in range(3):
+            os.makedirs(tmp_path / str(i))
+            process = subprocess.run([sys.executable, "-c", script, str(tmp_path / str(i))], env=environment, cwd=os.path.dirname(backup.__file__), capture_output=True, text=True)
+            assert process.stderr == ""
+            assert process.stdout == f"{8 * (i + 1)}\n"
+
+    def test_profiler(self, tmp_path):
+        """Test if the profiler records nested spans and counters only while enabled."""
+        profiler = utils.profiler
+        with TempFileHelper() as helper:
+            old_file_path = helper.create(b"first line\nsecond line\n")
+            new_file_path = helper.create(b"first line\nnew line\nsecond line\n")
+            backup_file_path = str(tmp_path / "backup")
+
+            # nothing is recorded while disabled
+            assert profiler.span("diff") is utils.NULL_SPAN
+            create_backup(old_file_path, new_file_path, backup_file_path)
+            assert not profiler.records
+
+            profiler.enable()
+            try:
+                with profiler.span("outer"):
+                    create_backup(old_file_path, new_file_path, backup_file_path)
+                    restore_backup(backup_file_path, old_file_path, str(tmp_path / "restored"))
+            finally:
+                profiler.disable()
+
+            spans = {record["name"]: record for record in profiler.records}
+            for name in ("diff", "serialize", "compress", "decompress", "parse", "apply"):
+                assert spans[name]["parent"] == spans["outer"]["id"]
+            assert spans["diff"]["attributes"]["changes"] == 1
+            assert profiler.counters["diff.changes"] == 1
+            assert profiler.counters["apply.changes"] == 1
+
+            # every line of the export is a json record
+            profiler.export(str(tmp_path / "profile.jsonl"))
+            with open(tmp_path / "profile.jsonl", "r", encoding="utf8") as profile_file:
+                records = [json.loads(line) for line in profile_file]
+            assert len(records) == len(profiler.records) + len(profiler.counters) + 1
+
+
+class TestGlobal:
+    def test_restore_global_backup(self, backup_data_dir, tmp_path):
+        """Test if every version of a globally tracked file can be restored."""
+        file_path = str(tmp_path / "tracked.txt")
+        versions = [b"first version\n", b"first version\nsecond line\n", b"third version\nsecond line\n"]
+        for content in versions:
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+
+        timestamps = backup.list_file_backups(0)
+        for timestamp, content in zip(timestamps, versions):
+            backup.restore_global_backup(0, timestamp, unsaved_changes_ok=True)
+            with open(file_path, "rb") as file:
+                assert file.read() == content
+
+    def test_create_global_backup_no_changes(self, backup_data_dir, tmp_path):
+        """Test if backing up a file that didn't change raises `NoChangesException`."""
+        file_path = str(tmp_path / "tracked.txt")
+        with open(file_path, "wb") as file:
+            file.write(b"content")
+        backup.create_global_backup(file_path)
+
+        with pytest.raises(BackupExceptions.NoChangesException):
+            backup.create_global_backup(file_path)
+
+    def test_best_base(self, backup_data_dir, tmp_path):
+        """Test if a file that goes back to a previous state is backed up against that state instead of head."""
+        file_path = str(tmp_path / "config.txt")
+        common = b"".join(f"option_{i} = {i}\n".encode() for i in range(100))
+        states = [common + b"flag = true\n" * 20, common + b"flag = false\n" * 20]
+        for content in states + states:
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+
+        timestamps = backup.list_file_backups(0)
+        assert backup.get_backup_chain(0, timestamps[2]) == [timestamps[0], timestamps[2]]
+        assert backup.get_backup_chain(0, timestamps[3]) == [timestamps[0], timestamps[1], timestamps[3]]
+
+        for timestamp, content in zip(timestamps, states + states):
+            backup.restore_global_backup(0, timestamp, unsaved_changes_ok=True)
+            with open(file_path, "rb") as file:
+                assert file.read() == content
+
+    def test_cat_global_backup(self, backup_data_dir, tmp_path):
+        """Test if writing an old version to another file leaves the tracked file and the current timestamp untouched."""
+        file_path = str(tmp_path / "tracked.txt")
+        for content in (b"old content\n", b"new content\n"):
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+
+        timestamps = backup.list_file_backups(0)
+        with open(os.path.join(backup_data_dir, "0", "timestamp"), "r") as timestamp_file:
+            current_timestamp = timestamp_file.read()
+
+        output_path = str(tmp_path / "output")
+        backup.cat_global_backup(0, timestamps[0], output_path)
+
+        with open(output_path, "rb") as output_file:
+            assert output_file.read() == b"old content\n"
+        with open(file_path, "rb") as file:
+            assert file.read() == b"new content\n"
+        with open(os.path.join(backup_data_dir, "0", "timestamp"), "r") as timestamp_file:
+            assert timestamp_file.read() == current_timestamp
+
+    def test_read_backup_range(self, backup_data_dir, tmp_path):
+        """Test if reading sections of old versions returns the same content as the full versions."""
+        file_path = str(tmp_path / "tracked.bin")
+        content = bytearray(random.randbytes(300))
+        versions = []
+        for _ in range(4):
+            content[10:20] = random.randbytes(15)
+            content += random.randbytes(10)
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+            versions.append(bytes(content))
+
+        for timestamp, version in zip(backup.list_file_backups(0), versions):
+            assert backup.read_backup_range(0, timestamp, 0, 16) == version[:16]
+            assert backup.read_backup_range(0, timestamp, 5, 40) == version[5:45]
+            assert backup.read_backup_range(0, timestamp, 290) == version[290:]
+            assert backup.read_backup_range(0, timestamp, len(version) + 5, 10) == b""
+
+    def test_repack_global_backups(self, backup_data_dir, tmp_path):
+        """Test if every version can still be restored after a repack and chains respect the keyframe interval."""
+        file_path = str(tmp_path / "tracked.txt")
+        versions = []
+        for i in range(6):
+            content = b"".join(f"line {j} of version {i if j == i else 0}\n".encode() for j in range(30))
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+            versions.append(content)
+
+        report = backup.repack_global_backups(0, keyframe_interval=2)
+        assert report["versions"] == 6
+        assert report["longest_chain_after"] <= 2
+        assert not os.path.exists(os.path.join(backup_data_dir, "0", "changes.old"))
+
+        for timestamp, content in zip(backup.list_file_backups(0), versions):
+            assert len(backup.get_backup_chain(0, timestamp)) <= 2
+            output_path = str(tmp_path / "output")
+            backup.cat_global_backup(0, timestamp, output_path)
+            with open(output_path, "rb") as output_file:
+                assert output_file.read() == content
+
+    def test_diff_global_backup(self, backup_data_dir, tmp_path, monkeypatch):
+        """Test if diffs found from the backups alone match the versions, in both directions and across full copies."""
+        file_path = str(tmp_path / "tracked.txt")
+        lines = [f"line {i}\n" for i in range(40)]
+        versions = []
+        for i in range(5):
+            lines[i * 7] = f"changed on version {i}\n"
+            lines.insert(i * 9, f"added on version {i}\n")
+            with open(file_path, "w") as file:
+                file.write("".join(lines))
+            backup.create_global_backup(file_path)
+            versions.append("".join(lines))
+        timestamps = backup.list_file_backups(0)
+
+        def diff(old: int, new: int, mode: str | None = None) -> str:
+            output = io.BytesIO()
+            backup.diff_global_backup(0, timestamps[old], timestamps[new], output, mode)
+            return output.getvalue().decode()
+
+        for old, new in ((1, 2), (3, 0), (0, 4)):
+            expected = difflib.unified_diff(versions[old].splitlines(True), versions[new].splitlines(True))
+            assert diff(old, new).splitlines(True)[2:] == list(expected)[2:]
+        assert diff(2, 2) == ""
+
+        # binary diffs only show the changed sections
+        summary = diff(1, 2, "binary").splitlines()
+        assert summary[2].startswith("Binary versions differ")
+        assert all(line.startswith("@@ -") for line in summary[3:])
+
+        # old versions too large to be held in memory are always shown as binary
+        monkeypatch.setattr(backup, "TEXT_DIFF_MAX_SIZE", len(versions[1]) - 1)
+        assert diff(1, 2, "text") == diff(1, 2, "binary")
+        assert diff(0, 1, "text") != diff(0, 1, "binary")
+
+        # the changes are the same when the versions are on chains with nothing in common
+        backup.repack_global_backups(0, keyframe_interval=1)
+        for old, new in ((1, 2), (4, 0)):
+            old_path = str(tmp_path / "old")
+            with open(old_path, "w") as old_file:
+                old_file.write(versions[old])
+            changes = backup.get_backup_changes(0, timestamps[old], timestamps[new])
+            assert b"".join(iter_applied_changes(changes, old_path)) == versions[new].encode()
+
+    def test_repack_interrupted_swap(self, backup_data_dir, tmp_path):
+        """Test if a repack interrupted while swapping the backups is finished when listing them."""
+        file_path = str(tmp_path / "tracked.txt")
+        for content in (b"first\n", b"second\n"):
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+
+        backups_dir = os.path.join(backup_data_dir, "0")
+        shutil.copytree(os.path.join(backups_dir, "changes"), os.path.join(backups_dir, "changes.repack"))
+        os.rename(os.path.join(backups_dir, "changes"), os.path.join(backups_dir, "changes.old"))
+
+        assert len(backup.list_file_backups(0)) == 2
+        assert not os.path.exists(os.path.join(backups_dir, "changes.old"))
+
+    def test_select_retained_backups(self):
+        """Test the grandfather-father-son retention rules."""
+        hour = 3600 * 10**9
+        timestamps = [1_700_000_000 * 10**9 + i * hour // 2 for i in range(8)]  # one backup every half an hour
+
+        assert backup.select_retained_backups(timestamps, keep_last=2) == set(timestamps[-2:])
+
+        hourly = backup.select_retained_backups(timestamps, keep_last=0, hourly=2)
+        assert len(hourly) == 2
+        assert timestamps[-1] in hourly
+
+    def test_prune_global_backups(self, backup_data_dir, tmp_path):
+        """Test if the kept versions can still be restored after deleting the ones in between."""
+        file_path = str(tmp_path / "tracked.txt")
+        versions = []
+        for i in range(5):
+            content = b"".join(f"line {j} version {i if j % 5 == i else 0}\n".encode() for j in range(20))
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+            versions.append(content)
+
+        timestamps = backup.list_file_backups(0)
+        backup.restore_global_backup(0, timestamps[2])
+
+        dropped = backup.prune_global_backups(0, keep_last=2)
+        assert dropped == timestamps[:2]
+        assert backup.list_file_backups(0) == timestamps[2:]
+        assert str(timestamps[0]) not in backup.JSONManager(os.path.join(backup_data_dir, "0", "checksums.json"), {}).read()
+
+        for timestamp, content in zip(timestamps[2:], versions[2:]):
+            output_path = str(tmp_path / "output")
+            backup.cat_global_backup(0, timestamp, output_path)
+            with open(output_path, "rb") as output_file:
+                assert output_file.read() == content
+
+    def test_pack_global_backups(self, backup_data_dir, tmp_path, monkeypatch):
+        """Test if packed backups are read the same way as loose ones, and if loose backups are packed automatically."""
+        monkeypatch.setattr(backup, "PACK_THRESHOLD", 4)
+        file_path = str(tmp_path / "tracked.txt")
+        changes_dir = os.path.join(backup_data_dir, "0", "changes")
+        versions = []
+        for i in range(6):
+            content = b"".join(f"line {j} of version {i if j % 6 == i else 0}\n".encode() for j in range(30))
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+            versions.append(content)
+
+        # the first four backups were packed once the fourth was created
+        timestamps = backup.list_file_backups(0)
+        assert len(timestamps) == 6
+        assert sorted(os.listdir(changes_dir)) == sorted([f"{timestamps[0]}.pack", f"{timestamps[0]}.idx", str(timestamps[4]), str(timestamps[5])])
+        assert backup.pack_global_backups(0) == 2
+        assert backup.list_file_backups(0) == timestamps
+
+        for timestamp, content in zip(timestamps, versions):
+            assert b"".join(backup.iter_global_backup(0, timestamp)) == content
+            assert backup.read_backup_range(0, timestamp, 5, 40) == content[5:45]
+        assert backup.verify_global_backups(0)["ok"]
+
+        # repack and prune pack the backups they create
+        backup.repack_global_backups(0)
+        assert len([name for name in os.listdir(changes_dir) if name.endswith(".pack")]) == 1
+        backup.prune_global_backups(0, keep_last=3)
+        assert not [name for name in os.listdir(changes_dir) if name.isdigit()]
+        for timestamp, content in zip(timestamps[3:], versions[3:]):
+            assert b"".join(backup.iter_global_backup(0, timestamp)) == content
+
+    def test_export_import_global_backups(self, backup_data_dir, tmp_path):
+        """Test if a bundle brings every version to a new backup index and path, and if damaged bundles aren't imported."""
+        file_path = str(tmp_path / "tracked.txt")
+        versions = []
+        for i in range(3):
+            content = f"version {i}\n".encode() * 10
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path, f"message {i}")
+            versions.append(content)
+
+        bundle = io.BytesIO()
+        backup.export_global_backups(0, bundle)
+        with pytest.raises(backup.BackupExceptions.FileAlreadyTrackedError):
+            backup.import_global_backups(io.BytesIO(bundle.getvalue()))
+
+        imported_path = str(tmp_path / "imported.txt")
+        assert backup.import_global_backups(io.BytesIO(bundle.getvalue()), imported_path) == 1
+        assert backup.get_tracked_path(1) == imported_path
+        timestamps = backup.list_file_backups(1)
+        assert timestamps == backup.list_file_backups(0)
+        assert backup.get_backup_message(1, timestamps[0]) == "message 0"
+        for timestamp, content in zip(timestamps, versions):
+            assert b"".join(backup.iter_global_backup(1, timestamp)) == content
+
+        # flip a byte of the content of the last member before the checksums
+        damaged = bytearray(bundle.getvalue())
+        damaged[damaged.index(versions[-1])] ^= 1
+        with pytest.raises(backup.BackupExceptions.CorruptedBackupError):
+            backup.import_global_backups(io.BytesIO(bytes(damaged)), str(tmp_path / "damaged.txt"))
+        assert len(backup.list_tracked_files()) == 2
+        assert not [name for name in os.listdir(backup_data_dir) if name.startswith("import.")]
+
+    def test_verify_global_backups(self, backup_data_dir, tmp_path):
+        """Test if verifying detects a version that doesn't match its checksum, using a pool of processes."""
+        for name in ("first.txt", "second.txt"):
+            file_path = str(tmp_path / name)
+            for content in (b"first version\n", b"second version\n"):
+                with open(file_path, "wb") as file:
+                    file.write(content)
+                backup.create_global_backup(file_path)
+
+        reports = backup.verify_all_global_backups(workers=2)
+        assert [report["ok"] for report in reports] == [True, True]
+        assert reports[0]["checked"] == 2
+
+        # tamper with the checksum of the first version of the second file, once it's saved to checksums.json
+        backup._compact_journal()
+        checksums_manager = backup.JSONManager(os.path.join(backup_data_dir, "1", "checksums.json"), {})
+        checksums_json = checksums_manager.read()
+        first_timestamp = backup.list_file_backups(1)[0]
+        checksums_json[str(first_timestamp)] = "0" * 64
+        checksums_manager.save(checksums_json)
+
+        report = backup.verify_global_backups(1)
+        assert not report["ok"]
+        assert report["failed"] == [first_timestamp]
+        assert backup.verify_global_backups(0, sample=1)["checked"] == 1
+
+    def test_backup_stats(self, backup_data_dir, tmp_path):
+        """Test if the stats saved when creating backups match the backups, and if they're measured again for backups without stats."""
+        file_path = str(tmp_path / "tracked.txt")
+        versions = []
+        for i in range(5):
+            content = b"".join(f"line {j} of version {i if j % 5 == i else 0}\n".encode() for j in range(40))
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path)
+            versions.append(content)
+
+        def measure() -> dict:
+            changes_index = backup._get_changes_index(os.path.join(backup_data_dir, "0", "changes"))
+            sizes = {timestamp: changes_index.size(timestamp) for timestamp in backup.list_file_backups(0)}
+            chains = {timestamp: backup.get_backup_chain(0, timestamp) for timestamp in sizes}
+            return {
+                "versions": len(sizes),
+                "backups_size": sum(sizes.values()),
+                "head_size": len(versions[-1]),
+                "versions_size": sum(len(content) for content in versions[-len(sizes) :]),
+                "chain_length": len(chains[max(sizes)]),
+                "longest_chain": max(len(chain) for chain in chains.values()),
+                "restore_size": max(sum(sizes[step] for step in chain) for chain in chains.values()),
+            }
+
+        stats = backup.get_backup_stats(0)
+        assert {name: stats[name] for name in measure()} == measure()
+        assert stats["stored_size"] == stats["backups_size"] + stats["head_size"]
+        assert stats["compression_ratio"] == stats["versions_size"] / stats["stored_size"]
+
+        # backups created before stats existed are measured from their backups
+        backup._compact_journal()
+        os.remove(os.path.join(backup_data_dir, "0", "stats.json"))
+        backup._get_metadata_cache().clear()
+        assert backup.get_backup_stats(0) == stats
+
+        # repack and prune save the stats of the backups they create
+        backup.repack_global_backups(0, keyframe_interval=2)
+        stats = backup.get_backup_stats(0)
+        assert stats["longest_chain"] <= 2
+        assert {name: stats[name] for name in measure()} == measure()
+        backup.prune_global_backups(0, keep_last=2)
+        assert {name: backup.get_backup_stats(0)[name] for name in measure()} == measure()
+
+    def test_tune_settings(self, backup_data_dir, tmp_path):
+        """Test if tuned settings are saved, read back on the next run and used for new backups."""
+        report = backup.tune_settings(64 * 1024)
+        assert report["settings"]["compression"] in backup.COMPRESSION_METHODS
+        assert len(report["measurements"]["apply_group_size"]) == 3
+
+        # simulate a new run reading the config file
+        backup._settings = None
+        assert backup.get_settings() == report["settings"]
+
+        backup.save_settings({"compression": "bzip2", "compresslevel": 9})
+        changes = ChangeSet()
+        changes.append(types.ADD.value, 0, b"content")
+        backup.write_backup(changes, str(tmp_path / "backup"))
+        with zipfile.ZipFile(tmp_path / "backup") as zip_file:
+            assert zip_file.getinfo("changes").compress_type == zipfile.ZIP_BZIP2
+        assert backup.get_settings()["apply_workers"] == backup.DEFAULT_SETTINGS["apply_workers"]
+
+    @pytest.mark.parametrize("polling", [False, True])
+    def test_backup_watcher(self, backup_data_dir, tmp_path, polling):
+        """Test if the watcher coalesces a burst of writes into a single backup and picks up newly tracked files."""
+        first_path = str(tmp_path / "first.txt")
+        second_path = str(tmp_path / "second.txt")
+        for path in (first_path, second_path):
+            with open(path, "w") as file:
+                file.write("first version\n")
+        backup.create_global_backup(first_path)
+
+        backed_up = []
+        both_backed_up = threading.Event()
+
+        def on_backup(path: str, error: Exception | None) -> None:
+            backed_up.append((path, error))
+            if len(backed_up) == 2:
+                both_backed_up.set()
+
+        # know when the watcher starts watching each file
+        watching = {first_path: threading.Event(), second_path: threading.Event()}
+
+        class Watcher(watch.BackupWatcher):
+            def _refresh(self):
+                super()._refresh()
+                for path, event in watching.items():
+                    if path in self.watcher.paths:
+                        event.set()
+
+        watcher = Watcher(debounce=0.3, polling=polling, poll_interval=0.05, on_backup=on_backup)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        try:
+            assert watching[first_path].wait(5)
+            for i in range(5):
+                with open(first_path, "a") as file:
+                    file.write(f"line {i}\n")
+                time.sleep(0.02)
+            backup.create_global_backup(second_path)
+            assert watching[second_path].wait(5)
+            with open(second_path, "a") as file:
+                file.write("second version\n")
+
+            # wait for both backups
+            assert both_backed_up.wait(5)
+        finally:
+            watcher.stop()
+            thread.join()
+
+        assert sorted(backed_up) == [(first_path, None), (second_path, None)]
+        assert len(backup.list_file_backups(0)) == 2
+        assert len(backup.list_file_backups(1)) == 2
+
+    def test_backup_watcher_errors(self, backup_data_dir, tmp_path, capsys):
+        """Test if backups that fail are reported on stderr when there's no callback."""
+        file_path = str(tmp_path / "tracked.txt")
+        watcher = watch.BackupWatcher()
+        watcher._backup(file_path)
+
+        assert f"Could not back up file '{file_path}'" in capsys.readouterr().err
+
+    def test_backup_server(self, backup_data_dir, tmp_path, monkeypatch, capsysbinary):
+        """Test if commands sent to the server run like local ones, including their output, exit codes and relative paths, and if `main` forwards commands to it."""
+        socket_path = str(tmp_path / "server.sock")
+        monkeypatch.setitem(vars(backup), "SERVER_SOCKET_PATH", socket_path)
+        with open(tmp_path / "file.txt", "w") as file:
+            file.write("first version\n")
+
+        backup_server = server.BackupServer()
+        thread = threading.Thread(target=backup_server.serve_forever)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 5
+            while not os.path.exists(socket_path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            def send(arguments):
+                output, errors = io.BytesIO(), io.BytesIO()
+                exit_code = server.send_command(arguments, cwd=str(tmp_path), output=output, errors=errors)
+                return exit_code, output.getvalue(), errors.getvalue()
+
+            exit_code, output, _ = send(["create", "file.txt", "first"])
+            assert exit_code == 0 and b"New backup created" in output
+            assert backup.list_tracked_files()[0]["path"] == str(tmp_path / "file.txt")
+
+            assert send(["cat", "0", "0"]) == (0, b"first version\n", b"")
+
+            exit_code, _, errors = send(["restore", "5", "0"])
+            assert exit_code == 1 and b"BackupNotFoundError" in errors
+            assert send(["unknown"])[0] == 2
+
+            # forwarded by the command line
+            monkeypatch.setattr(sys, "argv", ["bak", "cat", "0", "0"])
+            backup.main()
+            assert capsysbinary.readouterr().out == b"first version\n"
+        finally:
+            assert server.send_command(["server", "--stop"]) == 0
+            thread.join()
+
+        assert not os.path.exists(socket_path)
+
+    def test_server_exclusive_commands(self):
+        """Test if exclusive commands wait for every running command, and other commands wait for them."""
+        lock = server._SharedLock()
+        events = []
+        shared_entered = threading.Event()
+        release_shared = threading.Event()
+
+        def run_shared():
+            with lock.shared():
+                shared_entered.set()
+                release_shared.wait(5)
+                events.append("shared")
+
+        def run_exclusive():
+            with lock.exclusive():
+                events.append("exclusive")
+
+        threads = [threading.Thread(target=run_shared)]
+        threads[0].start()
+        assert shared_entered.wait(5)
+        threads.append(threading.Thread(target=run_exclusive))
+        threads[1].start()
+        threads[1].join(0.1)
+        assert events == []  # still waiting for the shared command
+
+        release_shared.set()
+        for thread in threads:
+            thread.join()
+        assert events == ["shared", "exclusive"]
+
+    def test_concurrent_backups(self, backup_data_dir, tmp_path):
+        """Test if backups created by several processes at once get their own backup indexes and don't lose any metadata."""
+        workers, count = 4, 6
+
+        # one shared file with a backup to be reworded by each worker
+        shared_path = str(tmp_path / "shared.txt")
+        for i in range(workers * count):
+            with open(shared_path, "a") as file:
+                file.write(f"version {i}\n")
+            backup.create_global_backup(shared_path)
+        shared_timestamps = backup.list_file_backups(0)
+
+        paths = [str(tmp_path / f"{worker}.txt") for worker in range(workers)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(concurrent_backups_worker, backup_data_dir, paths[worker], shared_timestamps[worker * count : (worker + 1) * count], worker) for worker in range(workers)]
+            for future in futures:
+                future.result()
+
+        tracked_files = backup.list_tracked_files()
+        assert sorted(file["index"] for file in tracked_files) == list(range(workers + 1))
+        assert sorted(file["path"] for file in tracked_files[1:]) == sorted(paths)
+
+        for file in tracked_files[1:]:
+            worker = paths.index(file["path"])
+            backup_list = backup.list_file_backups(file["index"])
+            assert [backup.get_backup_message(file["index"], timestamp) for timestamp in backup_list] == [f"{worker} {i}" for i in range(count)]
+        for i, timestamp in enumerate(shared_timestamps):
+            assert backup.get_backup_message(0, timestamp) == f"{i // count} {i % count}"
+
+        assert all(report["ok"] for report in backup.verify_all_global_backups())
+
+    def test_async_api(self, backup_data_dir, tmp_path):
+        """Test if the asynchronous functions run backups concurrently, respect the concurrency limit and drop calls cancelled while waiting for their turn."""
+        paths = [str(tmp_path / f"{i}.txt") for i in range(3)]
+        for i, path in enumerate(paths):
+            with open(path, "wb") as file:
+                file.write(random.Random(i).randbytes(200_000))
+
+        async def run():
+            await asyncio.gather(*(aio.acreate_global_backup(path, "first") for path in paths))
+            tracked_files = await aio.alist_tracked_files()
+            assert sorted(file["path"] for file in tracked_files) == sorted(paths)
+
+            index = next(file["index"] for file in tracked_files if file["path"] == paths[0])
+            timestamp = (await aio.alist_file_backups(index))[0]
+            assert await aio.aget_backup_message(index, timestamp) == "first"
+            assert b"".join([block async for block in aio.aiter_global_backup(index, timestamp, block_size=4096)]) == random.Random(0).randbytes(200_000)
+
+            # with a single slot, the second backup waits for the first one and is dropped when cancelled
+            default_executor = aio._get_executor()
+            aio.configure(max_concurrency=1)
+            assert default_executor._shutdown
+            for path in paths[:2]:
+                with open(path, "ab") as file:
+                    file.write(b"second version")
+            first = asyncio.create_task(aio.acreate_global_backup(paths[0]))
+            second = asyncio.create_task(aio.acreate_global_backup(paths[1]))
+            await asyncio.sleep(0)
+            second.cancel()
+            await first
+            with pytest.raises(asyncio.CancelledError):
+                await second
+            return index
+
+        try:
+            index = asyncio.run(run())
+
+            # calls also work from a process pool
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                aio.configure(executor)
+                assert asyncio.run(aio.averify_global_backups(index))["ok"]
+
+                # executors that weren't created here are left running
+                aio.configure()
+                assert executor.submit(int).result() == 0
+        finally:
+            aio.configure()
+
+        assert len(backup.list_file_backups(index)) == 2
+        assert len(backup.list_file_backups(next(file["index"] for file in backup.list_tracked_files() if file["path"] == paths[1]))) == 1
+
+    def test_repositories(self, backup_data_dir, tmp_path):
+        """Test if several repositories can be used from different threads at once and if their cached metadata follows changes made elsewhere."""
+        repositories = [backup.Repository(str(tmp_path / f"repository {i}")) for i in range(2)]
+        paths = [str(tmp_path / f"{i}.txt") for i in range(2)]
+
+        def create_backups(repository, path):
+            for version in range(3):
+                with open(path, "w") as file:
+                    file.write(f"{path} version {version}\n")
+                repository.create(path, f"version {version}")
+
+        threads = [threading.Thread(target=create_backups, args=arguments) for arguments in zip(repositories, paths)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the default backup directory isn't touched
+        assert backup.list_tracked_files() == []
+        for repository, path in zip(repositories, paths):
+            assert repository.list_tracked_files() == [{"index": 0, "path": path}]
+            timestamps = repository.list_backups(0)
+            assert [repository.get_message(0, timestamp) for timestamp in timestamps] == [f"version {version}" for version in range(3)]
+
+        # changes made through another instance are seen through the cache
+        timestamps = repositories[0].list_backups(0)
+        assert repositories[0].metadata_cache
+        backup.Repository(repositories[0].root).reword(0, timestamps[0], "reworded")
+        assert repositories[0].get_message(0, timestamps[0]) == "reworded"
+
+        repositories[0].restore(0, timestamps[0])
+        with open(paths[0]) as file:
+            assert file.read() == f"{paths[0]} version 0\n"
+        output = io.BytesIO()
+        repositories[0].cat(0, timestamps[1], output)
+        assert output.getvalue() == f"{paths[0]} version 1\n".encode()
+
+        old_root = repositories[1].root
+        repositories[1].migrate(str(tmp_path / "moved"))
+        assert not os.path.exists(old_root)
+        assert len(repositories[1].list_backups(0)) == 3
+
+    def test_storage_backends(self, backup_data_dir, tmp_path):
+        """Test if backups pushed to an object store only send what changed, and if pulling them into another directory brings every version back."""
+        store = LocalObjectStore()
+        threading.Thread(target=store.serve_forever, daemon=True).start()
+        try:
+            remote = storage.ObjectStoreBackend(store.url, workers=3, chunk_size=1024)
+
+            # small objects are sent in chunks by a bounded amount of connections
+            remote.put_many((f"objects/{i}", str(i).encode() * 100) for i in range(50))
+            assert store.connections <= 3
+            assert remote.get_many([f"objects/{i}" for i in range(50)]) == {f"objects/{i}": str(i).encode() * 100 for i in range(50)}
+            assert remote.get_range("objects/12", 150, 10) == b"1212121212"
+            assert len(remote.list("objects/")) == 50
+            remote.delete("objects/0")
+            with pytest.raises(FileNotFoundError):
+                remote.get("objects/0")
+
+            # backends must implement every basic operation
+            with pytest.raises(TypeError):
+                storage.StorageBackend()
+
+            file_path = str(tmp_path / "tracked.txt")
+            versions = []
+            for i in range(3):
+                content = f"version {i}\n".encode() * 20
+                with open(file_path, "wb") as file:
+                    file.write(content)
+                backup.create_global_backup(file_path, f"message {i}")
+                versions.append(content)
+
+            report = backup.push_global_backups(remote)
+            assert report["copied"] > 0
+            assert backup.push_global_backups(remote)["copied"] == 0
+            backup.create_backup_message(0, backup.list_file_backups(0)[0], "reworded")
+            assert backup.push_global_backups(remote)["copied"] == 1
+
+            # pull everything into another backup directory
+            repository = backup.Repository(str(tmp_path / "pulled"))
+            with repository.activate():
+                backup.pull_global_backups(store.url)
+                assert backup.verify_global_backups(0)["ok"]
+
+            timestamps = repository.list_backups(0)
+            assert repository.get_message(0, timestamps[0]) == "reworded"
+            for timestamp, content in zip(timestamps, versions):
+                output = io.BytesIO()
+                repository.cat(0, timestamp, output)
+                assert output.getvalue() == content
+        finally:
+            store.shutdown()
+            store.server_close()
+
+    def test_metadata_journal(self, backup_data_dir, tmp_path, monkeypatch):
+        """Test if backups interrupted before or after being saved to the journal are undone or finished, and if the journal is compacted."""
+        file_path = str(tmp_path / "tracked.txt")
+        backups_dir = os.path.join(backup_data_dir, "0")
+        for content in (b"first\n", b"second\n"):
+            with open(file_path, "wb") as file:
+                file.write(content)
+            backup.create_global_backup(file_path, content.decode().strip())
+
+        # changes are only on the journal until it's compacted
+        first, second = backup.list_file_backups(0)
+        assert backup.JSONManager(os.path.join(backups_dir, "messages.json"), {}).read() == {}
+        assert backup.get_backup_message(0, second) == "second"
+
+        append_journal = backup._append_journal
+
+        def crash_after_append(record):
+            append_journal(record)
+            raise KeyboardInterrupt
+
+        def crash_before_append(record):
+            raise KeyboardInterrupt
+
+        # interrupted right after being saved to the journal, finished once the backup folder is locked again
+        with open(file_path, "wb") as file:
+            file.write(b"third\n")
+        monkeypatch.setattr(backup, "_append_journal", crash_after_append)
+        with pytest.raises(KeyboardInterrupt):
+            backup.create_global_backup(file_path, "third")
+        monkeypatch.setattr(backup, "_append_journal", append_journal)
+        assert backup.list_file_backups(0) == [first, second]
+
+        backup.create_backup_message(0, first, "reworded")
+        third = backup.list_file_backups(0)[-1]
+        assert backup.get_backup_message(0, third) == "third"
+        with open(os.path.join(backups_dir, "head"), "rb") as head_file:
+            assert head_file.read() == b"third\n"
+        assert backup._get_current_timestamp(0) == third
+
+        # interrupted before being saved to the journal, undone once the backup folder is locked again
+        with open(file_path, "wb") as file:
+            file.write(b"fourth\n")
+        monkeypatch.setattr(backup, "_append_journal", crash_before_append)
+        with pytest.raises(KeyboardInterrupt):
+            backup.create_global_backup(file_path, "fourth")
+        monkeypatch.setattr(backup, "_append_journal", append_journal)
+        backup.restore_global_backup(0, second, unsaved_changes_ok=True)
+        assert not os.path.exists(os.path.join(backups_dir, "pending"))
+        assert backup.list_file_backups(0) == [first, second, third]
+
+        # the journal is saved to the metadata files once it gets too large
+        monkeypatch.setattr(backup, "JOURNAL_MAX_SIZE", 0)
+        backup.create_backup_message(0, third, "compacted")
+        assert backup.JSONManager(os.path.join(backups_dir, "messages.json"), {}).read() == {str(first): "reworded", str(second): "second", str(third): "compacted"}
+        with open(os.path.join(backups_dir, "timestamp")) as timestamp_file:
+            assert int(timestamp_file.read()) == second
+        assert backup.verify_global_backups(0)["ok"]
+
+    def test_journal_group_commit(self, tmp_path, monkeypatch):
+        """Test if records appended at the same time share their syncs."""
+        fsync = os.fsync
+        syncs = []
+
+        def slow_fsync(fd):
+            syncs.append(fd)
+            time.sleep(0.02)
+            fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", slow_fsync)
+        journal = utils.Journal(str(tmp_path / "journal"), str(tmp_path / "journal.lock"))
+        journal.append({"index": 0})
+        syncs.clear()
+
+        threads = [threading.Thread(target=journal.append, args=({"index": i},)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        records, _, _ = journal.read()
+        assert sorted(record["index"] for record in records) == [0] + list(range(16))
+        assert len(syncs) < 8
+
+    def test_journal_torn_write(self, backup_data_dir, tmp_path):
+        """Test if records appended after one cut short by a crash are still read, and if backups made after it keep their metadata."""
+        journal = utils.Journal(str(tmp_path / "journal"), str(tmp_path / "journal.lock"))
+        journal.append({"index": 0})
+        with open(journal.path, "ab") as journal_file:
+            journal_file.write(b'{"op": "create", "ind')
+        journal.append({"index": 1})
+        records, position, _ = journal.read()
+        assert records == [{"index": 0}, {"index": 1}]
+
+        # also when the crash happened on another journal appending to the same file
+        with open(journal.path, "ab") as journal_file:
+            journal_file.write(b'{"ind')
+        utils.Journal(journal.path, str(tmp_path / "journal.lock")).append({"index": 2})
+        assert journal.read(position)[0] == [{"index": 2}]
+
+        file_path = str(tmp_path / "tracked.txt")
+        for version in range(2):
+            with open(file_path, "w") as file:
+                file.write(f"version {version}\n")
+            backup.create_global_backup(file_path, f"version {version}")
+            with open(backup._get_journal().path, "ab") as journal_file:
+                journal_file.write(b'{"op": "create", "ind')
+
+        timestamps = backup.list_file_backups(0)
+        assert [backup.get_backup_message(0, timestamp) for timestamp in timestamps] == ["version 0", "version 1"]
+        assert backup.get_checksum(0, timestamps[1])
+        with open(file_path, "w") as file:
+            file.write("version 2\n")
+        backup.create_global_backup(file_path, "version 2")
+        assert backup.verify_global_backups(0)["ok"]
+
+    def test_metadata_cache(self, backup_data_dir, tmp_path):
+        """Test if repeated lookups reuse the parsed metadata and listings, and if changes made behind the cache's back are still seen."""
+        file_path = str(tmp_path / "file.txt")
+        for version in range(2):
+            with open(file_path, "w") as file:
+                file.write(f"version {version}\n")
+            backup.create_global_backup(file_path, f"version {version}")
+        timestamps = backup.list_file_backups(0)
+
+        # listings of directories that just changed aren't kept, so make it look older
+        changes_dir = os.path.join(backup_data_dir, "0", "changes")
+        os.utime(changes_dir, ns=(time.time_ns() - 10 * backup.LISTING_CACHE_DELAY,) * 2)
+
+        utils.profiler.enable()
+        try:
+            backup.get_backup_message(0, timestamps[0])
+            utils.profiler.counters.clear()
+            for _ in range(3):
+                assert backup.get_backup_message(0, timestamps[0]) == "version 0"
+                assert backup.get_checksum(0, timestamps[1])
+            assert "metadata.reads" not in utils.profiler.counters
+            assert utils.profiler.counters["metadata.cache_hits"] > 0
+
+            # a file tracked by someone else without the cache
+            with open(backup.TRACKED_FILES_LIST_PATH, "r") as tracked_file:
+                tracked = json.load(tracked_file)
+            tracked["list"].append({"index": 1, "path": "/other"})
+            with open(backup.TRACKED_FILES_LIST_PATH, "w") as tracked_file:
+                json.dump(tracked, tracked_file, indent=4)
+            assert backup.get_tracked_path(1) == "/other"
+
+            # a backup added by someone else without the cache
+            shutil.copy(os.path.join(changes_dir, str(timestamps[1])), os.path.join(changes_dir, str(timestamps[1] + 1)))
+            assert backup.list_file_backups(0) == timestamps + [timestamps[1] + 1]
+        finally:
+            utils.profiler.disable()
+
+    def test_metadata_cache_not_shared(self, backup_data_dir, tmp_path):
+        """Test if the cached metadata can't be changed through what the public functions return, and if saving new metadata leaves what was read before as it was."""
+        file_path = str(tmp_path / "file.txt")
+        with open(file_path, "w") as file:
+            file.write("version 0\n")
+        backup.create_global_backup(file_path)
+
+        # changing the returned entries doesn't change the cached ones
+        tracked = backup.list_tracked_files()
+        tracked[0]["path"] = "/changed"
+        tracked.append({"index": 1, "path": "/other"})
+        assert backup.list_tracked_files() == [{"index": 0, "path": os.path.realpath(file_path)}]
+        assert backup.Repository(backup_data_dir).list_tracked_files() == [{"index": 0, "path": os.path.realpath(file_path)}]
+
+        # the content read before a save stays the same
+        cached = backup._read_tracked_list()
+        with open(file_path, "w") as file:
+            file.write("version 1\n")
+        backup.create_global_backup(file_path, mode="binary")
+        other_path = str(tmp_path / "other.txt")
+        with open(other_path, "w") as file:
+            file.write("other\n")
+        backup.create_global_backup(other_path)
+        assert cached == [{"index": 0, "path": os.path.realpath(file_path)}]
+        assert backup.list_tracked_files() == [{"index": 0, "path": os.path.realpath(file_path), "mode": "binary"}, {"index": 1, "path": os.path.realpath(other_path)}]
+
+    @pytest.mark.parametrize("same_file_system", (True, False))
+    def test_migrate_global_backups(self, backup_data_dir, tmp_path, monkeypatch, same_file_system):
+        """Test if migrating renames or copies the backups, and if an interrupted copy is finished by migrating again without copying everything twice."""
+        monkeypatch.setitem(vars(backup), "NEW_DIR_FILE_PATH", str(tmp_path / "new_dir.txt"))
+        monkeypatch.setitem(vars(backup), "MIGRATION_FILE_PATH", str(tmp_path / "migration.json"))
+        monkeypatch.setattr(backup, "_same_file_system", lambda source, target: same_file_system)
+        for i in range(4):
+            file_path = str(tmp_path / f"{i}.txt")
+            for version in range(3):
+                with open(file_path, "w") as file:
+                    file.write(f"{i} version {version}\n" * 100)
+                backup.create_global_backup(file_path)
+
+        # the copy fails after a few files
+        copied = []
+        copy_file = backup._copy_file
+
+        def failing_copy_file(source_path, target_path):
+            if len(copied) == 5 and not same_file_system:
+                raise OSError("interrupted")
+            copied.append(source_path)
+            copy_file(source_path, target_path)
+
+        monkeypatch.setattr(backup, "_copy_file", failing_copy_file)
+        new_dir = str(tmp_path / "new" / "backups")
+        if not same_file_system:
+            with pytest.raises(OSError):
+                backup.migrate_global_backups(new_dir, workers=1)
+            with pytest.raises(BackupExceptions.MigrationInProgressError):
+                backup.migrate_global_backups(str(tmp_path / "other"))
+            monkeypatch.delitem(vars(backup), "BACKUP_DATA_DIR")
+            with pytest.raises(BackupExceptions.MigrationInProgressError):
+                backup._get_path("BACKUP_DATA_DIR")
+            assert os.path.exists(backup_data_dir)
+            assert not os.path.exists(tmp_path / "new_dir.txt")
+            copied.append(None)
+
+        report = backup.migrate_global_backups(new_dir, workers=1)
+        assert report["renamed"] == same_file_system
+        assert not os.path.exists(backup_data_dir)
+        assert not os.path.exists(tmp_path / "migration.json")
+        with open(tmp_path / "new_dir.txt") as new_dir_file:
+            assert new_dir_file.read() == new_dir
+
+        # the files copied before the interruption were only copied once
+        assert len(copied) == len(set(copied))
+
+        # the backups are used from the new directory
+        monkeypatch.setitem(vars(backup), "TRACKED_FILES_LIST_PATH", os.path.join(new_dir, "tracked.json"))
+        monkeypatch.setitem(vars(backup), "BACKUP_DATA_DIR", new_dir)
+        assert len(backup.list_tracked_files()) == 4
+        assert all(report["ok"] for report in backup.verify_all_global_backups())
+
+    @pytest.mark.parametrize("same_file_system", (True, False))
+    def test_create_during_migrate(self, backup_data_dir, tmp_path, monkeypatch, same_file_system):
+        """Test if backups created while migrating either end up in the new directory or fail with `MigrationInProgressError`, and if nothing writes to the old directory afterwards."""
+        monkeypatch.setitem(vars(backup), "NEW_DIR_FILE_PATH", str(tmp_path / "new_dir.txt"))
+        monkeypatch.setitem(vars(backup), "MIGRATION_FILE_PATH", str(tmp_path / "migration.json"))
+        monkeypatch.setattr(backup, "_same_file_system", lambda source, target: same_file_system)
+
+        # slow the move down so the backups are created while it runs
+        copy_file = backup._copy_file
+        move_directory = backup._move_directory
+
+        def slow_copy_file(source_path, target_path):
+            time.sleep(0.005)
+            copy_file(source_path, target_path)
+
+        def slow_move_directory(*args):
+            time.sleep(0.1)
+            return move_directory(*args)
+
+        monkeypatch.setattr(backup, "_copy_file", slow_copy_file)
+        monkeypatch.setattr(backup, "_move_directory", slow_move_directory)
+
+        file_paths = [str(tmp_path / f"{i}.txt") for i in range(4)]
+        for file_path in file_paths:
+            with open(file_path, "w") as file:
+                file.write("version 0\n")
+            backup.create_global_backup(file_path)
+
+        # create backups of every file until the migration is over
+        created = {file_path: 1 for file_path in file_paths}
+        failed = []
+        migrated = threading.Event()
+
+        def create_backups(file_path):
+            version = 1
+            while not migrated.is_set() or version < 5:
+                with open(file_path, "w") as file:
+                    file.write(f"version {version}\n")
+                version += 1
+                try:
+                    backup.create_global_backup(file_path)
+                except BackupExceptions.MigrationInProgressError:
+                    failed.append(file_path)
+                else:
+                    created[file_path] += 1
+
+        new_dir = str(tmp_path / "new" / "backups")
+        with concurrent.futures.ThreadPoolExecutor(len(file_paths)) as executor:
+            futures = [executor.submit(create_backups, file_path) for file_path in file_paths]
+            time.sleep(0.05)
+            try:
+                backup.migrate_global_backups(new_dir, workers=1)
+            finally:
+                migrated.set()
+            for future in futures:
+                future.result()
+
+        # every backup that was created is in the new directory, and the old one wasn't written to again
+        assert not os.path.exists(backup_data_dir)
+        monkeypatch.setitem(vars(backup), "TRACKED_FILES_LIST_PATH", os.path.join(new_dir, "tracked.json"))
+        monkeypatch.setitem(vars(backup), "BACKUP_DATA_DIR", new_dir)
+        assert len(backup.list_tracked_files()) == len(file_paths)
+        for entry in backup.list_tracked_files():
+            assert len(backup.list_file_backups(entry["index"])) == created[entry["path"]]
+        assert all(report["ok"] for report in backup.verify_all_global_backups())
+
+        # a process still using the old directory can't write to it
+        monkeypatch.setitem(vars(backup), "TRACKED_FILES_LIST_PATH", os.path.join(backup_data_dir, "tracked.json"))
+        monkeypatch.setitem(vars(backup), "BACKUP_DATA_DIR", backup_data_dir)
+        with pytest.raises(BackupExceptions.MigrationInProgressError):
+            backup.create_global_backup(file_paths[0])
+        assert not os.path.exists(backup_data_dir)
+
+    @pytest.mark.parametrize("same_file_system", (True, False))
+    def test_create_during_repository_migrate(self, tmp_path, monkeypatch, same_file_system):
+        """Test if backups created on a repository while it's migrated end up in its new directory or fail with `MigrationInProgressError`, the same as `test_create_during_migrate`."""
+        monkeypatch.setattr(backup, "_same_file_system", lambda source, target: same_file_system)
+        copy_file = backup._copy_file
+
+        def slow_copy_file(source_path, target_path):
+            time.sleep(0.005)
+            copy_file(source_path, target_path)
+
+        monkeypatch.setattr(backup, "_copy_file", slow_copy_file)
+
+        repository = backup.Repository(str(tmp_path / "repository"))
+        old_root = repository.root
+        file_paths = [str(tmp_path / f"{i}.txt") for i in range(3)]
+        for file_path in file_paths:
+            with open(file_path, "w") as file:
+                file.write("version 0\n")
+            repository.create(file_path)
+
+        created = {file_path: 1 for file_path in file_paths}
+        migrated = threading.Event()
+
+        def create_backups(file_path):
+            version = 1
+            while not migrated.is_set() or version < 5:
+                with open(file_path, "w") as file:
+                    file.write(f"version {version}\n")
+                version += 1
+                try:
+                    repository.create(file_path)
+                except BackupExceptions.MigrationInProgressError:
+                    pass
+                else:
+                    created[file_path] += 1
+
+        with concurrent.futures.ThreadPoolExecutor(len(file_paths)) as executor:
+            futures = [executor.submit(create_backups, file_path) for file_path in file_paths]
+            time.sleep(0.05)
+            try:
+                repository.migrate(str(tmp_path / "moved"), workers=1)
+            finally:
+                migrated.set()
+            for future in futures:
+                future.result()
+
+        assert not os.path.exists(old_root)
+        assert len(repository.list_tracked_files()) == len(file_paths)
+        for entry in repository.list_tracked_files():
+            assert len(repository.list_backups(entry["index"])) == created[entry["path"]]
+        with repository.activate():
+            assert all(report["ok"] for report in backup.verify_all_global_backups())
@@ -1,14 +1,72 @@
-import datetime
-import json
+import importlib
+import threading
+import time
+import sys
 import os
 
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+
+def lazy_import(name: str):
+    """Import a module that's only actually loaded when one of its attributes is first used.
+
+    Modules that were already imported are returned as they are.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return _LazyModule(name)
+
+
+class _LazyModule:
+    """Stand-in for a module that imports it when one of its attributes is first used, see `lazy_import`.
+
+    The module is imported normally (and only once) while holding a lock, so it can be first used by several threads at the same time.
+    `importlib.util.LazyLoader` isn't used since threads using a module while another one is loading it may find it half loaded.
+    """
+
+    _lock = threading.RLock()  # reentrant, since loading a module may use other lazy modules
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+
+        return getattr(module, attribute)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}>"
+
+
+json = lazy_import("json")
+
 
 # TODO: refactor this to work exclusively with properties and be more intuitive to use
 class JSONManager:
-    """A helper class to manage writes and reads to json files more easily."""
+    """A helper class to manage writes and reads to json files more easily.
+
+    When given a `cache` dict, the parsed content is kept there and reused by every manager sharing it for as long as the modification time, size and inode of the file stay the same.
+    Cached content is shared between reads, so it must never be changed in place, new content is saved instead.
+    """
 
-    def __init__(self, json_path: str, default_value: dict | list):
+    def __init__(self, json_path: str, default_value: dict | list, cache: dict | None = None):
         self.path = json_path
+        self.cache = cache
 
         # read content from the file if it already exists
         if os.path.exists(json_path):
@@ -19,73 +77,379 @@ class JSONManager:
             self.content = self.save(default_value)
 
     def read(self):
-        with open(self.path, "r", encoding="utf8") as file:
-            self.content = json.loads(file.read())
+        # reuse the cached content if the file didn't change since it was cached
+        if self.cache is not None:
+            key = get_file_key(self.path)
+            cached = self.cache.get(self.path)
+            if cached is not None and cached[0] == key:
+                profiler.count("metadata.cache_hits")
+                self.content = cached[1]
+                return self.content
 
-        return self.content
+        profiler.count("metadata.reads")
+        with profiler.span("metadata.read", path=self.path):
+            with open(self.path, "r", encoding="utf8") as file:
+                self.content = json.loads(file.read())
+
+        if self.cache is not None:
+            self.cache[self.path] = (key, self.content)
 
-    def save(self, content: dict | list):
-        with open(self.path, "w", encoding="utf8") as file:
-            self.content = content
-            file.write(json.dumps(self.content, indent=2))
+        return self.content
 
+    def save(self, content: dict | list, fsync: bool = False):
+        profiler.count("metadata.writes")
+        with profiler.span("metadata.write", path=self.path):
+            # write to a temporary file first so the json file is replaced at once and never read half written
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf8") as file:
+                self.content = content
+                file.write(json.dumps(self.content, indent=2))
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
 
-def date_from_ms(timestamp: int):
-    """Convert a ms unix timestamp to a date time object."""
-    return datetime.datetime.fromtimestamp(timestamp // 1000000000)
+            # the key is taken from the temporary file, since the json file itself may be replaced again by someone else right after
+            if self.cache is not None:
+                self.cache[self.path] = (get_file_key(temp_path), self.content)
+            os.replace(temp_path, self.path)
 
 
-def get_tracked_path(backup_index: int):
-    """Get the path of the tracked file with a corresponding backup index.
+def get_file_key(path: str) -> tuple[int, int, int]:
+    """Get the modification time, size and inode of a file or directory, which change whenever it's replaced or written to."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
 
-    Arguments
-    ---------
-    backup_index: int
-        The backup index of the tracked file whose path need to be retrieved.
 
-    Returns
-    -------
-    str
-        A string containing the path of the track file.
+class FileLock:
+    """An exclusive lock shared by every thread and process using the same lock file, held while inside a `with` block.
 
-    Raises
-    ------
-    BackupNotFoundError
-        If the given backup index doesn't correspond to any tracked file.
+    Locks are reentrant within a thread, so functions holding a lock can call other functions that take the same one.
+    Locking is advisory (it only excludes other `FileLock`s) and does nothing where `fcntl` isn't available.
     """
-    from backup import list_tracked_files, BackupExceptions
 
-    # return the path of the tracked file if the given backup index exists or raise exception if not
-    tracked_list = list_tracked_files()
-    for file in tracked_list:
-        if file["index"] == backup_index:
-            return file["path"]
+    _held = threading.local()  # the open lock file and depth of every lock held by the current thread
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        held = self._held.__dict__.setdefault("locks", {})
+        if self.path not in held:
+            file = open(self.path, "ab")
+            if fcntl is not None:
+                profiler.count("lock.acquires")
+                with profiler.span("lock.wait", path=self.path):
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            held[self.path] = [file, 0]
 
-    raise BackupExceptions.BackupNotFoundError(f"Backup with index '{backup_index}' does not exist.")
+        held[self.path][1] += 1
+        return self
 
+    def __exit__(self, *exc_info):
+        held = self._held.locks
+        held[self.path][1] -= 1
+        if not held[self.path][1]:
+            # closing the file releases the lock
+            held.pop(self.path)[0].close()
 
-def timestamp_exists(backup_index: int, timestamp: int):
-    """Check if a backup with the given timestamp exists for the specified file index.
+        return False
+
+
+class Journal:
+    """An append-only file of json records, shared by every thread and process using the same path.
+
+    Each record is appended as a single line with a single write while holding `lock`, so records are never interleaved.
+    A record cut short by a crash is ignored when reading, and the next record appended starts on a new line after it, so it isn't lost along with it.
+    When several threads append at the same time, the first one to sync the file syncs every record written so far, so they all share the cost of a single `os.fsync` ("group commit").
+
+    The first line of the file holds an id that changes every time the journal is emptied by `reset`, so readers can tell new records apart from old ones at the same offset.
 
     Parameters
     ----------
-    backup_index: int
-        The backup index of the file that's suposed to contain the timestamp.
+    path: str
+        The path of the journal file.
+
+    lock_path: str
+        The path of the lock file used for appending and resetting the journal (see `FileLock`).
+    """
+
+    def __init__(self, path: str, lock_path: str):
+        self.path = path
+        self.lock = FileLock(lock_path)
+        self._fd = None
+        self._condition = threading.Condition()
+        self._written = 0  # how many records this instance wrote
+        self._synced = 0  # how many of those are known to be synced
+        self._syncing = False
+
+    def append(self, record: dict, sync: bool = True) -> None:
+        """Append a record, waiting for it to be synced to disk if `sync` is True."""
+        line = (json.dumps(record) + "\n").encode()
+        with self.lock:
+            fd = self._open()
+
+            # end a record cut short by a crash, so this one isn't read as part of it
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                line = b"\n" + line
+            os.write(fd, line)
+            with self._condition:
+                self._written += 1
+                sequence = self._written
+
+        profiler.count("journal.appends")
+        if sync:
+            self._sync(sequence)
+
+    def read(self, position: tuple[int, int] | None = None) -> tuple[list[dict], tuple[int, int], bool]:
+        """Read the records appended after `position`, which is returned by a previous read.
+
+        Returns
+        -------
+        tuple[list[dict], tuple[int, int], bool]
+            The records, the position after the last one and whether the journal was reset since `position`, in which case every record is read from the start instead.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                header = file.readline()
+                if not header.endswith(b"\n"):
+                    return [], (0, 0), position is not None
+                journal_id = json.loads(header)["journal"]
+
+                reset = position is None or position[0] != journal_id
+                if not reset:
+                    file.seek(position[1])
+                content = file.read()
+                offset = file.tell()
+        except FileNotFoundError:
+            return [], (0, 0), position is not None
+
+        # ignore a record cut short at the end, and any damaged one before it
+        records = []
+        lines = content.split(b"\n")
+        offset -= len(lines[-1])
+        for line in lines[:-1]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+
+        return records, (journal_id, offset), reset
+
+    def reset(self) -> None:
+        """Remove every record, which must be done while holding `lock` after everything in them is saved elsewhere."""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write((json.dumps({"journal": time.time_ns()}) + "\n").encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
 
-    timestamp: int
-        The timestamp expected.
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
 
-    Raises
-    ------
-    TimestampNotFound
-        If the timestamp is not found within the given backup index.
+    def _open(self) -> int:
+        """Get the descriptor of the journal file while holding `lock`, reopening it if the journal was reset by someone else since it was opened."""
+        if self._fd is not None:
+            try:
+                if os.fstat(self._fd).st_ino == os.stat(self.path).st_ino:
+                    return self._fd
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+            self._fd = None
 
-    BackupNotFoundError
-        If the given backup index doesn't corespond to any of the tracked files.
+        if not os.path.exists(self.path):
+            self.reset()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        return self._fd
+
+    def _sync(self, sequence: int) -> None:
+        """Wait until the record with the given sequence number is synced, syncing it along with every record written before it unless another thread already is."""
+        with self._condition:
+            while self._synced < sequence:
+                if self._syncing:
+                    self._condition.wait()
+                    continue
+
+                # sync every record written so far, letting other threads append in the meantime
+                self._syncing = True
+                target = self._written
+                self._condition.release()
+                try:
+                    # the descriptor is duplicated since it may be replaced by another thread while syncing
+                    with self.lock:
+                        fd = os.dup(self._open())
+                    try:
+                        with profiler.span("journal.fsync"):
+                            os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                    self._condition.notify_all()
+                self._synced = max(self._synced, target)
+                profiler.count("journal.fsyncs")
+
+
+class _NullSpan:
+    """The span returned by `Profiler.span` while profiling is disabled, which does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+class _Span:
+    """A timed section of code recorded by a `Profiler`, see `Profiler.span`."""
+
+    def __init__(self, profiler: "Profiler", name: str, attributes: dict):
+        self.profiler = profiler
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        # spans opened while this one is running become its children
+        stack = self.profiler._get_stack()
+        self.parent = stack[-1].id if stack else None
+        self.id = self.profiler._new_id()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.profiler._get_stack().pop()
+
+        record = {
+            "type": "span",
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "thread": threading.current_thread().name,
+            "start": self.start - self.profiler.started,
+            "seconds": seconds,
+            "max_rss_bytes": get_peak_memory(),
+        }
+        if exc_info[0] is not None:
+            record["error"] = exc_info[0].__name__
+        record["attributes"] = self.attributes
+        self.profiler._add_record(record)
+        return False
+
+    def set(self, **attributes) -> None:
+        """Add attributes to the span, such as the amount of bytes it processed."""
+        self.attributes.update(attributes)
+
+
+class Profiler:
+    """Collects nested timing spans and counters of the operations being profiled.
+
+    Profiling is disabled by default, in which case `span` always returns the same span that does nothing and `count` returns right away, so instrumented code runs at almost full speed.
+    Every span also samples the peak memory usage of the process when it ends (see `get_peak_memory`).
     """
-    from backup import list_file_backups, BackupExceptions
 
-    # check if the given backup exists
-    backup_list = list_file_backups(backup_index)  # implicitly check if this backup index is being used
-    if timestamp not in backup_list:
-        raise BackupExceptions.TimestampNotFound(f"A backup with timestamp '{timestamp}' does not exist for the file '{get_tracked_path(backup_index)}'")
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        self.records = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_id = 0
+
+    def enable(self) -> None:
+        """Start recording spans and counters, discarding the ones recorded before."""
+        self.records = []
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording spans and counters, keeping the ones already recorded."""
+        self.enabled = False
+
+    def span(self, name: str, **attributes) -> _Span | _NullSpan:
+        """Get a context manager that records how long the code within it takes to run.
+
+        Spans opened while another span of the same thread is running are recorded as its children.
+
+        Parameters
+        ----------
+        name: str
+            The name of the span, such as "diff" or "compress".
+
+        **attributes
+            Extra information stored with the span, more can be added with its `set` method.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+
+        return _Span(self, name, attributes)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add an amount to a counter, such as the amount of bytes compressed."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def export(self, file_path: str) -> None:
+        """Save every span and counter recorded to a file in the json lines format, one record per line.
+
+        Spans are written in the order they ended, so children come before their parents, and counters are written last.
+        """
+        with open(file_path, "w", encoding="utf8") as file:
+            for record in self.records:
+                file.write(json.dumps(record) + "\n")
+            for name, value in sorted(self.counters.items()):
+                file.write(json.dumps({"type": "counter", "name": name, "value": value}) + "\n")
+            file.write(json.dumps({"type": "memory", "max_rss_bytes": get_peak_memory()}) + "\n")
+
+    def _get_stack(self) -> list[_Span]:
+        """Get the spans currently running on this thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        return self._local.stack
+
+    def _new_id(self) -> int:
+        with self._lock:
+            self._last_id += 1
+            return self._last_id
+
+    def _add_record(self, record: dict) -> None:
+        with self._lock:
+            self.records.append(record)
+
+
+NULL_SPAN = _NullSpan()
+
+# the profiler used by every instrumented operation
+profiler = Profiler()
+
+
+def get_peak_memory() -> int | None:
+    """Get the peak resident memory of the process in bytes, or None if it can't be measured on this platform."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # linux reports it in kilobytes
+
+
+def date_from_ms(timestamp: int):
+    """Convert a ms unix timestamp to a date time object."""
+    import datetime
+
+    return datetime.datetime.fromtimestamp(timestamp // 1000000000)
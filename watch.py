@@ -0,0 +1,274 @@
+import threading
+import ctypes
+import select
+import struct
+import time
+import sys
+import os
+
+from backup import BackupExceptions, create_global_backup, list_tracked_files, _get_path
+from utils import lazy_import
+
+concurrent_futures = lazy_import("concurrent.futures")
+
+
+# settings for watching tracked files
+DEBOUNCE = 1.0  # how many seconds a file must go without changes before being backed up
+MAX_DELAY = 30.0  # files that never stop changing are still backed up at least this often (in seconds)
+WORKERS = 2  # how many files can be backed up at the same time
+POLL_INTERVAL = 1.0  # how often files are checked for changes when inotify isn't available (in seconds)
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # the fixed size part of an inotify event: watch descriptor, mask, cookie and name length
+
+
+class InotifyWatcher:
+    """Watch files for changes using the inotify API of Linux, called straight from libc through ctypes.
+
+    The directory of each file is watched instead of the file itself, so files replaced by editors that write a temporary file and rename it over the original keep being watched.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        # a pipe used to interrupt `wait` from other threads
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+
+        self.paths = set()
+        self.directories = {}  # the directory of every watch descriptor
+        self.closed = False
+
+    def set_paths(self, paths: set[str]) -> None:
+        """Set the paths of the files being watched."""
+        self.paths = set(paths)
+
+        # watch the directories that aren't watched yet, directories that don't exist are tried again on the next call
+        watched = set(self.directories.values())
+        for directory in {os.path.dirname(path) for path in self.paths} - watched:
+            descriptor = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if descriptor >= 0:
+                self.directories[descriptor] = directory
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        """Wait until any of the watched files changes or `timeout` seconds pass (forever if None), returning the paths of the files that changed."""
+        readable, _, _ = select.select([self.fd, self._wake_read], [], [], timeout)
+        if self._wake_read in readable:
+            while _read_available(self._wake_read):
+                pass
+
+        changed = set()
+        while data := _read_available(self.fd):
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    # some events were lost, so every file might have changed
+                    changed.update(self.paths)
+                elif mask & IN_IGNORED:
+                    # the directory was removed, it will be watched again if it comes back when the paths are set again
+                    self.directories.pop(descriptor, None)
+                elif descriptor in self.directories:
+                    path = os.path.join(self.directories[descriptor], os.fsdecode(name))
+                    if path in self.paths:
+                        changed.add(path)
+
+        return changed
+
+    def wake(self) -> None:
+        """Make a running `wait` return right away."""
+        if not self.closed:
+            os.write(self._wake_write, b"\0")
+
+    def close(self) -> None:
+        self.closed = True
+        for fd in (self.fd, self._wake_read, self._wake_write):
+            os.close(fd)
+
+
+class PollingWatcher:
+    """Watch files for changes by checking their modification time, size and inode every `interval` seconds, used where inotify isn't available."""
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self.paths = set()
+        self.states = {}
+        self._wake_event = threading.Event()
+
+    def set_paths(self, paths: set[str]) -> None:
+        """Set the paths of the files being watched."""
+        self.paths = set(paths)
+        self.states = {path: self.states[path] if path in self.states else _get_state(path) for path in self.paths}
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        """Wait until any of the watched files changes or `timeout` seconds pass (forever if None), returning the paths of the files that changed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, max(deadline - time.monotonic(), 0))
+            woken = self._wake_event.wait(remaining)
+            self._wake_event.clear()
+
+            changed = set()
+            for path in self.paths:
+                state = _get_state(path)
+                if state != self.states[path]:
+                    self.states[path] = state
+                    changed.add(path)
+
+            if changed or woken or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def wake(self) -> None:
+        """Make a running `wait` return right away."""
+        self._wake_event.set()
+
+    def close(self) -> None:
+        pass
+
+
+class BackupWatcher:
+    """Back up tracked files (see `create_global_backup`) as soon as they change, until stopped.
+
+    Changes are coalesced, so a file is only backed up once it goes `debounce` seconds without changing (or every `MAX_DELAY` seconds, if it never does).
+    Backups run on a pool of up to `workers` threads and each file is only backed up by one of them at a time.
+    The list of tracked files is watched as well, so newly tracked files start being watched right away.
+
+    Parameters
+    ----------
+    debounce: float, optional
+        How many seconds a file must go without changes before being backed up.
+
+    workers: int, optional
+        How many files can be backed up at the same time.
+
+    polling: bool, optional
+        Whether to check files for changes every `poll_interval` seconds instead of using inotify, which is also done when inotify isn't available.
+
+    poll_interval: float, optional
+        How often files are checked for changes when polling.
+
+    on_backup: Callable[[str, Exception | None], None], None, optional
+        Called from the worker thread after a file is backed up, with the path of the file and the exception raised while backing it up, if any.
+        Files that didn't change since their last backup are ignored.
+        If omited, backups that fail are reported on stderr.
+    """
+
+    def __init__(self, debounce: float = DEBOUNCE, workers: int = WORKERS, polling: bool = False, poll_interval: float = POLL_INTERVAL, on_backup=None):
+        self.debounce = debounce
+        self.workers = workers
+        self.on_backup = on_backup
+
+        self.watcher = None
+        if not polling and sys.platform.startswith("linux"):
+            try:
+                self.watcher = InotifyWatcher()
+            except (OSError, AttributeError):
+                pass
+        if self.watcher is None:
+            self.watcher = PollingWatcher(poll_interval)
+
+        self.tracked_files_list_path = _get_path("TRACKED_FILES_LIST_PATH")
+        self._stopped = False
+
+    def run(self) -> None:
+        """Watch and back up files until `stop` is called."""
+        pending = {}  # the time when each changed file is due to be backed up
+        first_changes = {}  # the time of the first change of each file since its last backup
+        running = {}  # the backup running for each file
+
+        self._refresh()
+        try:
+            with concurrent_futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while not self._stopped:
+                    # wait for changes until the next backup is due
+                    waiting = [due for path, due in pending.items() if path not in running]
+                    timeout = max(min(waiting) - time.monotonic(), 0) if waiting else None
+                    changed = self.watcher.wait(timeout)
+
+                    now = time.monotonic()
+                    for path in changed:
+                        if path == self.tracked_files_list_path:
+                            self._refresh()
+                            continue
+
+                        # postpone the backup until the file stops changing
+                        first_change = first_changes.setdefault(path, now)
+                        pending[path] = min(now + self.debounce, first_change + MAX_DELAY)
+
+                    # forget finished backups
+                    for path in [path for path, future in running.items() if future.done()]:
+                        del running[path]
+
+                    # start the backups that are due, unless the same file is still being backed up
+                    for path, due in list(pending.items()):
+                        if due <= now and path not in running:
+                            del pending[path]
+                            del first_changes[path]
+                            running[path] = executor.submit(self._backup, path)
+                            running[path].add_done_callback(lambda _: self.watcher.wake())
+        finally:
+            self.watcher.close()
+
+    def stop(self) -> None:
+        """Make `run` return after waiting for the backups already running, changes that weren't backed up yet are dropped."""
+        self._stopped = True
+        self.watcher.wake()
+
+    def _refresh(self) -> None:
+        """Watch every tracked file and the list of tracked files itself."""
+        self.watcher.set_paths({file["path"] for file in list_tracked_files()} | {self.tracked_files_list_path})
+
+    def _backup(self, path: str) -> None:
+        try:
+            create_global_backup(path)
+        except BackupExceptions.NoChangesException:
+            return
+        except Exception as e:
+            if self.on_backup is not None:
+                self.on_backup(path, e)
+            else:
+                import traceback
+
+                print(f"Could not back up file '{path}':", file=sys.stderr)
+                traceback.print_exc()
+            return
+
+        if self.on_backup is not None:
+            self.on_backup(path, None)
+
+
+def _read_available(fd: int) -> bytes:
+    """Read everything available on a non blocking file descriptor, or nothing if there's nothing to read."""
+    try:
+        return os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return b""
+
+
+def _get_state(path: str) -> tuple[int, int, int] | None:
+    """Get the modification time, size and inode of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino